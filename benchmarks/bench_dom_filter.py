@@ -0,0 +1,104 @@
+"""
+Benchmark the streaming DOM filter against the original BeautifulSoup implementation
+of filter_dom_by_whitelist on large generated SPA-like pages.
+
+Usage (from the repository root):
+    python benchmarks/bench_dom_filter.py [--sizes 1 5 20] [--repeat 3]
+"""
+
+import argparse
+import os
+import random
+import sys
+import time
+import tracemalloc
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "codebase"))
+
+from bs4 import BeautifulSoup
+from dom_filter import filter_dom, etree
+
+WHITELIST = ["button", "text box", "link"]
+
+
+def legacy_filter_dom_by_whitelist(dom_tree, whitelist):
+    """The original utils.filter_dom_by_whitelist, kept here as the baseline"""
+    filtered_elements = []
+    for tag in dom_tree.find_all(True):
+        for item in whitelist:
+            item_lower = item.lower()
+            if item_lower == "button" and tag.name == "button":
+                filtered_elements.append(tag)
+            elif item_lower == "text box" and tag.name == "input":
+                if tag.get("type") in ["text", "search", None]:
+                    filtered_elements.append(tag)
+            elif item_lower == "link" and tag.name == "a":
+                filtered_elements.append(tag)
+    return "\n".join(str(el) for el in filtered_elements)
+
+
+def make_fixture_page(target_mb, seed=0):
+    """Deeply nested SPA-style markup: cards, inline SVG icons, inline styles and data attributes"""
+    rng = random.Random(seed)
+    svg_path = "M" + " ".join(f"{rng.randint(0, 24)}.{rng.randint(0, 99)}" for _ in range(60)) + "Z"
+    parts = ["<!DOCTYPE html><html><head><title>Fixture</title>",
+             "<script>window.__STATE__ = {" + ",".join(f'"k{i}": {i}' for i in range(2000)) + "};</script>",
+             "</head><body><div id=\"root\">"]
+    size = sum(len(p) for p in parts)
+    card = 0
+    while size < target_mb * 1024 * 1024:
+        card += 1
+        chunk = (
+            f'<div class="card card-{card % 17}" data-reactid="{card}" style="padding:{card % 9}px;margin:2px">'
+            f'<div class="row"><span class="title">Result {card}</span>'
+            f'<svg viewBox="0 0 24 24" width="16" height="16"><path d="{svg_path}"></path></svg></div>'
+            f'<a href="/item/{card}?ref=list&amp;pos={card}" class="link" aria-label="Open result {card}">'
+            f'<span>Open</span></a>'
+            f'<button type="button" class="btn btn-primary" data-testid="select-{card}">Select'
+            f'<svg viewBox="0 0 24 24"><path d="{svg_path}"></path></svg></button>'
+            f'<input type="{"text" if card % 3 else "checkbox"}" name="note-{card}" placeholder="Note">'
+            f'<p>{"Lorem ipsum dolor sit amet. " * (card % 5 + 1)}</p></div>'
+        )
+        parts.append(chunk)
+        size += len(chunk)
+    parts.append("</div></body></html>")
+    return "".join(parts)
+
+
+def measure(fn):
+    tracemalloc.start()
+    start = time.perf_counter()
+    result = fn()
+    elapsed = time.perf_counter() - start
+    _, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    return result, elapsed, peak
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--sizes", type=float, nargs="+", default=[1, 5], help="Fixture sizes in MB")
+    parser.add_argument("--repeat", type=int, default=3)
+    args = parser.parse_args()
+
+    engines = [("legacy (bs4 html.parser)",
+                lambda html: legacy_filter_dom_by_whitelist(BeautifulSoup(html, "html.parser"), WHITELIST))]
+    if etree is not None:
+        engines.append(("streaming (lxml)", lambda html: filter_dom(html, WHITELIST)))
+    engines.append(("streaming (stdlib)", lambda html: filter_dom(html, WHITELIST, use_lxml=False)))
+
+    print(f"{'size':>8}  {'engine':<26} {'best time':>10} {'peak mem':>10} {'matches':>8}")
+    for size_mb in args.sizes:
+        html = make_fixture_page(size_mb)
+        for name, engine in engines:
+            best, peak, matches = None, 0, 0
+            for _ in range(args.repeat):
+                output, elapsed, run_peak = measure(lambda: engine(html))
+                best = elapsed if best is None else min(best, elapsed)
+                peak = max(peak, run_peak)
+                matches = output.count("\n") + 1 if output else 0
+            print(f"{size_mb:>6.1f}MB  {name:<26} {best:>9.3f}s {peak / 1e6:>8.1f}MB {matches:>8}")
+
+
+if __name__ == "__main__":
+    main()
@@ -1,21 +1,19 @@
 # answering_llm.py
 import base64, yaml, json, os, time 
 from pathlib import Path  
-from openai import AzureOpenAI  
 from mimetypes import guess_type  
 from utils import log_interaction, log_token_usage
+from image_prep import image_content_parts
+from llm_gateway import load_prompt, chat_completion, achat_completion
   
 def load_config(path="../config.yaml"):  
     with open(path, "r") as file:  
         return yaml.safe_load(file)  
   
-def evaluate_task_completion(screenshot_path):  
-    # Load config  
-    config = load_config()  
-    problem_id = config['problem_id']  
-    question = config['intent']  
-    planner_conf = config['planner']  
-  
+ANSWER_REQUEST = {"model": "gpt-4o", "temperature": 0.7, "max_tokens": 8000}
+
+
+def build_answer_messages(question, screenshot_path):  
     # Verify and load screenshot  
     if not Path(screenshot_path).exists():  
         raise FileNotFoundError(f"Screenshot not found at: {screenshot_path}")  
@@ -25,18 +23,9 @@ def evaluate_task_completion(screenshot_path):
     if mime_type is None:  
         raise ValueError("Could not determine MIME type of screenshot.")  
       
-    base64_image = base64.b64encode(screenshot_bytes).decode("utf-8")  
-    start_time = time.time()
-    # Load system prompt  
-    with open("../prompts/answering_instructions.txt", "r") as f:  
-        system_prompt = f.read()  
-  
-    # Initialize Azure OpenAI client  
-    client = AzureOpenAI(  
-        azure_endpoint=planner_conf['azure_endpoint'],  
-        api_key=planner_conf['api_key'],  
-        api_version=planner_conf['api_version']  
-    )  
+    image_parts = image_content_parts(screenshot_bytes, "answering", mime_type)  
+    # Load system prompt (cached by the LLM gateway)  
+    system_prompt = load_prompt("answering_instructions.txt")  
   
     # Compose messages  
     messages = [  
@@ -45,7 +34,7 @@ def evaluate_task_completion(screenshot_path):
             "role": "user",  
             "content": [  
                 {"type": "text", "text": question},  
-                {"type": "image_url", "image_url": {"url": f"data:{mime_type};base64,{base64_image}"}}  
+                *image_parts  
             ]  
         }  
     ]  
@@ -57,16 +46,10 @@ def evaluate_task_completion(screenshot_path):
     print(f"\nUser Prompt (Question):\n{question}")
     print(f"[Image included: base64 encoded screenshot from {screenshot_path}]")
     print(f"{'='*60}\n")
+    return messages
 
-    print("📤 Sending request to Azure OpenAI...")  
-    # Send request to model  
-    response = client.chat.completions.create(  
-        model="gpt-4o",  
-        messages=messages,  
-        temperature=0.7,  
-        max_tokens=8000  
-    )  
-    
+
+def interpret_answer(response, problem_id, question, screenshot_path, start_time):
     log_token_usage(response, problem_id, "evaluate_task_completion")
     # Calculate time taken
     elapsed_time = time.time() - start_time
@@ -94,4 +77,27 @@ def evaluate_task_completion(screenshot_path):
         return "Failure", response_text
     else:  
         raise ValueError("Unexpected response format from LLM.")  
+
+
+def evaluate_task_completion(screenshot_path):  
+    # Load config  
+    config = load_config()  
+    problem_id = config['problem_id']  
+    question = config['intent']  
+    planner_conf = config['planner']  
   
+    start_time = time.time()
+    messages = build_answer_messages(question, screenshot_path)
+
+    print("📤 Sending request to Azure OpenAI...")  
+    # Send request to model  
+    response = chat_completion("answering", planner_conf, messages=messages, **ANSWER_REQUEST)
+    return interpret_answer(response, problem_id, question, screenshot_path, start_time)
+
+
+async def aevaluate_task_completion(screenshot_path, config):
+    """asyncio counterpart of evaluate_task_completion; takes the problem's config instead of reading config.yaml"""
+    start_time = time.time()
+    messages = build_answer_messages(config['intent'], screenshot_path)
+    response = await achat_completion("answering", config['planner'], messages=messages, **ANSWER_REQUEST)
+    return interpret_answer(response, config['problem_id'], config['intent'], screenshot_path, start_time)
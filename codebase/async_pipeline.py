@@ -0,0 +1,306 @@
+# async_pipeline.py
+"""
+asyncio version of execute_pipeline_until_success for running several problems at once.
+LLM calls use the gateway's native async clients and generated scripts run under the
+script_executor watchdog on worker threads. Captures stay on the sync Playwright stack (settle probe, routing, HAR, selector
+precomputation): each runs on one of max_browsers capture threads, each with its own warm pool.
+
+Problems are isolated by problem_id: their own screenshot and capture bundle prefix
+(../responses/{problem_id}_last_update, passed to scripts as TESSARA_CAPTURE_PREFIX), HAR
+archive, state file, screenshot index and DOM snapshots. Semaphores bound the number of
+problems, LLM calls and script runs in flight.
+
+    python async_pipeline.py      # runs every entry of `problems:` in config.yaml (or the single problem)
+"""
+import asyncio, contextvars, json, os
+from concurrent.futures import ThreadPoolExecutor
+from utils import log_interaction, capture_page, load_capture_bundle, save_script_to_file, load_config, load_state, save_state, reset_state
+from planner import agenerate_plan, parse_plan
+from scripter import agenerate_script
+from answering_llm import aevaluate_task_completion
+from browser_pool import configure_browser_pool, shutdown_browser_pool
+from page_settle import configure_page_settle
+from image_prep import configure_image_budget
+from request_routing import configure_request_routing
+from har_archive import configure_har, HAR_ENV
+from screenshot_dedupe import ScreenshotIndex
+from dom_snapshots import DomSnapshotStore
+from selector_cache import configure_selector_cache
+from llm_gateway import configure_llm_gateway, aclose_clients
+from llm_cache import configure_llm_cache
+from script_runtime import CAPTURE_PREFIX_ENV
+from checkpoints import configure_checkpoints, reset_checkpoints, CHECKPOINT_DIR_ENV
+from step_events import StepEventListener, STEP_EVENTS_ENV, print_event
+from process_tracker import get_tracker, reap_run, end_scope
+from script_executor import configure_script_execution, abort_env, ExecutionMonitor, run_streamed
+from main import (wrap_script_with_exit_handling, script_env, check_script_result, save_aborted_state, build_planner_input,
+                  prepare_scripter_dom, extract_successful_steps_from_script,
+                  parse_last_successful_step_from_output, save_final_outputs)
+import run_metrics
+
+DEFAULT_ASYNC_CONFIG = {
+    "max_problems": 4,       # Problems running at the same time
+    "max_llm_calls": 8,      # Planner, scripter and answering requests in flight
+    "max_browsers": 2,       # Capture threads, each with its own warm browser pool
+    "max_scripts": 2,        # Generated scripts running at the same time (each launches a browser)
+    "max_iterations": 8,
+}
+
+
+class PipelineScheduler:
+    """Bounds the work in flight across problems. Create it inside the running event loop."""
+
+    def __init__(self, conf=None):
+        self.conf = dict(DEFAULT_ASYNC_CONFIG)
+        self.conf.update(conf or {})
+        self.problems = asyncio.Semaphore(self.conf["max_problems"])
+        self.llm = asyncio.Semaphore(self.conf["max_llm_calls"])
+        self.scripts = asyncio.Semaphore(self.conf["max_scripts"])
+        # One single-thread executor per browser slot: sync Playwright (and the browser pool)
+        # is bound to the thread that started it, so a slot always captures on the same thread
+        self._capture_slots = asyncio.Queue()
+        self._executors = [ThreadPoolExecutor(max_workers=1, thread_name_prefix=f"capture-{i}")
+                           for i in range(self.conf["max_browsers"])]
+        for executor in self._executors:
+            self._capture_slots.put_nowait(executor)
+
+    async def capture(self, func, *args):
+        """Run a sync Playwright capture on a free browser thread, in the caller's context (HAR override)"""
+        executor = await self._capture_slots.get()
+        try:
+            ctx = contextvars.copy_context()
+            return await asyncio.get_running_loop().run_in_executor(executor, ctx.run, func, *args)
+        finally:
+            self._capture_slots.put_nowait(executor)
+
+    async def shutdown(self):
+        loop = asyncio.get_running_loop()
+        for executor in self._executors:
+            await loop.run_in_executor(executor, shutdown_browser_pool)
+            executor.shutdown(wait=True)
+        await aclose_clients()
+
+
+def problem_configs(config):
+    """One config per entry of `problems:` (each overrides problem_id, start_url, intent, ...)"""
+    problems = config.get('problems') or [{}]
+    base = {key: value for key, value in config.items() if key != 'problems'}
+    return [{**base, **problem} for problem in problems]
+
+
+def capture_prefix(problem_id):
+    return f"../responses/{problem_id}_last_update"
+
+
+async def arun_script_and_check(script_path, problem_id, env, scheduler):
+    """asyncio counterpart of main.run_script_and_check"""
+    reset_checkpoints(env[CHECKPOINT_DIR_ENV])
+    reset_state(problem_id)
+    async with scheduler.scripts:
+        # The watchdog (first failed step with abort_on_failure, deadlines, memory limit) is the sync
+        # executor's, run on a worker thread so the event loop keeps serving other problems
+        monitor = ExecutionMonitor(on_event=print_event)
+        with StepEventListener(on_event=monitor.on_event) as listener:
+            result = await asyncio.to_thread(run_streamed, ["python", script_path],
+                                             abort_env({**env, STEP_EVENTS_ENV: listener.address}, "kill"),
+                                             monitor=monitor, tracker=get_tracker(problem_id))
+        await asyncio.to_thread(reap_run, problem_id)
+    events = listener.summary()
+    run_metrics.absorb_file(env[run_metrics.METRICS_FILE_ENV])
+    log_interaction(problem_id, "script_execution", {key: result.get(key) for key in
+                    ("ended", "elapsed", "peak_rss_mb", "cpu_seconds", "mode")})
+    if result["ended"] != "normal" and events is not None:
+        save_aborted_state(problem_id, events)
+    return check_script_result(problem_id, result["stdout"], result["stderr"], result["returncode"], events=events)
+
+
+async def arun_pipeline(start_url, screenshot_path, script_path, config, problem_id, scheduler, env,
+                        failure_reason=None, iteration_num=0, screenshot_index=None, dom_snapshots=None):
+    """
+    One iteration for one problem (see main.run_pipeline).
+    Returns: (success: bool, last_successful_step: int, output: str, parsed_plan: list, script_code: str)
+    """
+    bundle = None
+    if os.path.exists(screenshot_path) and screenshot_path.endswith("last_update.png"):
+        bundle = load_capture_bundle(os.path.splitext(screenshot_path)[0])
+    if bundle is None:
+        bundle = await scheduler.capture(capture_page, start_url, screenshot_path, config.get('playwright_user_data_dir'))
+        screenshot_path = bundle["screenshot_path"]
+    print(f"[{problem_id}] Capture of {bundle['final_url']} (timing {bundle['timing']})")
+    dom_tree = bundle["html"]
+    selectors = bundle.get("selectors")
+    with open(screenshot_path, "rb") as f:
+        screenshot_bytes = f.read()
+
+    nlp_input = await asyncio.to_thread(build_planner_input, config, failure_reason, dom_tree, selectors,
+                                        dom_snapshots, problem_id)
+
+    cached_plan, plan_fingerprint = None, None
+    if screenshot_index is not None:
+        cached_plan, plan_fingerprint, _ = screenshot_index.lookup("planner", nlp_input, screenshot_bytes)
+    if cached_plan is not None:
+        plan_text, parsed_plan = cached_plan, parse_plan(cached_plan)
+        log_interaction(problem_id, "planner_response_reused", plan_text)
+    else:
+        print(f"[{problem_id}] Iteration {iteration_num + 1}: calling planner")
+        async with scheduler.llm:
+            plan_text, parsed_plan = await agenerate_plan(nlp_input, screenshot_bytes, config['planner'], problem_id)
+        if screenshot_index is not None:
+            screenshot_index.store("planner", nlp_input, plan_fingerprint, plan_text)
+
+    if not parsed_plan:
+        error_msg = f"Failed to parse plan. Planner response: {plan_text[:500]}"
+        print(f"[{problem_id}] [ERROR] {error_msg}")
+        return False, 0, error_msg, [], ""
+
+    filtered_dom = await asyncio.to_thread(prepare_scripter_dom, config, dom_tree, selectors, parsed_plan,
+                                           dom_snapshots, problem_id)
+
+    print(f"[{problem_id}] Iteration {iteration_num + 1}: calling scripter")
+    try:
+        async with scheduler.llm:
+            script_code = await agenerate_script(parsed_plan, filtered_dom, start_url, screenshot_bytes,
+                                                 config['scripter'], problem_id)
+        save_script_to_file(wrap_script_with_exit_handling(script_code), path=script_path)
+    except Exception as e:
+        print(f"[{problem_id}] [ERROR] {e}")
+        return False, 0, str(e), parsed_plan, ""
+
+    try:
+        success, last_step, output = await arun_script_and_check(script_path, problem_id, env, scheduler)
+        return success, last_step, output, parsed_plan, script_code
+    except Exception as e:
+        print(f"[{problem_id}] An error occurred while executing the script: {e}")
+        return False, 0, str(e), parsed_plan, script_code
+
+
+async def execute_pipeline_async(config, problem_id, scheduler):
+    """asyncio counterpart of main.execute_pipeline_until_success for one problem"""
+    har_conf = configure_har(config.get('har'), problem_id, export=False)
+    prefix = capture_prefix(problem_id)
+    env = script_env(problem_id, {HAR_ENV: json.dumps(har_conf), CAPTURE_PREFIX_ENV: prefix})
+    screenshot_index = ScreenshotIndex(config.get('screenshot_dedupe'))
+    dom_snapshots = DomSnapshotStore(config.get('dom_snapshots'))
+    screenshot_path = f"../responses/{problem_id}_screenshot.png"
+    script_path = f"../responses/{problem_id}_playwright_script.py"
+    last_update_path = prefix + ".png"
+    max_iterations = scheduler.conf["max_iterations"]
+
+    iteration_count = 0
+    success = False
+    previous_llm_result = None
+    last_successful_step = 0
+    all_successful_steps = []
+    all_successful_scripts = []
+
+    while not success and iteration_count < max_iterations:
+        print(f"[{problem_id}] Starting iteration {iteration_count + 1}/{max_iterations}")
+        if iteration_count > 0 and os.path.exists(last_update_path):
+            screenshot_path = last_update_path
+
+        failure_reason = None
+        if iteration_count > 0:
+            if previous_llm_result:
+                failure_reason = f"[Task Evaluation Feedback from Previous Iteration]:\n{previous_llm_result}\n\n[Last Successful Step]: {last_successful_step}"
+            elif last_successful_step > 0:
+                failure_reason = f"[Script Execution]: Failed at step {last_successful_step + 1}. Last successful step: {last_successful_step}"
+
+        iteration_success, step_reached, output, parsed_plan, script_code = await arun_pipeline(
+            config['start_url'], screenshot_path, script_path, config, problem_id, scheduler, env,
+            failure_reason=failure_reason, iteration_num=iteration_count,
+            screenshot_index=screenshot_index, dom_snapshots=dom_snapshots
+        )
+        if not iteration_success and output and not load_state(problem_id).get("step_events"):
+            step_reached = max(step_reached, parse_last_successful_step_from_output(output))
+
+        if step_reached > last_successful_step:
+            last_successful_step = step_reached
+            all_successful_steps.extend(parsed_plan[:step_reached])
+            successful_script = extract_successful_steps_from_script(script_code, step_reached)
+            if successful_script:
+                all_successful_scripts.append(successful_script)
+            try:
+                save_state(problem_id, last_successful_step=last_successful_step)
+            except Exception as e:
+                print(f"[{problem_id}] [WARNING] Failed to save last successful step: {e}")
+
+        if iteration_success:
+            if os.path.exists(last_update_path):
+                screenshot_path = last_update_path
+            else:
+                latest_url = load_state(problem_id).get("recovery_url", config['start_url'])
+                try:
+                    bundle = await scheduler.capture(capture_page, latest_url, screenshot_path,
+                                                     config.get('playwright_user_data_dir'))
+                    screenshot_path = bundle["screenshot_path"]
+                except Exception as e:
+                    print(f"[{problem_id}] Failed to capture fresh screenshot, reusing previous one: {e}")
+
+            with open(screenshot_path, "rb") as f:
+                eval_screenshot_bytes = f.read()
+            cached_eval, eval_fingerprint, _ = screenshot_index.lookup("answering", config['intent'], eval_screenshot_bytes)
+            if cached_eval is not None:
+                llm_result, llm_output = cached_eval
+            else:
+                print(f"[{problem_id}] Iteration {iteration_count + 1}: calling answering LLM")
+                async with scheduler.llm:
+                    llm_result, llm_output = await aevaluate_task_completion(screenshot_path, config)
+                screenshot_index.store("answering", config['intent'], eval_fingerprint, (llm_result, llm_output))
+
+            if "Success" in llm_result:
+                print(f"[{problem_id}] Answering LLM reported success")
+                success = True
+            elif "Failure" in llm_result:
+                previous_llm_result = llm_output
+                screenshot_path = last_update_path if os.path.exists(last_update_path) else screenshot_path
+            else:
+                previous_llm_result = None
+        else:
+            print(f"[{problem_id}] Plan execution failed. Last successful step: {last_successful_step}")
+        iteration_count += 1
+
+    save_final_outputs(problem_id, all_successful_steps, all_successful_scripts, iteration_count)
+    await asyncio.to_thread(end_scope, problem_id, problem_id)
+    if not success:
+        print(f"[{problem_id}] ❌ Task failed after {max_iterations} iterations")
+    return {"problem_id": problem_id, "success": success, "iterations": iteration_count,
+            "last_successful_step": last_successful_step}
+
+
+async def run_problems(config):
+    """Run every problem in config concurrently. Returns one result dict per problem."""
+    configure_browser_pool(config.get('browser_pool'))
+    configure_page_settle(config.get('page_settle'))
+    configure_image_budget(config.get('image_budget'))
+    configure_request_routing(config.get('request_routing'))
+    configure_selector_cache(config.get('selector_cache'))
+    configure_checkpoints(config.get('checkpoints'))
+    configure_llm_gateway(config.get('llm_gateway'))
+    configure_llm_cache(config.get('llm_cache'))
+    configure_script_execution(config.get('script_execution'))
+    run_metrics.reset()
+    scheduler = PipelineScheduler(config.get('async_pipeline'))
+
+    async def run_one(problem_conf):
+        problem_id = problem_conf['problem_id']
+        async with scheduler.problems:
+            try:
+                return await execute_pipeline_async(problem_conf, problem_id, scheduler)
+            except Exception as e:
+                print(f"[{problem_id}] Pipeline error occurred: {e}")
+                return {"problem_id": problem_id, "success": False, "error": str(e)}
+
+    try:
+        results = await asyncio.gather(*(run_one(conf) for conf in problem_configs(config)))
+    finally:
+        await scheduler.shutdown()
+    # Counters are process-wide, so they cover the whole batch
+    metrics = run_metrics.snapshot()
+    for result in results:
+        log_interaction(result["problem_id"], "batch_run_metrics", metrics)
+    return results
+
+
+if __name__ == "__main__":
+    for result in asyncio.run(run_problems(load_config())):
+        print(f"[RESULT] {result}")
@@ -0,0 +1,222 @@
+# browser_pool.py
+import atexit, threading, time
+from contextlib import contextmanager
+from playwright.sync_api import sync_playwright
+from process_tracker import tracking_new_children
+
+DEFAULT_POOL_CONFIG = {
+    "enabled": True,
+    "size": 1,                    # Number of warm browsers kept open
+    "max_uses_per_browser": 25,   # Recycle a browser after this many contexts
+    "headless": True,
+    "channel": "chrome",
+    "launch_args": [],
+}
+
+_pool_config = dict(DEFAULT_POOL_CONFIG)
+_local = threading.local()
+_pools = []
+_pools_lock = threading.Lock()
+
+
+class PooledBrowser:
+    """A launched browser plus the bookkeeping the pool needs to recycle it"""
+
+    def __init__(self, browser):
+        self.browser = browser
+        self.uses = 0
+        self.in_use = False
+        self.launched_at = time.time()
+
+    def is_healthy(self):
+        try:
+            return self.browser.is_connected()
+        except Exception:
+            return False
+
+    def close(self):
+        try:
+            self.browser.close()
+        except Exception:
+            pass
+
+
+class BrowserPool:
+    """
+    Keeps a number of warm Chromium instances and hands out fresh, isolated
+    BrowserContexts. Playwright's sync API is bound to the thread that started
+    it, so each pool must only be used from the thread that created it.
+    """
+
+    def __init__(self, size=1, max_uses_per_browser=25, headless=True, channel="chrome", launch_args=None):
+        self.size = max(1, int(size))
+        self.max_uses_per_browser = max(1, int(max_uses_per_browser))
+        self.headless = headless
+        self.channel = channel
+        self.launch_args = list(launch_args or [])
+        self.owner_thread = threading.get_ident()
+        self.stats = {"launches": 0, "recycled": 0, "unhealthy": 0, "contexts": 0}
+        self._playwright = None
+        self._browsers = []
+
+    def start(self):
+        if self._playwright is None:
+            with tracking_new_children("browser_pool"):
+                self._playwright = sync_playwright().start()
+        while len(self._browsers) < self.size:
+            self._browsers.append(self._launch())
+        return self
+
+    def _launch(self):
+        launch_kwargs = {"headless": self.headless, "args": self.launch_args}
+        if self.channel:
+            launch_kwargs["channel"] = self.channel
+        with tracking_new_children("browser_pool"):
+            browser = self._playwright.chromium.launch(**launch_kwargs)
+        self.stats["launches"] += 1
+        return PooledBrowser(browser)
+
+    def _replace(self, pooled, reason):
+        pooled.close()
+        self.stats[reason] += 1
+        self._browsers.remove(pooled)
+        fresh = self._launch()
+        self._browsers.append(fresh)
+        return fresh
+
+    def _acquire(self):
+        if self._playwright is None:
+            self.start()
+        # Health check every idle browser before handing one out
+        for pooled in list(self._browsers):
+            if not pooled.in_use and not pooled.is_healthy():
+                print(f"[WARNING] Pooled browser disconnected after {pooled.uses} uses, relaunching")
+                self._replace(pooled, "unhealthy")
+        idle = [b for b in self._browsers if not b.in_use]
+        if not idle:
+            # Nested acquisition on a fully busy pool: grow temporarily
+            pooled = self._launch()
+            self._browsers.append(pooled)
+        else:
+            pooled = min(idle, key=lambda b: b.uses)
+        pooled.in_use = True
+        pooled.uses += 1
+        return pooled
+
+    def _release(self, pooled):
+        pooled.in_use = False
+        if pooled not in self._browsers:
+            return
+        if pooled.uses >= self.max_uses_per_browser or not pooled.is_healthy():
+            self._replace(pooled, "recycled")
+        elif len(self._browsers) > self.size:
+            pooled.close()
+            self._browsers.remove(pooled)
+
+    @contextmanager
+    def context(self, **context_kwargs):
+        """Yield a fresh BrowserContext from a warm browser; the context is always closed afterwards"""
+        if threading.get_ident() != self.owner_thread:
+            raise RuntimeError("BrowserPool used from a thread other than the one that created it")
+        pooled = self._acquire()
+        context = None
+        try:
+            context = pooled.browser.new_context(**context_kwargs)
+            self.stats["contexts"] += 1
+            yield context
+        finally:
+            if context is not None:
+                try:
+                    context.close()
+                except Exception:
+                    pass
+            self._release(pooled)
+
+    def shutdown(self):
+        for pooled in self._browsers:
+            pooled.close()
+        self._browsers = []
+        if self._playwright is not None:
+            try:
+                self._playwright.stop()
+            except Exception:
+                pass
+            self._playwright = None
+
+
+def configure_browser_pool(pool_conf=None):
+    """Apply the `browser_pool` section of config.yaml; takes effect for pools created afterwards"""
+    _pool_config.clear()
+    _pool_config.update(DEFAULT_POOL_CONFIG)
+    _pool_config.update(pool_conf or {})
+
+
+def get_browser_pool():
+    """Return the warm pool owned by the current thread, creating it on first use"""
+    pool = getattr(_local, "pool", None)
+    if pool is None:
+        pool = BrowserPool(
+            size=_pool_config["size"],
+            max_uses_per_browser=_pool_config["max_uses_per_browser"],
+            headless=_pool_config["headless"],
+            channel=_pool_config["channel"],
+            launch_args=_pool_config["launch_args"],
+        ).start()
+        _local.pool = pool
+        with _pools_lock:
+            _pools.append(pool)
+    return pool
+
+
+@contextmanager
+def browser_context(**context_kwargs):
+    """
+    Fresh isolated BrowserContext for a capture. Uses the warm pool when enabled,
+    otherwise falls back to launching a browser for this call only.
+    """
+    if _pool_config.get("enabled", True):
+        with get_browser_pool().context(**context_kwargs) as context:
+            yield context
+        return
+
+    with sync_playwright() as p:
+        launch_kwargs = {"headless": _pool_config["headless"], "args": _pool_config["launch_args"]}
+        if _pool_config["channel"]:
+            launch_kwargs["channel"] = _pool_config["channel"]
+        browser = p.chromium.launch(**launch_kwargs)
+        try:
+            context = browser.new_context(**context_kwargs)
+            try:
+                yield context
+            finally:
+                context.close()
+        finally:
+            browser.close()
+
+
+def shutdown_browser_pool():
+    """Close the current thread's pool; safe to call more than once"""
+    pool = getattr(_local, "pool", None)
+    if pool is None:
+        return
+    _local.pool = None
+    with _pools_lock:
+        if pool in _pools:
+            _pools.remove(pool)
+    print(f"[INFO] Shutting down browser pool (stats: {pool.stats})")
+    pool.shutdown()
+
+
+def _shutdown_at_exit():
+    # Only the owning thread may touch a sync Playwright instance; pools owned by
+    # other threads are torn down with their driver process when the interpreter exits.
+    current = threading.get_ident()
+    with _pools_lock:
+        owned = [p for p in _pools if p.owner_thread == current]
+        for pool in owned:
+            _pools.remove(pool)
+    for pool in owned:
+        pool.shutdown()
+
+
+atexit.register(_shutdown_at_exit)
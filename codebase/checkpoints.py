@@ -0,0 +1,214 @@
+# checkpoints.py
+"""
+Per-step browser checkpoints. Generated scripts call save_checkpoint(page, N) right after step N
+succeeds; the checkpoint stores the context's storage state (cookies, local storage), the URL,
+the scroll position and the values of the page's form fields.
+
+A retry then resumes from the latest checkpoint instead of replaying every step from the start
+URL (see main.suffix_resume_point): the new context starts from the saved storage state, and an
+init script puts the form values and scroll position back once the checkpoint URL has loaded.
+
+Steps are classified while the script runs:
+    commit      - the step sent a first-party POST/PUT/PATCH/DELETE (form submission, order, ...);
+                  replaying it could repeat a side effect
+    restorable  - the page was reached by a GET navigation, so loading its URL again reproduces it
+latest_resumable() never picks a checkpoint that would replay a commit step.
+
+Settings reach generated scripts through TESSARA_CHECKPOINTS; the per-problem directory through
+TESSARA_CHECKPOINT_DIR (see main.script_env).
+"""
+import glob, json, os, shutil, time
+from urllib.parse import urlparse
+
+CHECKPOINTS_ENV = "TESSARA_CHECKPOINTS"
+CHECKPOINT_DIR_ENV = "TESSARA_CHECKPOINT_DIR"
+RESUME_CHECKPOINT_ENV = "TESSARA_RESUME_CHECKPOINT"
+
+DEFAULT_CHECKPOINT_CONFIG = {
+    "enabled": False,
+    "dir": "../responses/checkpoints",
+    "max_form_fields": 200,
+    "commit_methods": ["POST", "PUT", "PATCH", "DELETE"],
+}
+
+# Scroll position and form field values; password and file inputs are never stored
+SNAPSHOT_JS = """
+(maxFields) => {
+    const selectorFor = (el) => {
+        if (el.id) return '#' + CSS.escape(el.id);
+        const tag = el.tagName.toLowerCase();
+        if (el.name) {
+            const byName = `${tag}[name="${CSS.escape(el.name)}"]`;
+            const same = document.querySelectorAll(byName);
+            if (same.length === 1) return byName;
+            if (el.type === 'radio' || el.type === 'checkbox') {
+                return `${byName}[value="${CSS.escape(el.value)}"]`;
+            }
+        }
+        const parts = [];
+        for (let node = el; node && node.nodeType === 1 && node !== document.documentElement; node = node.parentElement) {
+            let part = node.tagName.toLowerCase();
+            const siblings = node.parentElement ? Array.from(node.parentElement.children).filter(s => s.tagName === node.tagName) : [];
+            if (siblings.length > 1) part += `:nth-of-type(${siblings.indexOf(node) + 1})`;
+            parts.unshift(part);
+        }
+        return parts.join(' > ');
+    };
+    const skipped = new Set(['hidden', 'submit', 'button', 'image', 'reset', 'file', 'password']);
+    const forms = [];
+    for (const el of document.querySelectorAll('input, textarea, select')) {
+        if (forms.length >= maxFields) break;
+        if (skipped.has(el.type)) continue;
+        const checkable = el.type === 'checkbox' || el.type === 'radio';
+        if (checkable ? el.checked === el.defaultChecked : el.value === (el.defaultValue ?? '')) continue;
+        forms.push({selector: selectorFor(el), value: el.value, checked: checkable ? el.checked : null});
+    }
+    return {scroll: {x: window.scrollX, y: window.scrollY}, forms};
+}
+"""
+
+# Runs in every document of a resumed context; restores once, on the checkpoint URL
+RESTORE_JS = """
+(checkpoint) => {
+    const apply = () => {
+        if (location.href !== checkpoint.url || sessionStorage.getItem('__tessara_restored')) return;
+        sessionStorage.setItem('__tessara_restored', '1');
+        for (const field of checkpoint.forms) {
+            const el = document.querySelector(field.selector);
+            if (!el) continue;
+            if (field.checked !== null) el.checked = field.checked;
+            else el.value = field.value;
+            el.dispatchEvent(new Event('input', {bubbles: true}));
+            el.dispatchEvent(new Event('change', {bubbles: true}));
+        }
+        window.scrollTo(checkpoint.scroll.x, checkpoint.scroll.y);
+    };
+    if (document.readyState === 'loading') document.addEventListener('DOMContentLoaded', apply, {once: true});
+    else apply();
+}
+"""
+
+# Requests seen by the context hook in this script process
+_activity = {"mutations": 0, "at_last_checkpoint": 0, "navigation_method": None}
+
+
+def configure_checkpoints(checkpoint_conf=None):
+    """Apply the `checkpoints` section of config.yaml and export it to child scripts"""
+    conf = dict(DEFAULT_CHECKPOINT_CONFIG)
+    conf.update(checkpoint_conf or {})
+    os.environ[CHECKPOINTS_ENV] = json.dumps(conf)
+    return conf
+
+
+def load_checkpoint_config():
+    try:
+        conf = json.loads(os.environ.get(CHECKPOINTS_ENV) or "{}")
+    except ValueError:
+        conf = {}
+    merged = dict(DEFAULT_CHECKPOINT_CONFIG)
+    merged.update(conf)
+    return merged
+
+
+def checkpoint_dir(problem_id):
+    return os.path.abspath(os.path.join(load_checkpoint_config()["dir"], problem_id))
+
+
+def _same_site(url, page_url):
+    host, page_host = urlparse(url).hostname or "", urlparse(page_url).hostname or ""
+    return host.split(".")[-2:] == page_host.split(".")[-2:]
+
+
+def track_requests(target):
+    """Context hook: count first-party state-changing requests and remember how the page was reached"""
+    commit_methods = set(load_checkpoint_config()["commit_methods"])
+
+    def on_request(request):
+        frame = request.frame
+        if request.is_navigation_request() and frame.parent_frame is None:
+            _activity["navigation_method"] = request.method
+        if request.method in commit_methods and request.resource_type in ("document", "xhr", "fetch"):
+            if _same_site(request.url, frame.url or request.url):
+                _activity["mutations"] += 1
+
+    target.on("request", on_request)
+
+
+def save_checkpoint(page, step, commit=None):
+    """
+    Save the browser state after a successful step. commit=True/False overrides the automatic
+    classification. No-op unless checkpoints are enabled. Returns the checkpoint path or None.
+    """
+    conf = load_checkpoint_config()
+    directory = os.environ.get(CHECKPOINT_DIR_ENV)
+    if not conf["enabled"] or not directory:
+        return None
+    mutations = _activity["mutations"] - _activity["at_last_checkpoint"]
+    _activity["at_last_checkpoint"] = _activity["mutations"]
+    try:
+        snapshot = page.evaluate(SNAPSHOT_JS, conf["max_form_fields"])
+        checkpoint = {
+            "step": step,
+            "url": page.url,
+            "scroll": snapshot["scroll"],
+            "forms": snapshot["forms"],
+            "storage_state": page.context.storage_state(),
+            "commit": bool(mutations) if commit is None else bool(commit),
+            "restorable": _activity["navigation_method"] in (None, "GET"),
+            "mutating_requests": mutations,
+            "saved_at": time.time(),
+        }
+        os.makedirs(directory, exist_ok=True)
+        path = os.path.join(directory, f"step_{step:03d}.json")
+        with open(path + ".tmp", "w", encoding="utf-8") as f:
+            json.dump(checkpoint, f)
+        os.replace(path + ".tmp", path)
+        return path
+    except Exception as e:
+        print(f"[WARNING] Checkpoint after step {step} not saved: {e}")
+        return None
+
+
+def apply_resume_checkpoint(target):
+    """Context hook: restore form values and scroll position of the checkpoint being resumed from"""
+    path = os.environ.get(RESUME_CHECKPOINT_ENV)
+    if not path or not os.path.exists(path):
+        return
+    with open(path, "r", encoding="utf-8") as f:
+        checkpoint = json.load(f)
+    payload = {key: checkpoint[key] for key in ("url", "scroll", "forms")}
+    target.add_init_script(script=f"({RESTORE_JS})({json.dumps(payload)})")
+
+
+def reset_checkpoints(directory):
+    """Drop the checkpoints of the previous run (each run numbers its steps from 1)"""
+    shutil.rmtree(directory, ignore_errors=True)
+
+
+def list_checkpoints(directory):
+    checkpoints = []
+    for path in sorted(glob.glob(os.path.join(directory, "step_*.json"))):
+        try:
+            with open(path, "r", encoding="utf-8") as f:
+                checkpoint = json.load(f)
+        except (OSError, ValueError):
+            continue
+        checkpoint["path"] = path
+        checkpoints.append(checkpoint)
+    return checkpoints
+
+
+def latest_resumable(checkpoints, max_step):
+    """
+    Latest checkpoint at or before max_step that can be resumed from. Resuming from step s replays
+    steps s+1..max_step, so the search stops at the first step that is a commit point or has no
+    checkpoint (unknown side effects). Returns None when there is no safe checkpoint.
+    """
+    by_step = {checkpoint["step"]: checkpoint for checkpoint in checkpoints}
+    for step in range(max_step, 0, -1):
+        checkpoint = by_step.get(step)
+        if checkpoint is not None and checkpoint["restorable"]:
+            return checkpoint
+        if checkpoint is None or checkpoint["commit"]:
+            return None
+    return None
@@ -0,0 +1,187 @@
+# dom_compact.py
+"""
+Compact DOM representation for the scripter prompt: one line per interactive element with a
+stable element ID, role, accessible name, key attributes and a candidate selector, deduplicated
+and trimmed to a token budget.
+"""
+import hashlib, json, math, re
+from dom_filter import iter_matching_elements
+
+DEFAULT_COMPACTION_CONFIG = {
+    "enabled": True,
+    "token_budget": 4000,
+    "max_name_chars": 80,
+    "max_attr_chars": 60,
+}
+
+KEY_ATTRIBUTES = ["id", "name", "type", "placeholder", "aria-label", "data-testid", "title", "href", "value", "role"]
+
+IMPLICIT_ROLES = {
+    "a": "link",
+    "button": "button",
+    "select": "combobox",
+    "textarea": "textbox",
+    "option": "option",
+    "summary": "button",
+}
+
+INPUT_ROLES = {
+    "search": "searchbox",
+    "checkbox": "checkbox",
+    "radio": "radio",
+    "submit": "button",
+    "button": "button",
+    "reset": "button",
+    "range": "slider",
+    "number": "spinbutton",
+}
+
+# ids like "ember123", ":r5:", "mat-input-12" or long hashes change between page loads
+_GENERATED_ID = re.compile(r"^(ember\d+|:r\w*:|.*\d{3,}.*|[a-f0-9]{8,})$", re.IGNORECASE)
+_CSS_IDENT = re.compile(r"^[A-Za-z_][\w-]*$")
+
+
+def estimate_tokens(text):
+    """Local token estimate (~4 characters per token for English/HTML)"""
+    return int(math.ceil(len(text) / 4.0))
+
+
+def element_role(tag, attrs):
+    if attrs.get("role"):
+        return attrs["role"]
+    if tag == "input":
+        return INPUT_ROLES.get((attrs.get("type") or "text").lower(), "textbox")
+    return IMPLICIT_ROLES.get(tag, tag)
+
+
+def accessible_name(tag, attrs, text):
+    for candidate in (attrs.get("aria-label"), text, attrs.get("title"), attrs.get("placeholder"),
+                      attrs.get("value") if tag in ("input", "button") else None,
+                      attrs.get("alt"), attrs.get("name")):
+        if candidate and candidate.strip():
+            return " ".join(candidate.split())
+    return ""
+
+
+def _quote(value):
+    return value.replace("\\", "\\\\").replace('"', '\\"')
+
+
+def candidate_selector(tag, attrs, name):
+    """Most specific selector we can derive from the element alone (uniqueness is not checked here)"""
+    if attrs.get("data-testid"):
+        return f'[data-testid="{_quote(attrs["data-testid"])}"]'
+    element_id = attrs.get("id")
+    if element_id and not _GENERATED_ID.match(element_id):
+        return f"#{element_id}" if _CSS_IDENT.match(element_id) else f'[id="{_quote(element_id)}"]'
+    if attrs.get("name"):
+        return f'{tag}[name="{_quote(attrs["name"])}"]'
+    if attrs.get("aria-label"):
+        return f'{tag}[aria-label="{_quote(attrs["aria-label"])}"]'
+    if attrs.get("placeholder"):
+        return f'{tag}[placeholder="{_quote(attrs["placeholder"])}"]'
+    if name and tag in ("a", "button"):
+        return f'{tag}:has-text("{_quote(name[:40])}")'
+    if element_id:
+        return f'[id="{_quote(element_id)}"]'
+    classes = (attrs.get("class") or "").split()
+    if classes and _CSS_IDENT.match(classes[0]):
+        return f"{tag}.{classes[0]}"
+    return tag
+
+
+def stable_element_id(tag, attrs, name):
+    """Same element on a re-captured page -> same ID (no positional information)"""
+    key = json.dumps([tag, name, {k: attrs.get(k) for k in KEY_ATTRIBUTES if k != "value"}], sort_keys=True)
+    return "e" + hashlib.sha1(key.encode("utf-8")).hexdigest()[:6]
+
+
+def describe_element(element, conf=None, selectors=None):
+    """Compact record for one MatchedElement; selectors are the in-page validated ones (see selector_cache)"""
+    conf = conf or DEFAULT_COMPACTION_CONFIG
+    name = accessible_name(element.tag, element.attrs, element.text)[:conf["max_name_chars"]]
+    attrs = {}
+    for key in KEY_ATTRIBUTES:
+        value = element.attrs.get(key)
+        if value and key not in ("aria-label",) and not (key == "role" and value == element_role(element.tag, element.attrs)):
+            attrs[key] = " ".join(value.split())[:conf["max_attr_chars"]]
+    record = {
+        "id": stable_element_id(element.tag, element.attrs, name),
+        "tag": element.tag,
+        "role": element_role(element.tag, element.attrs),
+        "name": name,
+        "attrs": attrs,
+        "selector": candidate_selector(element.tag, element.attrs, name),
+    }
+    validated = (selectors or {}).get(record["id"])
+    if validated:
+        record["derived_selector"] = record["selector"]
+        record["selector"] = validated[0]["selector"]
+        record["verified"] = True
+        if len(validated) > 1:
+            record["fallback_selector"] = validated[1]["selector"]
+    return record
+
+
+def format_element_line(record, count=1):
+    attrs = " ".join(f'{k}="{v}"' for k, v in record["attrs"].items())
+    line = f'[{record["id"]}] {record["role"]} "{record["name"]}"'
+    if attrs:
+        line += f" {attrs}"
+    line += f' | selector: {record["selector"]}'
+    if record.get("verified") and count == 1:
+        line += " (unique)"
+        if record.get("fallback_selector"):
+            line += f' | fallback: {record["fallback_selector"]}'
+    if count > 1:
+        line += f" (x{count})"
+    return line
+
+
+def compact_dom(source, whitelist, token_budget=None, conf=None, selectors=None):
+    """
+    Compact the whitelisted elements of a page. Returns (text, stats) where stats has the raw
+    filtered-DOM size, the compact size and how many elements were deduplicated or trimmed.
+    """
+    conf = dict(DEFAULT_COMPACTION_CONFIG, **(conf or {}))
+    token_budget = token_budget or conf["token_budget"]
+    elements = iter_matching_elements(source, whitelist)
+    raw_bytes = sum(len(el.html.encode("utf-8")) + 1 for el in elements)
+
+    records = {}
+    order = []
+    for element in elements:
+        record = describe_element(element, conf, selectors)
+        key = (record["role"], record["name"], record["selector"])
+        if key in records:
+            records[key][1] += 1
+            continue
+        records[key] = [record, 1]
+        order.append(key)
+
+    lines = []
+    used_tokens = 0
+    for key in order:
+        record, count = records[key]
+        line = format_element_line(record, count)
+        line_tokens = estimate_tokens(line) + 1
+        if used_tokens + line_tokens > token_budget:
+            break
+        lines.append(line)
+        used_tokens += line_tokens
+    omitted = len(order) - len(lines)
+    if omitted:
+        lines.append(f"... {omitted} more elements omitted (token budget {token_budget})")
+
+    text = "\n".join(lines)
+    stats = {
+        "elements": len(elements),
+        "unique_elements": len(order),
+        "duplicates_dropped": len(elements) - len(order),
+        "omitted_for_budget": omitted,
+        "raw_bytes": raw_bytes,
+        "compact_bytes": len(text.encode("utf-8")),
+        "estimated_tokens": estimate_tokens(text),
+    }
+    stats["bytes_saved"] = stats["raw_bytes"] - stats["compact_bytes"]
+    return text, stats
@@ -0,0 +1,251 @@
+# dom_filter.py
+"""
+One-pass, streaming DOM filter. The page is fed to a SAX-style parser in chunks (lxml's
+target parser when available, the stdlib HTMLParser otherwise) and only the subtrees of
+matching elements are buffered, so memory stays bounded on multi-megabyte SPA pages.
+Matching uses a precomputed tag -> (category, predicate) dispatch table.
+"""
+import html as html_lib
+from collections import namedtuple
+from functools import lru_cache
+from html.parser import HTMLParser
+
+try:
+    from lxml import etree
+except ImportError:  # lxml is optional; the stdlib parser gives the same results, just slower
+    etree = None
+
+CHUNK_SIZE = 1 << 16
+MAX_TEXT_CHARS = 300
+
+VOID_TAGS = frozenset([
+    "area", "base", "br", "col", "embed", "hr", "img", "input", "link", "meta",
+    "param", "source", "track", "wbr",
+])
+
+
+def _is_text_input(attrs):
+    return attrs.get("type") in ("text", "search", None)
+
+
+INTERACTIVE_ROLES = frozenset([
+    "button", "link", "checkbox", "radio", "combobox", "listbox", "option", "menuitem", "menuitemcheckbox",
+    "menuitemradio", "tab", "switch", "textbox", "searchbox", "slider", "spinbutton", "treeitem", "gridcell",
+])
+
+
+def _is_visible_input(attrs):
+    return (attrs.get("type") or "").lower() != "hidden"
+
+
+def _has_interactive_role(attrs):
+    return (attrs.get("role") or "").lower() in INTERACTIVE_ROLES
+
+
+# Whitelist category -> {tag: predicate(attrs) or None}; "*" rules are checked for every tag
+CATEGORY_RULES = {
+    "button": {"button": None},
+    "text box": {"input": _is_text_input},
+    "link": {"a": None},
+    # Everything a user can interact with (used by the element index)
+    "interactive": {
+        "a": None, "button": None, "input": _is_visible_input, "select": None, "textarea": None,
+        "summary": None, "option": None, "*": _has_interactive_role,
+    },
+}
+
+MatchedElement = namedtuple("MatchedElement", "order tag attrs category html text")
+
+
+@lru_cache(maxsize=64)
+def _build_dispatch(categories):
+    dispatch = {}
+    for category in categories:
+        for tag, predicate in CATEGORY_RULES.get(category, {}).items():
+            dispatch.setdefault(tag, []).append((category, predicate))
+    return dispatch
+
+
+def build_dispatch(whitelist):
+    """Tag -> [(category, predicate)] for the given whitelist (cached per whitelist)"""
+    return _build_dispatch(tuple(sorted({item.lower() for item in whitelist})))
+
+
+def _start_tag_html(tag, attrs, void):
+    parts = [tag]
+    for name, value in attrs.items():
+        value = (value or "").replace("&", "&amp;").replace("<", "&lt;").replace(">", "&gt;").replace('"', "&quot;")
+        parts.append(f'{name}="{value}"')
+    return "<" + " ".join(parts) + ("/>" if void else ">")
+
+
+class _OpenMatch:
+    __slots__ = ("order", "tag", "attrs", "category", "parts", "text")
+
+    def __init__(self, order, tag, attrs, category):
+        self.order = order
+        self.tag = tag
+        self.attrs = attrs
+        self.category = category
+        self.parts = []
+        self.text = []
+
+
+class DomFilterTarget:
+    """Parser target: receives start/end/data events and buffers only matching subtrees"""
+
+    def __init__(self, dispatch, max_matches=None):
+        self.dispatch = dispatch
+        self.max_matches = max_matches
+        self.stack = []          # (tag, [open matches started by this element])
+        self.open_matches = []   # Matches whose subtree is still being read
+        self.results = []
+        self.order = 0
+
+    def _match(self, tag, attrs):
+        rules = self.dispatch.get(tag)
+        wildcard = self.dispatch.get("*")
+        if not rules and not wildcard:
+            return []
+        matched = []
+        for category, predicate in (rules or []):
+            if predicate is None or predicate(attrs):
+                matched.append(category)
+        for category, predicate in (wildcard or []):
+            if category not in matched and predicate(attrs):
+                matched.append(category)
+        return matched
+
+    def start(self, tag, attrib):
+        tag = tag.lower() if isinstance(tag, str) else str(tag)
+        attrs = dict(attrib)
+        void = tag in VOID_TAGS
+        start_html = _start_tag_html(tag, attrs, void)
+        for match in self.open_matches:
+            match.parts.append(start_html)
+
+        started = []
+        if self.max_matches is None or self.order < self.max_matches:
+            for category in self._match(tag, attrs):
+                match = _OpenMatch(self.order, tag, attrs, category)
+                match.parts.append(start_html)
+                self.order += 1
+                started.append(match)
+                self.open_matches.append(match)
+        self.stack.append((tag, started))
+
+    def end(self, tag):
+        tag = tag.lower() if isinstance(tag, str) else str(tag)
+        # Close implicitly-closed elements too (stdlib parser does not balance tags)
+        if not any(open_tag == tag for open_tag, _ in self.stack):
+            return
+        while self.stack:
+            open_tag, started = self.stack.pop()
+            self._close(open_tag, started)
+            if open_tag == tag:
+                break
+
+    def _close(self, tag, started):
+        end_html = "" if tag in VOID_TAGS else f"</{tag}>"
+        for match in self.open_matches:
+            if end_html:
+                match.parts.append(end_html)
+        for match in started:
+            self.open_matches.remove(match)
+            text = " ".join("".join(match.text).split())[:MAX_TEXT_CHARS]
+            self.results.append(MatchedElement(match.order, match.tag, match.attrs, match.category,
+                                               "".join(match.parts), text))
+
+    def data(self, data):
+        if not self.open_matches:
+            return
+        escaped = html_lib.escape(data, quote=False)
+        for match in self.open_matches:
+            match.parts.append(escaped)
+            if len(match.text) < 64:
+                match.text.append(data)
+
+    def comment(self, text):
+        for match in self.open_matches:
+            match.parts.append(f"<!--{text}-->")
+
+    def close(self):
+        while self.stack:
+            open_tag, started = self.stack.pop()
+            self._close(open_tag, started)
+        self.results.sort(key=lambda m: m.order)
+        return self.results
+
+
+class _StdlibAdapter(HTMLParser):
+    """Feeds stdlib HTMLParser events into a DomFilterTarget"""
+
+    def __init__(self, target):
+        super().__init__(convert_charrefs=True)
+        self.target = target
+
+    def handle_starttag(self, tag, attrs):
+        self.target.start(tag, attrs)
+        if tag in VOID_TAGS:
+            self.target.end(tag)
+
+    def handle_startendtag(self, tag, attrs):
+        self.target.start(tag, attrs)
+        self.target.end(tag)
+
+    def handle_endtag(self, tag):
+        if tag not in VOID_TAGS:
+            self.target.end(tag)
+
+    def handle_data(self, data):
+        self.target.data(data)
+
+    def handle_comment(self, data):
+        self.target.comment(data)
+
+
+def _iter_chunks(source):
+    if callable(getattr(source, "read", None)):
+        while True:
+            chunk = source.read(CHUNK_SIZE)
+            if not chunk:
+                return
+            yield chunk
+    else:
+        for start in range(0, len(source), CHUNK_SIZE):
+            yield source[start:start + CHUNK_SIZE]
+
+
+def iter_matching_elements(source, whitelist, max_matches=None, use_lxml=True):
+    """
+    Parse HTML (str, bytes, file object or BeautifulSoup tree) in one pass and return the
+    MatchedElement records for the whitelist categories, in document order.
+    """
+    if not isinstance(source, (str, bytes)) and not callable(getattr(source, "read", None)):
+        source = str(source)  # Already-parsed soup
+    target = DomFilterTarget(build_dispatch(whitelist), max_matches=max_matches)
+
+    if use_lxml and etree is not None:
+        parser = etree.HTMLParser(target=target, recover=True)
+        for chunk in _iter_chunks(source):
+            parser.feed(chunk)
+        return parser.close()
+
+    parser = _StdlibAdapter(target)
+    for chunk in _iter_chunks(source):
+        if isinstance(chunk, bytes):
+            chunk = chunk.decode("utf-8", errors="replace")
+        parser.feed(chunk)
+    parser.close()
+    return target.close()
+
+
+def parse_tree(source):
+    """Full BeautifulSoup tree of a page for CSS queries, built by lxml when it is installed"""
+    from bs4 import BeautifulSoup
+    return BeautifulSoup(source, "lxml" if etree is not None else "html.parser")
+
+
+def filter_dom(source, whitelist, max_matches=None, use_lxml=True):
+    """Outer HTML of every element matching the whitelist, one per line"""
+    return "\n".join(m.html for m in iter_matching_elements(source, whitelist, max_matches, use_lxml))
@@ -0,0 +1,155 @@
+# dom_snapshots.py
+"""
+Per-run store of DOM snapshots. Each capture is reduced to its interactive element records
+(see element_index.interactive_records) and diffed structurally against the previous capture,
+keyed by element identity. In "delta" mode later iterations send the LLMs only what changed
+plus a short summary of the unchanged context.
+"""
+import hashlib
+from collections import Counter, OrderedDict
+from element_index import ElementIndex, interactive_records
+from dom_compact import format_element_line, estimate_tokens
+import run_metrics
+
+DEFAULT_SNAPSHOT_CONFIG = {
+    "mode": "delta",            # full | delta
+    "max_change_ratio": 0.6,    # Above this share of changed elements the full DOM is sent instead
+    "context_k": 2,             # Unchanged elements listed per plan step as context
+    "max_listed_changes": 40,   # Changed elements listed in the planner summary
+    "token_budget": 4000,
+}
+
+
+def element_identity(record):
+    """
+    What makes two captures' elements "the same element". Selectors derived from test IDs,
+    ids, names, labels or placeholders survive text changes; text-only elements fall back
+    to their stable ID. Validated in-page selectors are ignored here (CSS paths are positional).
+    """
+    selector = record.get("derived_selector", record["selector"])
+    if selector != record["tag"] and ":has-text(" not in selector:
+        return (record["tag"], selector)
+    return (record["tag"], record["id"])
+
+
+class DomSnapshot:
+    def __init__(self, html, selectors=None):
+        self.html_hash = hashlib.sha1(html.encode("utf-8", errors="replace")).hexdigest()
+        self.records = interactive_records(html, selectors)
+        self.by_identity = OrderedDict()
+        for record in self.records:
+            self.by_identity.setdefault(element_identity(record), []).append(record)
+
+
+class DomDiff:
+    def __init__(self, previous, current):
+        self.added, self.removed, self.changed, self.unchanged = [], [], [], []
+        for identity, records in current.by_identity.items():
+            before = previous.by_identity.get(identity, [])
+            for i, record in enumerate(records):
+                if i >= len(before):
+                    self.added.append(record)
+                elif before[i]["id"] == record["id"]:
+                    self.unchanged.append(record)
+                else:
+                    self.changed.append((before[i], record))
+        for identity, records in previous.by_identity.items():
+            after = current.by_identity.get(identity, [])
+            self.removed.extend(records[len(after):])
+
+    @property
+    def change_count(self):
+        return len(self.added) + len(self.removed) + len(self.changed)
+
+    @property
+    def change_ratio(self):
+        total = len(self.added) + len(self.changed) + len(self.unchanged) + len(self.removed)
+        return self.change_count / total if total else 0.0
+
+    def stats(self):
+        return {"added": len(self.added), "removed": len(self.removed), "changed": len(self.changed),
+                "unchanged": len(self.unchanged), "change_ratio": round(self.change_ratio, 3)}
+
+
+def _short(record):
+    return f'[{record["id"]}] {record["role"]} "{record["name"]}"'
+
+
+class DomSnapshotStore:
+    """Keeps the previous capture of the run and produces diffs / delta prompts against it"""
+
+    def __init__(self, snapshot_conf=None):
+        self.conf = dict(DEFAULT_SNAPSHOT_CONFIG)
+        self.conf.update(snapshot_conf or {})
+        self.previous = None
+        self.current = None
+        self.diff = None
+
+    def capture(self, html, selectors=None):
+        """Snapshot a new capture and diff it against the previous one. Returns the DomDiff (None on the first capture)"""
+        if self.current is not None and self.current.html_hash == hashlib.sha1(html.encode("utf-8", errors="replace")).hexdigest():
+            # Identical page source: no need to parse it again
+            snapshot = self.current
+            run_metrics.incr("dom_snapshots.reused")
+        else:
+            snapshot = DomSnapshot(html, selectors)
+            run_metrics.incr("dom_snapshots.parsed")
+        self.previous, self.current = self.current, snapshot
+        self.diff = DomDiff(self.previous, snapshot) if self.previous is not None else None
+        return self.diff
+
+    def delta_active(self):
+        """True when this capture should be sent as a delta rather than in full"""
+        return (self.conf["mode"] == "delta" and self.diff is not None
+                and self.diff.change_ratio <= self.conf["max_change_ratio"])
+
+    def planner_summary(self):
+        """Short description of what changed on the page since the previous iteration ("" if nothing did)"""
+        if self.diff is None or not self.diff.change_count:
+            return ""
+        diff = self.diff
+        limit = self.conf["max_listed_changes"]
+        lines = [f"{len(diff.added)} elements appeared, {len(diff.removed)} disappeared, "
+                 f"{len(diff.changed)} changed, {len(diff.unchanged)} unchanged."]
+        listed = [("+", r) for r in diff.added] + [("~", after) for _, after in diff.changed] + [("-", r) for r in diff.removed]
+        for marker, record in listed[:limit]:
+            lines.append(f"{marker} {record['role']} \"{record['name']}\"")
+        if len(listed) > limit:
+            lines.append(f"... {len(listed) - limit} more changes")
+        return "\n".join(lines)
+
+    def scripter_delta(self, plan_steps):
+        """Scripter DOM section: changed elements in full, plus the unchanged elements the plan most likely needs"""
+        diff = self.diff
+        budget = self.conf["token_budget"]
+        lines = ["Changed since the previous capture:"]
+        for record in diff.added:
+            lines.append("+ " + format_element_line(record, record["count"]))
+        for before, after in diff.changed:
+            lines.append("~ " + format_element_line(after, after["count"]) + f' (was {before["role"]} "{before["name"]}")')
+        for record in diff.removed:
+            lines.append("- " + _short(record) + " (no longer on the page)")
+        if len(lines) == 1:
+            lines.append("(no interactive elements changed)")
+
+        used_tokens = estimate_tokens("\n".join(lines))
+        if used_tokens > budget:
+            return None  # Too much changed to be worth a delta
+
+        # Unchanged context: per-step best matches among elements that did not change
+        context = ElementIndex(diff.unchanged, {"top_k": self.conf["context_k"]})
+        context_ids = OrderedDict()
+        for step in plan_steps:
+            for record in context.query(step):
+                context_ids.setdefault(record["id"], record)
+        roles = Counter(record["role"] for record in diff.unchanged)
+        lines.append("")
+        lines.append(f"Unchanged: {len(diff.unchanged)} elements ("
+                     + ", ".join(f"{count} {role}" for role, count in roles.most_common(6)) + ")")
+        for record in context_ids.values():
+            line = "  " + format_element_line(record, record["count"])
+            used_tokens += estimate_tokens(line) + 1
+            if used_tokens > budget:
+                break
+            lines.append(line)
+        return "\n".join(lines)
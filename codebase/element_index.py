@@ -0,0 +1,171 @@
+# element_index.py
+"""
+Per-capture index of interactive elements, keyed by role, tag, visible text, label and ARIA
+name. Each plan step is matched against it with a local text-similarity ranking, so the scripter
+receives only the top-k candidate elements per step instead of one whitelist-filtered dump.
+"""
+import math, re
+from collections import defaultdict
+from difflib import SequenceMatcher
+from dom_filter import iter_matching_elements
+from dom_compact import describe_element, format_element_line, estimate_tokens
+
+DEFAULT_INDEX_CONFIG = {
+    "enabled": True,
+    "top_k": 8,
+    "token_budget": 4000,
+    "max_posting_fraction": 0.5,   # Tokens present in more than this share of elements are not used to find candidates
+}
+
+_TOKEN = re.compile(r"[a-z0-9]+")
+_QUOTED = re.compile(r"[\"“']([^\"”']{2,})[\"”']")
+
+STOPWORDS = frozenset([
+    "a", "an", "the", "on", "in", "of", "to", "for", "and", "or", "at", "by", "with", "from", "into",
+    "click", "type", "enter", "press", "select", "choose", "then", "it", "its", "this", "that", "is",
+])
+
+# Planner element types -> roles they usually correspond to
+ELEMENT_TYPE_ROLES = [
+    ("radio", {"radio"}),
+    ("checkbox", {"checkbox", "switch"}),
+    ("dropdown", {"combobox", "listbox", "option", "button"}),
+    ("text", {"textbox", "searchbox", "combobox"}),
+    ("input", {"textbox", "searchbox", "combobox", "spinbutton"}),
+    ("search", {"searchbox", "textbox", "combobox"}),
+    ("link", {"link"}),
+    ("hyperlink", {"link"}),
+    ("tab", {"tab"}),
+    ("menu", {"menuitem", "button"}),
+    ("icon", {"button", "link"}),
+    ("button", {"button"}),
+    ("slider", {"slider"}),
+    ("option", {"option"}),
+]
+
+
+def tokenize(text):
+    return [t for t in _TOKEN.findall((text or "").lower()) if t not in STOPWORDS]
+
+
+def roles_for_element_type(element_type):
+    element_type = (element_type or "").lower()
+    roles = set()
+    for keyword, keyword_roles in ELEMENT_TYPE_ROLES:
+        if keyword in element_type:
+            roles |= keyword_roles
+    return roles
+
+
+def interactive_records(html, selectors=None):
+    """
+    Compact records (plus "label" and "count" fields) for the page's interactive elements, one per
+    stable ID. "count" is how many elements share that ID, so a selector shown for a record with
+    count > 1 is marked "(xN)" instead of being taken as unique.
+    """
+    records = []
+    seen = {}
+    for element in iter_matching_elements(html, ["interactive"]):
+        record = describe_element(element, selectors=selectors)
+        if record["id"] in seen:
+            seen[record["id"]]["count"] += 1
+            continue
+        seen[record["id"]] = record
+        attrs = element.attrs
+        record["label"] = " ".join(filter(None, [attrs.get("aria-label"), attrs.get("placeholder"), attrs.get("title")]))
+        record["count"] = 1
+        records.append(record)
+    return records
+
+
+class ElementIndex:
+    """Interactive elements of one capture plus inverted indexes over their searchable fields"""
+
+    def __init__(self, records, conf=None):
+        self.conf = dict(DEFAULT_INDEX_CONFIG, **(conf or {}))
+        self.records = records
+        self.by_role = defaultdict(list)
+        self.by_tag = defaultdict(list)
+        self.postings = defaultdict(set)
+        self.tokens = []
+        for position, record in enumerate(records):
+            self.by_role[record["role"]].append(position)
+            self.by_tag[record["tag"]].append(position)
+            searchable = " ".join([record["name"], record["label"], record["role"], record["tag"],
+                                   record["attrs"].get("name", ""), record["attrs"].get("id", "")])
+            tokens = set(tokenize(searchable))
+            self.tokens.append(tokens)
+            for token in tokens:
+                self.postings[token].add(position)
+        total = max(1, len(records))
+        self.idf = {token: math.log(1 + total / len(positions)) for token, positions in self.postings.items()}
+
+    @classmethod
+    def from_html(cls, html, conf=None, selectors=None):
+        return cls(interactive_records(html, selectors), conf)
+
+    def _candidates(self, tokens, roles):
+        limit = max(1, int(len(self.records) * self.conf["max_posting_fraction"]))
+        candidates = set()
+        for token in tokens:
+            positions = self.postings.get(token)
+            if positions and len(positions) <= limit:
+                candidates |= positions
+        if not candidates:
+            # Nothing textual matched: fall back to elements of the expected role
+            for role in roles:
+                candidates.update(self.by_role.get(role, [])[:self.conf["top_k"] * 4])
+        return candidates
+
+    def query(self, step, k=None):
+        """Top-k records for a plan step ({action_label, element_type, action}), best first"""
+        k = k or self.conf["top_k"]
+        step_text = f"{step.get('action_label', '')} {step.get('action', '')}"
+        tokens = set(tokenize(step_text))
+        quoted = [q.lower() for q in _QUOTED.findall(step_text)]
+        roles = roles_for_element_type(step.get("element_type"))
+
+        scored = []
+        for position in self._candidates(tokens, roles):
+            record = self.records[position]
+            overlap = tokens & self.tokens[position]
+            score = sum(self.idf.get(t, 0) for t in overlap)
+            haystack = f"{record['name']} {record['label']}".lower()
+            score += sum(2.0 for q in quoted if q in haystack)
+            if record["role"] in roles:
+                score += 1.0
+            scored.append((score, position))
+
+        scored.sort(key=lambda item: (-item[0], item[1]))
+        # Fine-grained string similarity only for the short list
+        shortlist = scored[:k * 3]
+        label = (step.get("action_label") or "").lower()
+        reranked = []
+        for score, position in shortlist:
+            record = self.records[position]
+            similarity = SequenceMatcher(None, label, f"{record['name']} {record['label']}".lower()).ratio()
+            reranked.append((score + similarity, position))
+        reranked.sort(key=lambda item: (-item[0], item[1]))
+        return [self.records[position] for score, position in reranked[:k] if score > 0]
+
+
+def format_step_candidates(plan_steps, index, k=None, token_budget=None):
+    """Scripter prompt section: the top-k candidate elements for each plan step"""
+    token_budget = token_budget or index.conf["token_budget"]
+    sections = []
+    used_tokens = 0
+    for i, step in enumerate(plan_steps):
+        header = f"Step {i + 1} - {step['action_label']} - candidates:"
+        lines = [header]
+        for record in index.query(step, k):
+            lines.append("  " + format_element_line(record, record["count"]))
+        if len(lines) == 1:
+            lines.append("  (no matching element found on the captured page)")
+        section = "\n".join(lines)
+        section_tokens = estimate_tokens(section)
+        if used_tokens + section_tokens > token_budget and sections:
+            sections.append(f"... candidates for steps {i + 1}-{len(plan_steps)} omitted (token budget {token_budget})")
+            break
+        sections.append(section)
+        used_tokens += section_tokens
+    return "\n\n".join(sections)
@@ -0,0 +1,82 @@
+# har_archive.py
+"""
+HAR record/replay for captures and generated scripts. In record mode the first capture of a
+problem saves its traffic to {dir}/{problem_id}.har; later captures and script runs are served
+from that archive with route_from_har. Settings reach generated scripts through TESSARA_HAR;
+the asyncio pipeline keeps one setting per problem in a context variable instead (see
+async_pipeline.py), which asyncio.to_thread carries into the capture threads.
+"""
+import contextvars, json, os
+import run_metrics
+
+HAR_ENV = "TESSARA_HAR"
+
+DEFAULT_HAR_CONFIG = {
+    "mode": "off",                 # off | record | replay
+    "dir": "../responses/har",
+    "not_found": "fallback",       # fallback (go to the network) | abort (fully offline)
+}
+
+_problem_har = contextvars.ContextVar("problem_har", default=None)
+
+
+def configure_har(har_conf, problem_id, export=True):
+    """
+    Apply the `har` section of config.yaml for this problem. With export=True it is exported to
+    child scripts through TESSARA_HAR; otherwise it only applies to the current context.
+    """
+    conf = dict(DEFAULT_HAR_CONFIG)
+    conf.update(har_conf or {})
+    if conf["mode"] not in ("off", "record", "replay"):
+        print(f"[WARNING] Unknown HAR mode '{conf['mode']}', HAR disabled")
+        conf["mode"] = "off"
+    conf["path"] = os.path.abspath(os.path.join(conf["dir"], f"{problem_id}.har"))
+    if export:
+        os.environ[HAR_ENV] = json.dumps(conf)
+    else:
+        _problem_har.set(conf)
+    if conf["mode"] != "off":
+        state = "found" if os.path.exists(conf["path"]) else "missing"
+        print(f"[INFO] HAR {conf['mode']} mode, archive {conf['path']} ({state})")
+    return conf
+
+
+def load_har_config():
+    if _problem_har.get() is not None:
+        return dict(_problem_har.get())
+    try:
+        conf = json.loads(os.environ.get(HAR_ENV) or "{}")
+    except ValueError:
+        conf = {}
+    merged = dict(DEFAULT_HAR_CONFIG)
+    merged.update(conf)
+    return merged
+
+
+def har_active():
+    """True when captures/scripts are recorded to or served from a HAR archive"""
+    return load_har_config()["mode"] != "off"
+
+
+def apply_har(target):
+    """
+    Attach HAR recording or replay to a BrowserContext or Page. Must be installed before any
+    other route handlers, since Playwright runs the most recently added handler first.
+    Returns "recording", "replaying" or None.
+    """
+    conf = load_har_config()
+    if conf["mode"] == "off" or not conf.get("path"):
+        return None
+    path = conf["path"]
+    if not os.path.exists(path):
+        if conf["mode"] == "record":
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+            # Written when the context closes
+            target.route_from_har(path, update=True, update_content="embed", update_mode="minimal")
+            run_metrics.incr("har.recorded_contexts")
+            return "recording"
+        print(f"[WARNING] HAR replay requested but {path} does not exist; using the live network")
+        return None
+    target.route_from_har(path, not_found=conf["not_found"])
+    run_metrics.incr("har.replayed_contexts")
+    return "replaying"
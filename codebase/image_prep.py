@@ -0,0 +1,166 @@
+# image_prep.py
+"""
+Prepare screenshots for LLM requests: crop, downscale, re-encode and tile them to fit a
+byte and pixel budget per stage (planner, scripter, answering), and cache the encoded
+result by content hash so the same screenshot is only encoded once per profile.
+"""
+import base64, hashlib, io, json
+from collections import OrderedDict
+from PIL import Image
+
+DEFAULT_IMAGE_BUDGET = {
+    "enabled": True,
+    "cache_entries": 32,
+    "defaults": {
+        "crop": "full",            # full | viewport
+        "viewport_aspect": 0.5625, # Height/width of the capture viewport (2560x1440)
+        "max_width": 1536,
+        "max_pixels": 1536 * 2048, # Per tile
+        "max_bytes": 1500000,      # Across all tiles of one image
+        "max_tiles": 4,
+        "tile_height": 2048,       # Tall pages are split into tiles of at most this height
+        "format": "jpeg",          # jpeg | webp | png
+        "quality": 80,
+        "min_quality": 40,
+    },
+    "profiles": {
+        "planner": {"crop": "full"},
+        "scripter": {"crop": "viewport", "max_width": 1280},
+        "answering": {"crop": "full", "max_width": 1280},
+    },
+}
+
+MIME_TYPES = {"jpeg": "image/jpeg", "webp": "image/webp", "png": "image/png"}
+
+_budget_config = json.loads(json.dumps(DEFAULT_IMAGE_BUDGET))
+_encoded_cache = OrderedDict()
+
+
+def configure_image_budget(budget_conf=None):
+    """Apply the `image_budget` section of config.yaml"""
+    global _budget_config
+    conf = json.loads(json.dumps(DEFAULT_IMAGE_BUDGET))
+    budget_conf = budget_conf or {}
+    for key, value in budget_conf.items():
+        if key in ("defaults", "profiles") and isinstance(value, dict):
+            for name, override in value.items():
+                if isinstance(override, dict):
+                    conf[key].setdefault(name, {}).update(override)
+                else:
+                    conf[key][name] = override
+        else:
+            conf[key] = value
+    _budget_config = conf
+    _encoded_cache.clear()
+
+
+def get_image_profile(stage):
+    profile = dict(_budget_config["defaults"])
+    profile.update(_budget_config["profiles"].get(stage, {}))
+    return profile
+
+
+def _encode(image, fmt, quality):
+    buffer = io.BytesIO()
+    if fmt == "png":
+        image.save(buffer, format="PNG", optimize=True)
+    elif fmt == "webp":
+        image.save(buffer, format="WEBP", quality=quality, method=4)
+    else:
+        image.save(buffer, format="JPEG", quality=quality, optimize=True)
+    return buffer.getvalue()
+
+
+def _split_tiles(image, tile_height, max_tiles):
+    tiles = []
+    top = 0
+    while top < image.height and len(tiles) < max_tiles:
+        tiles.append(image.crop((0, top, image.width, min(top + tile_height, image.height))))
+        top += tile_height
+    return tiles
+
+
+def _fit_image(image, profile):
+    """Crop and downscale to the profile's width, tile and pixel limits; returns the tiles"""
+    if profile["crop"] == "viewport":
+        viewport_height = int(image.width * profile["viewport_aspect"])
+        image = image.crop((0, 0, image.width, min(image.height, viewport_height)))
+
+    if image.width > profile["max_width"]:
+        scale = profile["max_width"] / image.width
+        image = image.resize((profile["max_width"], max(1, int(image.height * scale))), Image.LANCZOS)
+
+    # Tall pages: keep at most max_tiles tiles; shrink further if the page would not fit
+    covered_height = profile["tile_height"] * profile["max_tiles"]
+    if image.height > covered_height:
+        scale = covered_height / image.height
+        image = image.resize((max(1, int(image.width * scale)), covered_height), Image.LANCZOS)
+    tiles = _split_tiles(image, profile["tile_height"], profile["max_tiles"])
+
+    fitted = []
+    for tile in tiles:
+        pixels = tile.width * tile.height
+        if pixels > profile["max_pixels"]:
+            scale = (profile["max_pixels"] / pixels) ** 0.5
+            tile = tile.resize((max(1, int(tile.width * scale)), max(1, int(tile.height * scale))), Image.LANCZOS)
+        fitted.append(tile)
+    return fitted
+
+
+def _encode_within_budget(tiles, profile):
+    fmt = profile["format"] if profile["format"] in MIME_TYPES else "jpeg"
+    if fmt != "png":
+        tiles = [t.convert("RGB") if t.mode != "RGB" else t for t in tiles]
+    quality = profile["quality"]
+    while True:
+        encoded = [_encode(t, fmt, quality) for t in tiles]
+        total = sum(len(e) for e in encoded)
+        if total <= profile["max_bytes"]:
+            return fmt, encoded
+        if fmt != "png" and quality - 10 >= profile["min_quality"]:
+            quality -= 10
+            continue
+        if min(min(t.size) for t in tiles) < 64:
+            return fmt, encoded  # Cannot shrink any further; send what we have
+        tiles = [t.resize((max(1, int(t.width * 0.8)), max(1, int(t.height * 0.8))), Image.LANCZOS) for t in tiles]
+
+
+def prepare_image(image_bytes, stage):
+    """
+    Return a list of (mime_type, base64_data) tiles for the given stage's profile.
+    Results are cached by content hash + profile, so planner, scripter and answering
+    never re-encode the same screenshot twice with the same settings.
+    """
+    profile = get_image_profile(stage)
+    digest = hashlib.sha256(image_bytes).hexdigest()
+    cache_key = (digest, json.dumps(profile, sort_keys=True))
+    if cache_key in _encoded_cache:
+        _encoded_cache.move_to_end(cache_key)
+        return _encoded_cache[cache_key]
+
+    image = Image.open(io.BytesIO(image_bytes))
+    image.load()
+    original_size = image.size
+    fmt, encoded = _encode_within_budget(_fit_image(image, profile), profile)
+    result = [(MIME_TYPES[fmt], base64.b64encode(data).decode("utf-8")) for data in encoded]
+
+    print(f"[INFO] Image for {stage}: {original_size[0]}x{original_size[1]} {len(image_bytes)} bytes -> "
+          f"{len(encoded)} {fmt} tile(s), {sum(len(e) for e in encoded)} bytes")
+
+    _encoded_cache[cache_key] = result
+    while len(_encoded_cache) > _budget_config["cache_entries"]:
+        _encoded_cache.popitem(last=False)
+    return result
+
+
+def image_content_parts(screenshot, stage, mime_type="image/png"):
+    """Chat message content parts for a screenshot (raw bytes or base64 string)"""
+    if isinstance(screenshot, str):
+        screenshot = base64.b64decode(screenshot)
+    if not _budget_config.get("enabled", True):
+        data = base64.b64encode(screenshot).decode("utf-8")
+        return [{"type": "image_url", "image_url": {"url": f"data:{mime_type};base64,{data}"}}]
+    return [
+        {"type": "image_url", "image_url": {"url": f"data:{mime};base64,{data}"}}
+        for mime, data in prepare_image(screenshot, stage)
+    ]
@@ -0,0 +1,142 @@
+# llm_cache.py
+"""
+Content-addressed on-disk cache for chat completions, consulted by llm_gateway before every
+request. Entries are keyed by a hash of the model, sampling parameters and messages (system
+prompt, text and image data), evicted least-recently-used by total size and by age.
+
+Modes:
+    off           - no caching
+    read-through  - serve hits, call the model on a miss and store the result
+    record        - always call the model and (over)write the entry
+    replay-only   - serve hits, raise LLMCacheMiss on a miss (offline runs, no tokens spent)
+"""
+import hashlib, json, os, threading, time
+from types import SimpleNamespace
+import run_metrics
+
+MODES = ("off", "read-through", "record", "replay-only")
+
+DEFAULT_CACHE_CONFIG = {
+    "mode": "off",
+    "dir": "../responses/llm_cache",
+    "max_bytes": 500 * 1024 * 1024,
+    "max_age_days": 30,
+}
+
+_cache_config = dict(DEFAULT_CACHE_CONFIG)
+_lock = threading.Lock()
+
+
+class LLMCacheMiss(RuntimeError):
+    """Raised in replay-only mode when a request has no recorded response"""
+
+
+def configure_llm_cache(cache_conf=None):
+    """Apply the `llm_cache` section of config.yaml"""
+    global _cache_config
+    conf = dict(DEFAULT_CACHE_CONFIG)
+    conf.update(cache_conf or {})
+    if conf["mode"] not in MODES:
+        print(f"[WARNING] Unknown LLM cache mode '{conf['mode']}', cache disabled")
+        conf["mode"] = "off"
+    _cache_config = conf
+    if conf["mode"] != "off":
+        print(f"[INFO] LLM cache {conf['mode']} mode, directory {os.path.abspath(conf['dir'])}")
+    return conf
+
+
+def request_key(request):
+    """sha256 over the canonical JSON of model, parameters and messages (image data URLs included)"""
+    canonical = json.dumps(request, sort_keys=True, separators=(",", ":"), ensure_ascii=False)
+    return hashlib.sha256(canonical.encode("utf-8")).hexdigest()
+
+
+def _entry_path(key):
+    return os.path.join(_cache_config["dir"], key[:2], key + ".json")
+
+
+def _serialize(response):
+    if hasattr(response, "model_dump"):
+        return response.model_dump(mode="json")
+    # Stub clients and streamed responses: keep what the stages read (message content and usage)
+    usage = getattr(response, "usage", None)
+    if usage is not None:
+        usage = usage.model_dump(mode="json") if hasattr(usage, "model_dump") else dict(vars(usage))
+    return {
+        "choices": [{"message": {"content": c.message.content}} for c in response.choices],
+        "usage": usage,
+    }
+
+
+def _deserialize(data):
+    # Attribute access like the SDK objects (response.choices[0].message.content, response.usage)
+    return json.loads(json.dumps(data), object_hook=lambda d: SimpleNamespace(**d))
+
+
+def lookup(stage, request):
+    """Cached response for the request, or None. Raises LLMCacheMiss on a miss in replay-only mode"""
+    mode = _cache_config["mode"]
+    if mode in ("off", "record"):
+        return None
+    key = request_key(request)
+    path = _entry_path(key)
+    try:
+        with open(path, "r", encoding="utf-8") as f:
+            entry = json.load(f)
+        if time.time() - entry["created_at"] > _cache_config["max_age_days"] * 86400:
+            raise ValueError("expired")
+        os.utime(path)  # LRU: mtime is the last use
+    except (OSError, ValueError, KeyError):
+        run_metrics.incr(f"llm_cache.{stage}.misses")
+        if mode == "replay-only":
+            raise LLMCacheMiss(f"No recorded {stage} response for request {key[:12]} in {_cache_config['dir']}")
+        return None
+    run_metrics.incr(f"llm_cache.{stage}.hits")
+    print(f"[INFO] LLM cache hit for {stage} ({key[:12]})")
+    return _deserialize(entry["response"])
+
+
+def store(stage, request, response):
+    if _cache_config["mode"] not in ("read-through", "record"):
+        return
+    key = request_key(request)
+    path = _entry_path(key)
+    entry = {"key": key, "stage": stage, "model": request.get("model"), "created_at": time.time(),
+             "response": _serialize(response)}
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    tmp_path = f"{path}.{os.getpid()}.tmp"
+    with open(tmp_path, "w", encoding="utf-8") as f:
+        json.dump(entry, f)
+    os.replace(tmp_path, path)
+    run_metrics.incr(f"llm_cache.{stage}.stores")
+    evict()
+
+
+def evict():
+    """Drop entries older than max_age_days, then least recently used ones until under max_bytes"""
+    root = _cache_config["dir"]
+    if not os.path.isdir(root):
+        return
+    with _lock:
+        entries = []
+        for dirpath, _, filenames in os.walk(root):
+            for name in filenames:
+                if name.endswith(".json"):
+                    path = os.path.join(dirpath, name)
+                    try:
+                        st = os.stat(path)
+                    except OSError:
+                        continue
+                    entries.append((st.st_mtime, st.st_size, path))
+        entries.sort()
+        cutoff = time.time() - _cache_config["max_age_days"] * 86400
+        total = sum(size for _, size, _ in entries)
+        for mtime, size, path in entries:
+            if mtime >= cutoff and total <= _cache_config["max_bytes"]:
+                break
+            try:
+                os.remove(path)
+            except OSError:
+                continue
+            total -= size
+            run_metrics.incr("llm_cache.evictions")
@@ -0,0 +1,373 @@
+# llm_gateway.py
+"""
+Process-wide gateway for chat completions. One pooled client per (endpoint, API version, key)
+is shared by the planner, scripter, correction and answering stages, so TLS sessions and
+keep-alive connections survive between calls. Prompt templates are read once. Every call
+reports time-to-first-byte and whether it reused a pooled connection, and goes through the
+response cache in llm_cache.py first. stream_chat_completion() streams the answer through a
+callback that can cancel generation early (see llm_stream.py). achat_completion() is the
+asyncio counterpart, with pooled AsyncAzureOpenAI clients per event loop (see async_pipeline.py).
+Tests can swap the real client for a stub with set_client_factory().
+"""
+import asyncio, contextvars, hashlib, os, threading, time
+from types import SimpleNamespace
+from openai import AzureOpenAI, AsyncAzureOpenAI
+import llm_cache, run_metrics
+
+try:
+    import httpx
+except ImportError:  # httpx ships with openai; without it the SDK's default client is used (no reuse stats)
+    httpx = None
+
+PROMPTS_DIR = "../prompts"
+
+DEFAULT_GATEWAY_CONFIG = {
+    "timeout": 120.0,             # Seconds per request (read timeout)
+    "connect_timeout": 10.0,
+    "max_retries": 2,             # SDK retries on connection errors, 429 and 5xx
+    "max_connections": 20,
+    "max_keepalive_connections": 10,
+    "keepalive_expiry": 120.0,    # Seconds an idle connection is kept open
+    "preload_prompts": True,
+}
+
+_gateway_config = dict(DEFAULT_GATEWAY_CONFIG)
+_clients = {}
+_clients_lock = threading.Lock()
+_prompts = {}
+_prompts_lock = threading.Lock()
+_async_clients = {}
+# Stats of the call in flight; a context variable so concurrent asyncio tasks do not share it
+_call_stats = contextvars.ContextVar("llm_call_stats", default=None)
+_client_factory = None
+_async_client_factory = None
+
+
+def configure_llm_gateway(gateway_conf=None):
+    """Apply the `llm_gateway` section of config.yaml (existing clients are closed and rebuilt)"""
+    global _gateway_config
+    conf = dict(DEFAULT_GATEWAY_CONFIG)
+    conf.update(gateway_conf or {})
+    _gateway_config = conf
+    close_clients()
+    if conf["preload_prompts"]:
+        preload_prompts()
+    return conf
+
+
+def set_client_factory(factory, async_factory=None):
+    """
+    factory(llm_conf, gateway_conf) -> object with .chat.completions.create(**kwargs);
+    async_factory is the same for achat_completion (create is a coroutine).
+    Pass None to go back to pooled AzureOpenAI / AsyncAzureOpenAI clients.
+    """
+    global _client_factory, _async_client_factory
+    _client_factory = factory
+    _async_client_factory = async_factory
+    close_clients()
+
+
+def preload_prompts(prompts_dir=PROMPTS_DIR):
+    if not os.path.isdir(prompts_dir):
+        return
+    for name in sorted(os.listdir(prompts_dir)):
+        if name.endswith(".txt"):
+            load_prompt(name, prompts_dir)
+
+
+def load_prompt(name, prompts_dir=PROMPTS_DIR):
+    """Contents of prompts/<name>, read from disk once per process"""
+    path = os.path.join(prompts_dir, name)
+    with _prompts_lock:
+        if path not in _prompts:
+            with open(path, "r") as f:
+                _prompts[path] = f.read()
+        return _prompts[path]
+
+
+class _CallStats:
+    __slots__ = ("start", "ttfb", "new_connections")
+
+    def __init__(self):
+        self.start = time.perf_counter()
+        self.ttfb = None
+        self.new_connections = 0
+
+
+def _trace(event_name, info):
+    stats = _call_stats.get()
+    if stats is not None and event_name == "connection.connect_tcp.started":
+        stats.new_connections += 1
+
+
+def _on_request(request):
+    # httpcore reports connection setup through the "trace" extension; no TCP connect -> reused connection
+    request.extensions["trace"] = _trace
+
+
+def _on_response(response):
+    stats = _call_stats.get()
+    if stats is not None and stats.ttfb is None:
+        stats.ttfb = time.perf_counter() - stats.start
+
+
+async def _atrace(event_name, info):
+    _trace(event_name, info)
+
+
+async def _aon_request(request):
+    request.extensions["trace"] = _atrace
+
+
+async def _aon_response(response):
+    _on_response(response)
+
+
+def _build_http_client(conf, asynchronous=False):
+    if httpx is None:
+        return None
+    client_class = httpx.AsyncClient if asynchronous else httpx.Client
+    hooks = {"request": [_aon_request], "response": [_aon_response]} if asynchronous else \
+        {"request": [_on_request], "response": [_on_response]}
+    return client_class(
+        timeout=httpx.Timeout(conf["timeout"], connect=conf["connect_timeout"]),
+        limits=httpx.Limits(max_connections=conf["max_connections"],
+                            max_keepalive_connections=conf["max_keepalive_connections"],
+                            keepalive_expiry=conf["keepalive_expiry"]),
+        event_hooks=hooks,
+    )
+
+
+def _client_key(llm_conf):
+    key_hash = hashlib.sha256(str(llm_conf.get("api_key", "")).encode("utf-8")).hexdigest()[:12]
+    return (llm_conf.get("azure_endpoint"), llm_conf.get("api_version"), key_hash)
+
+
+def get_client(llm_conf):
+    """Pooled client for a planner/scripter config section"""
+    key = _client_key(llm_conf)
+    with _clients_lock:
+        client = _clients.get(key)
+        if client is None:
+            if _client_factory is not None:
+                client = _client_factory(llm_conf, _gateway_config)
+            else:
+                client = AzureOpenAI(
+                    azure_endpoint=llm_conf['azure_endpoint'],
+                    api_key=llm_conf['api_key'],
+                    api_version=llm_conf['api_version'],
+                    timeout=_gateway_config["timeout"],
+                    max_retries=_gateway_config["max_retries"],
+                    http_client=_build_http_client(_gateway_config),
+                )
+            _clients[key] = client
+            run_metrics.incr("llm.clients_created")
+        return client
+
+
+def get_async_client(llm_conf):
+    """Pooled async client for the running event loop (async clients cannot be shared across loops)"""
+    key = (id(asyncio.get_running_loop()),) + _client_key(llm_conf)
+    with _clients_lock:
+        client = _async_clients.get(key)
+        if client is None:
+            if _async_client_factory is not None:
+                client = _async_client_factory(llm_conf, _gateway_config)
+            else:
+                client = AsyncAzureOpenAI(
+                    azure_endpoint=llm_conf['azure_endpoint'],
+                    api_key=llm_conf['api_key'],
+                    api_version=llm_conf['api_version'],
+                    timeout=_gateway_config["timeout"],
+                    max_retries=_gateway_config["max_retries"],
+                    http_client=_build_http_client(_gateway_config, asynchronous=True),
+                )
+            _async_clients[key] = client
+            run_metrics.incr("llm.clients_created")
+        return client
+
+
+def close_clients():
+    with _clients_lock:
+        for client in _clients.values():
+            try:
+                client.close()
+            except Exception:
+                pass
+        _clients.clear()
+        # Async clients are closed by aclose_clients() on their own loop
+        _async_clients.clear()
+
+
+async def aclose_clients():
+    """Close the async clients of the running event loop"""
+    loop_id = id(asyncio.get_running_loop())
+    with _clients_lock:
+        keys = [key for key in _async_clients if key[0] == loop_id]
+        clients = [_async_clients.pop(key) for key in keys]
+    for client in clients:
+        try:
+            await client.close()
+        except Exception:
+            pass
+
+
+def _record_call(stage, stats, first_token=None):
+    elapsed = time.perf_counter() - stats.start
+    run_metrics.incr(f"llm.{stage}.calls")
+    run_metrics.incr(f"llm.{stage}.seconds", round(elapsed, 3))
+    if first_token is not None:
+        run_metrics.incr(f"llm.{stage}.first_token_seconds", round(first_token, 3))
+    if stats.ttfb is None:
+        return
+    run_metrics.incr(f"llm.{stage}.ttfb_seconds", round(stats.ttfb, 3))
+    reused = stats.new_connections == 0
+    run_metrics.incr("llm.connections_reused" if reused else "llm.connections_new")
+    first = f"first token {first_token:.2f}s, " if first_token is not None else ""
+    print(f"[INFO] LLM {stage}{' (streamed)' if first_token is not None else ''}: {elapsed:.2f}s "
+          f"({first}TTFB {stats.ttfb:.2f}s, {'reused connection' if reused else 'new connection'})")
+
+
+def chat_completion(stage, llm_conf, messages, model, temperature, max_tokens, **kwargs):
+    """
+    Run one chat completion through the pooled client for llm_conf. Returns the SDK response;
+    timing and connection reuse are printed and added to run_metrics under llm.<stage>.*
+    """
+    request = dict(model=model, messages=messages, temperature=temperature, max_tokens=max_tokens, **kwargs)
+    cached = llm_cache.lookup(stage, request)
+    if cached is not None:
+        return cached
+
+    client = get_client(llm_conf)
+    stats = _CallStats()
+    token = _call_stats.set(stats)
+    try:
+        response = client.chat.completions.create(**request)
+    finally:
+        _call_stats.reset(token)
+    _record_call(stage, stats)
+    llm_cache.store(stage, request, response)
+    return response
+
+
+class StreamAborted(ValueError):
+    """Raised by a stream callback to cancel generation; .partial_text holds what arrived so far"""
+
+    def __init__(self, reason, partial_text=""):
+        super().__init__(reason)
+        self.reason = reason
+        self.partial_text = partial_text
+
+
+def stream_chat_completion(stage, llm_conf, messages, model, temperature, max_tokens, on_text, **kwargs):
+    """
+    Like chat_completion, but streams the answer: on_text(delta, text_so_far) runs for every chunk
+    and may raise StreamAborted to close the stream (the model stops generating). Returns a
+    response object with .choices[0].message.content and .usage like the non-streaming call.
+    """
+    request = dict(model=model, messages=messages, temperature=temperature, max_tokens=max_tokens, **kwargs)
+    cached = llm_cache.lookup(stage, request)
+    if cached is not None:
+        return _replay_cached(cached, on_text)
+
+    client = get_client(llm_conf)
+    stats = _CallStats()
+    token = _call_stats.set(stats)
+    collector = _StreamCollector(stage, stats, on_text)
+    try:
+        stream = client.chat.completions.create(stream=True, stream_options={"include_usage": True}, **request)
+        try:
+            for chunk in stream:
+                collector.add(chunk)
+        finally:
+            close = getattr(stream, "close", None)
+            if close is not None:
+                close()
+    finally:
+        _call_stats.reset(token)
+    _record_call(stage, stats, collector.first_token)
+    return collector.finish(request)
+
+
+class _StreamCollector:
+    """Accumulates streamed chunks and runs the on_text callback (shared by the sync and async paths)"""
+
+    def __init__(self, stage, stats, on_text):
+        self.stage = stage
+        self.stats = stats
+        self.on_text = on_text
+        self.parts = []
+        self.usage = None
+        self.first_token = None
+
+    def add(self, chunk):
+        if getattr(chunk, "usage", None) is not None:
+            self.usage = chunk.usage
+        if not chunk.choices:
+            return
+        delta = chunk.choices[0].delta.content or ""
+        if not delta:
+            return
+        if self.first_token is None:
+            self.first_token = time.perf_counter() - self.stats.start
+        self.parts.append(delta)
+        try:
+            self.on_text(delta, "".join(self.parts))
+        except StreamAborted as e:
+            e.partial_text = "".join(self.parts)
+            run_metrics.incr(f"llm.{self.stage}.aborted")
+            print(f"[WARNING] LLM {self.stage} stream cancelled after {len(e.partial_text)} chars: {e.reason}")
+            raise
+
+    def finish(self, request):
+        response = SimpleNamespace(choices=[SimpleNamespace(message=SimpleNamespace(content="".join(self.parts)))],
+                                   usage=self.usage)
+        llm_cache.store(self.stage, request, response)
+        return response
+
+
+def _replay_cached(cached, on_text):
+    content = cached.choices[0].message.content or ""
+    try:
+        on_text(content, content)
+    except StreamAborted as e:
+        e.partial_text = content
+        raise
+    return cached
+
+
+async def achat_completion(stage, llm_conf, messages, model, temperature, max_tokens, on_text=None, **kwargs):
+    """
+    asyncio counterpart of chat_completion (on_text=None) and stream_chat_completion (on_text given),
+    using the pooled async client of the running loop.
+    """
+    request = dict(model=model, messages=messages, temperature=temperature, max_tokens=max_tokens, **kwargs)
+    cached = llm_cache.lookup(stage, request)
+    if cached is not None:
+        return _replay_cached(cached, on_text) if on_text is not None else cached
+
+    client = get_async_client(llm_conf)
+    stats = _CallStats()
+    token = _call_stats.set(stats)
+    try:
+        if on_text is None:
+            response = await client.chat.completions.create(**request)
+            collector = None
+        else:
+            collector = _StreamCollector(stage, stats, on_text)
+            stream = await client.chat.completions.create(stream=True, stream_options={"include_usage": True}, **request)
+            try:
+                async for chunk in stream:
+                    collector.add(chunk)
+            finally:
+                close = getattr(stream, "close", None)
+                if close is not None:
+                    await close()
+    finally:
+        _call_stats.reset(token)
+    if collector is None:
+        _record_call(stage, stats)
+        llm_cache.store(stage, request, response)
+        return response
+    _record_call(stage, stats, collector.first_token)
+    return collector.finish(request)
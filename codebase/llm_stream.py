@@ -0,0 +1,111 @@
+# llm_stream.py
+"""
+Incremental parsing of streamed planner and scripter output. The monitors are passed to
+llm_gateway.stream_chat_completion as on_text callbacks: they check the first lines as soon as
+they arrive, cancel generation when the answer is clearly prose instead of a plan or a script,
+and hand every completed step to the orchestrator while the rest is still being generated.
+"""
+import re
+from llm_gateway import StreamAborted
+
+CODE_LINE = re.compile(r"^\s*(```|import |from |with |def |class |try:|#|success_status|async def |@)")
+SCRIPT_STEP_MARKER = re.compile(r"Executing Step (\d+) -")
+PLAN_STEP_LINE = re.compile(r"^\s*(?:Step\s*\d+\s*[-:]|\d+\s*[.-])", re.IGNORECASE)
+
+
+class ScriptStreamMonitor:
+    """
+    Scripter stream: aborts when no code has started within probe_chars, and calls
+    on_step(step_number, code) for each step block once the next step (or the end) arrives.
+    """
+
+    def __init__(self, on_step=None, probe_chars=400):
+        self.on_step = on_step
+        self.probe_chars = probe_chars
+        self.code_seen = False
+        self.scanned = 0           # Length of the text whose complete lines were inspected
+        self.current_step = None   # (step_number, offset of the line starting the block)
+        self.emitted = []
+
+    def __call__(self, delta, text):
+        end = text.rfind("\n") + 1
+        if end <= self.scanned:
+            self._check_prose(text)
+            return
+        for line_start, line in self._lines(text, self.scanned, end):
+            if not self.code_seen and CODE_LINE.match(line):
+                self.code_seen = True
+            marker = SCRIPT_STEP_MARKER.search(line)
+            if marker:
+                block_start = self._block_start(text, line_start)
+                self._emit(text[:block_start])
+                self.current_step = (int(marker.group(1)), block_start)
+        self.scanned = end
+        self._check_prose(text)
+
+    def finish(self, text):
+        """Emit the last step block once the stream has ended"""
+        self._emit(text)
+
+    def _check_prose(self, text):
+        if not self.code_seen and len(text) >= self.probe_chars:
+            raise StreamAborted(f"no code in the first {self.probe_chars} characters")
+
+    @staticmethod
+    def _lines(text, start, end):
+        offset = start
+        for line in text[start:end].splitlines(keepends=True):
+            yield offset, line
+            offset += len(line)
+
+    @staticmethod
+    def _block_start(text, line_start):
+        # A step block starts at the `try:` that precedes its "Executing Step" print, if any
+        previous = text.rfind("\n", 0, max(0, line_start - 1)) + 1
+        if text[previous:line_start].strip() == "try:":
+            return previous
+        return line_start
+
+    def _emit(self, text):
+        if self.current_step is None:
+            return
+        number, start = self.current_step
+        self.current_step = None
+        block = text[start:].rstrip()
+        self.emitted.append(number)
+        if self.on_step is not None:
+            self.on_step(number, block)
+
+
+class PlanStreamMonitor:
+    """
+    Planner stream: calls on_step(line) for every completed "Step N - ..." line. When the answer
+    starts as prose, reads probe_chars (enough for parse_plan's fallback step) and then cancels.
+    """
+
+    def __init__(self, on_step=None, probe_chars=400):
+        self.on_step = on_step
+        self.probe_chars = probe_chars
+        self.steps_seen = 0
+        self.scanned = 0
+
+    def __call__(self, delta, text):
+        end = text.rfind("\n") + 1
+        if end > self.scanned:
+            for line in text[self.scanned:end].splitlines():
+                self._line(line)
+            self.scanned = end
+        if not self.steps_seen and len(text) >= self.probe_chars and not PLAN_STEP_LINE.match(text.lstrip()):
+            raise StreamAborted(f"no plan step in the first {self.probe_chars} characters")
+
+    def finish(self, text):
+        tail = text[self.scanned:]
+        if tail.strip():
+            self._line(tail)
+        self.scanned = len(text)
+
+    def _line(self, line):
+        if PLAN_STEP_LINE.match(line):
+            self.steps_seen += 1
+            if self.on_step is not None:
+                self.on_step(line.strip())
@@ -1,46 +1,75 @@
 # main.py
-import os, shutil, re, tempfile, time,psutil
+import os, shutil, re, json, tempfile, time
 from sys import stdout
 from subprocess import run, CalledProcessError, PIPE, Popen
-from utils import (get_screenshot, get_dom_tree, filter_dom_by_whitelist, save_script_to_file, load_config, final_save_and_run, load_state, save_state)
+from utils import (log_interaction, get_screenshot, get_dom_tree, capture_page, load_capture_bundle, filter_dom_by_whitelist, save_script_to_file, load_config, final_save_and_run, load_state, save_state, reset_state, get_state_file_path)
 from planner import (generate_plan, parse_plan)
 from scripter import generate_script, correct_script
 from answering_llm import evaluate_task_completion
-
+from browser_pool import configure_browser_pool, shutdown_browser_pool
+from page_settle import configure_page_settle
+from image_prep import configure_image_budget
+from request_routing import configure_request_routing
+from har_archive import configure_har
+from screenshot_dedupe import ScreenshotIndex
+from dom_compact import compact_dom
+from element_index import ElementIndex, format_step_candidates
+from dom_snapshots import DomSnapshotStore
+from selector_cache import configure_selector_cache
+from llm_gateway import configure_llm_gateway
+from llm_cache import configure_llm_cache
+from step_scripter import StepScripter
+from speculative import load_speculative_config, generate_candidates, rank_candidates, race_candidates
+from script_worker import configure_script_worker, run_in_worker, shutdown_script_worker
+from step_events import StepEventListener, STEP_EVENTS_ENV, print_event
+from script_executor import configure_script_execution, abort_env, ExecutionMonitor, run_streamed
+from process_tracker import get_tracker, reap_run, end_scope, reap_all
+from script_runtime import capture_paths, RESUME_STORAGE_ENV
+from checkpoints import (configure_checkpoints, load_checkpoint_config, checkpoint_dir, list_checkpoints, latest_resumable,
+                         reset_checkpoints, CHECKPOINT_DIR_ENV, RESUME_CHECKPOINT_ENV)
+import run_metrics
+
+
+CODEBASE_DIR = os.path.dirname(os.path.abspath(__file__))
 
 def wrap_script_with_exit_handling(script_code):
     lines = script_code.strip().splitlines()
-    new_lines = ["success_status = True"]
+    # Make script_runtime importable from ../responses/ where generated scripts live
+    # and apply the pipeline's request routing profile to every context the script creates
+    new_lines = ["import sys", f"sys.path.insert(0, {CODEBASE_DIR!r})",
+                 "import script_runtime", "script_runtime.install_context_hooks()",
+                 "success_status = True"]
     new_lines.extend(lines)
     new_lines.append("print('Task completion status:', 'Success' if success_status else 'Failed')")
     return "\n".join(new_lines)
 
-def run_script_and_check(script_path, problem_id):
+def script_env(problem_id, overrides=None):
+    """Environment for a generated script: pipeline settings plus this problem's metrics file and checkpoints"""
+    env = {**os.environ, run_metrics.METRICS_FILE_ENV: f"../responses/{problem_id}_script_metrics.json",
+           CHECKPOINT_DIR_ENV: checkpoint_dir(problem_id)}
+    env.update(overrides or {})
+    return env
+
+def check_script_result(problem_id, stdout, stderr, returncode, events=None):
     """
-    Run script and check result. Returns (success: bool, last_successful_step: int, output: str)
+    Log a finished script run and work out how far it got. Returns (success, last_successful_step, output)
+    events is the step_events summary of the run; when the script reported events they decide the outcome.
     """
-    try:
-        # Run the script with UTF-8 decoding to avoid Windows charmap issues
-        result = run(
-            ["python", script_path],
-            capture_output=True,
-            text=True,
-            encoding="utf-8",     # ✅ Force UTF-8 decoding
-            errors="replace"      # ✅ Replace invalid characters instead of crashing
-        )
-        
-        output_text = result.stdout + result.stderr
-        
-        from utils import log_interaction
-        log_interaction(problem_id, "script_run_output", {
-            "stdout": result.stdout,
-            "stderr": result.stderr,
-            "exit_code": result.returncode
-        })
-
-        # Parse last successful step from output
+    output_text = stdout + stderr
+    log_interaction(problem_id, "script_run_output", {
+        "stdout": stdout,
+        "stderr": stderr,
+        "exit_code": returncode
+    })
+
+    if events is not None:
+        # The script reported its steps: no output parsing, no reconciling with the state file
+        log_interaction(problem_id, "step_events", events)
+        last_successful_step = events["last_successful_step"]
+    else:
+        # Older scripts without step events: parse last successful step from output
         last_successful_step = parse_last_successful_step_from_output(output_text)
-        
+
         # Also try to load from state JSON (in case script saved it)
         try:
             state = load_state(problem_id)
@@ -49,20 +78,63 @@ def run_script_and_check(script_path, problem_id):
                 last_successful_step = file_step
         except:
             pass
-        
-        # Save last successful step to state JSON
-        try:
-            save_state(problem_id, last_successful_step=last_successful_step)
-        except Exception as e:
-            print(f"[WARNING] Failed to save last successful step: {e}")
+    
+    # Save last successful step (and whether events decided it) to state JSON
+    try:
+        save_state(problem_id, last_successful_step=last_successful_step, step_events=events or {})
+    except Exception as e:
+        print(f"[WARNING] Failed to save last successful step: {e}")
 
-        if result.returncode == 0:
-            return True, last_successful_step, output_text
-        else:
-            print("Exit code from script:", result.returncode)
-            print("---- Script STDOUT ----\n", result.stdout)
-            print("---- Script STDERR ----\n", result.stderr)
-            return False, last_successful_step, output_text
+    if returncode == 0:
+        return True, last_successful_step, output_text
+    else:
+        print("Exit code from script:", returncode)
+        print("---- Script STDOUT ----\n", stdout)
+        print("---- Script STDERR ----\n", stderr)
+        return False, last_successful_step, output_text
+
+def save_aborted_state(problem_id, events):
+    """State file of a script that was stopped (it never reached its own final save), rebuilt from its step events"""
+    step_urls = {step: record["url"] for step, record in events["steps"].items() if record["status"] == "succeeded"}
+    state = {
+        "last_successful_step": events["last_successful_step"],
+        "step_urls": step_urls,
+        "recovery_url": events["error"]["url"] if events["error"] else step_urls.get(str(events["last_successful_step"]))
+    }
+    with open(get_state_file_path(problem_id), "w") as f:
+        json.dump(state, f, indent=2)
+
+def run_script_and_check(script_path, problem_id, env=None):
+    """
+    Run script and check result. Returns (success: bool, last_successful_step: int, output: str)
+    """
+    env = env or script_env(problem_id)
+    reset_checkpoints(env[CHECKPOINT_DIR_ENV])
+    # A run that crashes before writing its own state must not inherit the previous run's step URLs
+    reset_state(problem_id)
+    # Step events arrive over a local socket while the script runs (see step_events.py); the monitor
+    # stops the run at the first failed step (abort_on_failure), at a deadline or above the memory limit
+    monitor = ExecutionMonitor(on_event=print_event)
+    listener = StepEventListener(on_event=monitor.on_event)
+    env = {**env, STEP_EVENTS_ENV: listener.address}
+    try:
+        # Warm worker browser when enabled (see script_worker.py); None falls back to a fresh process
+        result = run_in_worker(script_path, abort_env(env, "exit"), monitor=monitor)
+        if result is None:
+            # Output is read as it arrives (UTF-8, invalid characters replaced to avoid Windows charmap issues)
+            result = run_streamed(["python", script_path], abort_env(env, "kill"), monitor=monitor,
+                                  tracker=get_tracker(problem_id))
+        listener.close()
+        # Browsers and drivers the script left behind are reaped here, not by name across the host
+        reap_run(problem_id)
+        events = listener.summary()
+        run_metrics.absorb_file(env[run_metrics.METRICS_FILE_ENV])
+        log_interaction(problem_id, "script_execution", {key: result.get(key) for key in
+                        ("ended", "elapsed", "peak_rss_mb", "cpu_seconds", "mode")})
+        # A worker job that ended itself at its failed step reports "normal"; the monitor saw the failure
+        if (monitor.reason is not None or result["ended"] != "normal") and events is not None:
+            save_aborted_state(problem_id, events)
+        return check_script_result(problem_id, result["stdout"], result["stderr"], result["returncode"], events=events)
 
     except CalledProcessError as e:
         print("Exit code from script:", e.returncode)
@@ -74,48 +146,199 @@ def run_script_and_check(script_path, problem_id):
         except:
             pass
         return False, last_successful_step, ""
+    finally:
+        listener.close()
 
 
 
 def kill_browser_processes():
-    """Kill all running browser processes (Chrome/Firefox)."""
-    for proc in psutil.process_iter(['pid', 'name']):
-        try:
-            name = proc.info['name'].lower() if proc.info['name'] else ""
-            if any(browser in name for browser in ["firefox", "chrome", "msedge", "chromium"]):
-                proc.kill()
-                print(f"[INFO] Killed browser process (PID: {proc.info['pid']}, Name: {proc.info['name']})")
-        except (psutil.NoSuchProcess, psutil.AccessDenied):
-            pass
+    """Kill the browser processes this pipeline started (see process_tracker.py); other runs on the host are left alone."""
+    reaped = reap_all()
+    if reaped:
+        print(f"[INFO] Killed {reaped} process(es) started by this pipeline")
+
+
+def build_planner_input(config, failure_reason, dom_tree, selectors, dom_snapshots, problem_id, resume=None):
+    """Planner text input: intent, previous failure and (in delta mode) what changed on the page"""
+    nlp_input = config['intent']
+    if failure_reason:
+        nlp_input += f"\n\n[Previous Failure Reason]: {failure_reason}"
+    if resume is not None:
+        completed = "\n".join(f"Step {i + 1} - {step['action_label']} - {step['element_type']} - {step['action']}"
+                               for i, step in enumerate(resume['completed_steps']))
+        nlp_input += (f"\n\n[Already Completed Steps]:\n{completed}\n\nThese steps were executed and verified; the "
+                      f"screenshot shows the page after them. Plan ONLY the remaining steps, numbered from Step 1.")
+
+    # Structural diff against the previous iteration's capture (keyed by element identity)
+    if dom_snapshots is not None:
+        dom_diff = dom_snapshots.capture(dom_tree, selectors)
+        if dom_diff is not None:
+            print(f"[INFO] DOM diff since previous capture: {dom_diff.stats()}")
+            log_interaction(problem_id, "dom_diff", dom_diff.stats())
+            page_changes = dom_snapshots.planner_summary() if dom_snapshots.delta_active() else ""
+            if page_changes:
+                nlp_input += f"\n\n[Page Changes Since Previous Iteration]:\n{page_changes}"
+    return nlp_input
+
+
+def build_element_index(config, dom_tree, selectors, dom_snapshots):
+    """Index of the capture's interactive elements (reuses the records parsed for DOM diffing)"""
+    index_conf = config.get('element_index') or {}
+    if dom_snapshots is not None and dom_snapshots.current is not None:
+        return ElementIndex(dom_snapshots.current.records, index_conf)
+    return ElementIndex.from_html(dom_tree, index_conf, selectors)
+
+
+def prepare_scripter_dom(config, dom_tree, selectors, parsed_plan, dom_snapshots, problem_id):
+    """DOM section of the scripter prompt: delta, per-step candidates, compact DOM or filtered HTML"""
+    whitelist = list({step['element_type'].lower() for step in parsed_plan})
+    compaction_conf = config.get('dom_compaction') or {}
+    index_conf = config.get('element_index') or {}
+    delta_dom = dom_snapshots.scripter_delta(parsed_plan) if dom_snapshots is not None and dom_snapshots.delta_active() else None
+    if delta_dom is not None:
+        # Only the changed elements plus the unchanged ones the plan most likely needs
+        filtered_dom = delta_dom
+        print(f"[INFO] Sending DOM delta to the scripter ({len(delta_dom.encode('utf-8'))} bytes)")
+        log_interaction(problem_id, "dom_delta", {"bytes": len(delta_dom.encode("utf-8")), **dom_snapshots.diff.stats()})
+    elif index_conf.get('enabled', True):
+        # Index the page's interactive elements once and give the scripter the top-k per plan step
+        index_start = time.perf_counter()
+        element_index = build_element_index(config, dom_tree, selectors, dom_snapshots)
+        filtered_dom = format_step_candidates(parsed_plan, element_index)
+        index_stats = {"elements": len(element_index.records), "steps": len(parsed_plan),
+                       "top_k": element_index.conf["top_k"], "bytes": len(filtered_dom.encode("utf-8")),
+                       "elapsed": round(time.perf_counter() - index_start, 3)}
+        print(f"[INFO] Element index: {index_stats['elements']} elements, "
+              f"{index_stats['bytes']} bytes of step candidates in {index_stats['elapsed']}s")
+        log_interaction(problem_id, "element_index", index_stats)
+    elif compaction_conf.get('enabled', True):
+        # One line per element instead of raw HTML, trimmed to the scripter's token budget
+        filtered_dom, compaction_stats = compact_dom(dom_tree, whitelist, conf=compaction_conf, selectors=selectors)
+        print(f"[INFO] Compact DOM: {compaction_stats['raw_bytes']} -> {compaction_stats['compact_bytes']} bytes "
+              f"(~{compaction_stats['estimated_tokens']} tokens)")
+        log_interaction(problem_id, "dom_compaction", compaction_stats)
+    else:
+        filtered_dom = filter_dom_by_whitelist(dom_tree, whitelist)
+    return filtered_dom
+
 
+def suffix_resume_point(problem_id, completed_steps, parsed_plan):
+    """
+    Where the next iteration resumes after a script failed past a verified prefix. With checkpoints
+    enabled: the latest checkpoint that is safe to resume from (see checkpoints.latest_resumable).
+    Otherwise: the URL of the last step of the verified prefix and the storage state the script
+    saved. None when there is nothing to resume from.
 
-def run_pipeline(start_url, screenshot_path, script_path, config, problem_id, failure_reason=None, iteration_num=0):
+    The verified prefix comes from this run's step events; the state file (reset before every run)
+    is only read for scripts that sent none.
+    """
+    try:
+        state = load_state(problem_id)
+    except Exception:
+        state = {}
+    events = state.get("step_events")
+    if events:
+        verified = min(events["last_successful_step"], len(parsed_plan))
+        step_urls = {step: record.get("url") for step, record in events["steps"].items()
+                     if record["status"] == "succeeded" and record.get("url")}
+    else:
+        # Only steps 1..N that all recorded a URL are verified: a step that ran after a failed one
+        # may have recorded a URL too, but the failed step before it never took effect
+        step_urls = state.get("step_urls", {})
+        verified = 0
+        while verified < len(parsed_plan) and str(verified + 1) in step_urls:
+            verified += 1
+    if verified == 0 or (str(verified) not in step_urls and not load_checkpoint_config()["enabled"]):
+        return None
+    storage_path = os.path.abspath(f"../responses/{problem_id}_resume_storage.json")
+
+    if load_checkpoint_config()["enabled"]:
+        checkpoint = latest_resumable(list_checkpoints(checkpoint_dir(problem_id)), verified)
+        if checkpoint is None:
+            print(f"[INFO] No checkpoint up to step {verified} can be resumed without repeating a commit step")
+            return None
+        # Copied out of the checkpoint directory, which the next run starts by clearing
+        checkpoint_path = os.path.abspath(f"../responses/{problem_id}_resume_checkpoint.json")
+        with open(storage_path, "w") as f:
+            json.dump(checkpoint.pop("storage_state"), f)
+        with open(checkpoint_path, "w") as f:
+            json.dump(checkpoint, f, indent=2)
+        return {"url": checkpoint["url"], "completed_steps": list(completed_steps) + parsed_plan[:checkpoint["step"]],
+                "storage_state": storage_path, "checkpoint": checkpoint_path}
+
+    saved_storage = capture_paths()["storage_path"]
+    if os.path.exists(saved_storage):
+        # Copied so the resumed run can overwrite last_update_* without touching its starting state
+        shutil.copyfile(saved_storage, storage_path)
+    else:
+        storage_path = None
+    return {"url": step_urls[str(verified)], "completed_steps": list(completed_steps) + parsed_plan[:verified],
+            "storage_state": storage_path}
+
+
+def run_pipeline(start_url, screenshot_path, script_path, config, problem_id, failure_reason=None, iteration_num=0, screenshot_index=None, dom_snapshots=None, step_scripter=None, resume=None):
     """
     Run pipeline.
     Returns: (success: bool, last_successful_step: int, output: str, parsed_plan: list, script_code: str)
     """
     # Check if screenshot already exists (from previous iteration)
     # If it exists and is last_update.png, use it; otherwise take fresh screenshot
+    profile_path = config.get('playwright_user_data_dir', None)
+    bundle = None
     if os.path.exists(screenshot_path) and screenshot_path.endswith("last_update.png"):
         print(f"[INFO] Reusing existing screenshot: {screenshot_path}")
-        # Still need DOM tree, so get it from the URL
-        profile_path = config.get('playwright_user_data_dir', None)
-        dom_tree = get_dom_tree(start_url)
-    else:
-        # Take fresh screenshot
-        profile_path = config.get('playwright_user_data_dir', None)
-        dom_tree, _ = get_screenshot(start_url, screenshot_path, profile_path)
+        # The script dumps DOM + URL alongside the screenshot, so no navigation is needed
+        bundle = load_capture_bundle(os.path.splitext(screenshot_path)[0])
+        if bundle is None:
+            print("[WARNING] No capture bundle matches the screenshot, capturing the page again")
+    if bundle is None:
+        # Take fresh screenshot, DOM and metadata in a single navigation
+        bundle = capture_page(start_url, screenshot_path, profile_path,
+                              storage_state=resume['storage_state'] if resume is not None else None)
+        screenshot_path = bundle["screenshot_path"]
         print("screenshot captured")
+    print(f"[INFO] Capture of {bundle['final_url']} (viewport {bundle['viewport']}, timing {bundle['timing']})")
+    # Raw HTML: filter_dom_by_whitelist parses it in one streaming pass
+    dom_tree = bundle["html"]
+    # In-page validated selectors keyed by stable element ID (None if precomputation is off)
+    selectors = bundle.get("selectors")
     
     with open(screenshot_path, "rb") as f:
         screenshot_bytes = f.read()
 
-    nlp_input = config['intent']
-    if failure_reason:
-        nlp_input += f"\n\n[Previous Failure Reason]: {failure_reason}"
-
-    print(f"\n[ITERATION {iteration_num + 1}] Calling Planner...")
-    plan_text, parsed_plan = generate_plan(nlp_input, screenshot_bytes, config['planner'], problem_id)
+    nlp_input = build_planner_input(config, failure_reason, dom_tree, selectors, dom_snapshots, problem_id, resume)
+    # Suffix recovery: the generated script starts from the saved cookies/local storage (and checkpoint)
+    resume_env = {}
+    if resume is not None and resume['storage_state']:
+        resume_env[RESUME_STORAGE_ENV] = resume['storage_state']
+    if resume is not None and resume.get('checkpoint'):
+        resume_env[RESUME_CHECKPOINT_ENV] = resume['checkpoint']
+    env = script_env(problem_id, resume_env)
+
+    # Same page + same prompt as an earlier iteration: reuse that plan instead of calling the planner
+    cached_plan, plan_fingerprint, changed_region = None, None, None
+    if screenshot_index is not None:
+        cached_plan, plan_fingerprint, changed_region = screenshot_index.lookup("planner", nlp_input, screenshot_bytes)
+        if changed_region is not None:
+            log_interaction(problem_id, "screenshot_diff", {"stage": "planner", "region": list(changed_region)})
+
+    spec_conf = load_speculative_config(config.get('speculative'))
+    if spec_conf['enabled'] and cached_plan is None:
+        return run_speculative_iteration(start_url, screenshot_bytes, script_path, config, problem_id, nlp_input,
+                                         dom_tree, selectors, dom_snapshots, spec_conf, iteration_num,
+                                         screenshot_index, plan_fingerprint, env)
+
+    if cached_plan is not None:
+        print(f"\n[ITERATION {iteration_num + 1}] Reusing plan for unchanged screenshot and prompt")
+        plan_text = cached_plan
+        parsed_plan = parse_plan(plan_text)
+        log_interaction(problem_id, "planner_response_reused", plan_text)
+    else:
+        print(f"\n[ITERATION {iteration_num + 1}] Calling Planner...")
+        plan_text, parsed_plan = generate_plan(nlp_input, screenshot_bytes, config['planner'], problem_id,
+                                               on_step=lambda line: print(f"[STREAM] Planner: {line}"))
+        if screenshot_index is not None:
+            screenshot_index.store("planner", nlp_input, plan_fingerprint, plan_text)
     
     # Validate that we have a parsable plan
     if not parsed_plan or len(parsed_plan) == 0:
@@ -123,11 +346,23 @@ def run_pipeline(start_url, screenshot_path, script_path, config, problem_id, fa
         print(f"[ERROR] {error_msg}")
         return False, 0, error_msg, [], ""
 
-    whitelist = list({step['element_type'].lower() for step in parsed_plan})
-    filtered_dom = filter_dom_by_whitelist(dom_tree, whitelist)
-
-    print(f"\n[ITERATION {iteration_num + 1}] Calling Scripter...")
-    script_code = generate_script(parsed_plan, filtered_dom, start_url, screenshot_bytes, config['scripter'], problem_id)
+    script_code = None
+    if step_scripter is not None:
+        # One cached fragment per plan step, assembled into the runnable script (see step_scripter.py)
+        print(f"\n[ITERATION {iteration_num + 1}] Calling Step Scripter...")
+        element_index = build_element_index(config, dom_tree, selectors, dom_snapshots)
+        try:
+            script_code = step_scripter.generate(parsed_plan, element_index, bundle['final_url'], start_url,
+                                                 config['scripter'], problem_id)
+        except Exception as e:
+            print(f"[WARNING] Step scripter failed ({e}); falling back to the monolithic scripter")
+            run_metrics.incr("fragments.fallbacks")
+    if script_code is None:
+        filtered_dom = prepare_scripter_dom(config, dom_tree, selectors, parsed_plan, dom_snapshots, problem_id)
+
+        print(f"\n[ITERATION {iteration_num + 1}] Calling Scripter...")
+        script_code = generate_script(parsed_plan, filtered_dom, start_url, screenshot_bytes, config['scripter'], problem_id,
+                                      on_step=lambda step, block: print(f"[STREAM] Scripter: step {step} ready ({len(block)} chars)"))
     
     try:
         wrapped_script = wrap_script_with_exit_handling(script_code)
@@ -138,7 +373,9 @@ def run_pipeline(start_url, screenshot_path, script_path, config, problem_id, fa
         return False, 0, error_msg, [], ""
 
     try:
-        success, last_step, output = run_script_and_check(script_path, problem_id)
+        success, last_step, output = run_script_and_check(script_path, problem_id, env)
+        if step_scripter is not None:
+            step_scripter.record_run(success, load_state(problem_id).get("step_events"), output)
         return success, last_step, output, parsed_plan, script_code
 
     except SyntaxError as e:  # Capturing syntax errors specifically
@@ -146,7 +383,7 @@ def run_pipeline(start_url, screenshot_path, script_path, config, problem_id, fa
         try:
             corrected_script = correct_script(script_code, str(e), config['scripter'], problem_id)
             save_script_to_file(corrected_script, path=script_path)
-            success, last_step, output = run_script_and_check(script_path, problem_id)
+            success, last_step, output = run_script_and_check(script_path, problem_id, env)
             return success, last_step, output, parsed_plan, corrected_script
         except Exception as correction_error:
             error_msg = f"Failed to correct script: {str(correction_error)}"
@@ -157,6 +394,37 @@ def run_pipeline(start_url, screenshot_path, script_path, config, problem_id, fa
         print(f"An error occurred while executing the script: {str(e)}")
         return False, 0, str(e), parsed_plan, script_code
 
+def run_speculative_iteration(start_url, screenshot_bytes, script_path, config, problem_id, nlp_input, dom_tree,
+                              selectors, dom_snapshots, spec_conf, iteration_num, screenshot_index, plan_fingerprint, env):
+    """
+    run_pipeline with several plan/script candidates generated, ranked and raced (see speculative.py).
+    Same return value as run_pipeline.
+    """
+    print(f"\n[ITERATION {iteration_num + 1}] Generating {spec_conf['candidates']} speculative candidates...")
+    candidates = generate_candidates(
+        nlp_input, screenshot_bytes, start_url, config, problem_id,
+        lambda parsed_plan: prepare_scripter_dom(config, dom_tree, selectors, parsed_plan, dom_snapshots, problem_id),
+        spec_conf)
+    ranked = rank_candidates(candidates, dom_tree, selectors)
+    for candidate in ranked:
+        print(f"[INFO] Candidate {candidate['index']} (temperature {candidate['temperature']}): {candidate['checks']}")
+
+    reset_state(problem_id)
+    winner = race_candidates(ranked, wrap_script_with_exit_handling, env, problem_id, spec_conf)
+    if winner is None:
+        best = ranked[0]
+        error_msg = best.get("error") or f"No runnable speculative candidate. Planner response: {best['plan_text'][:500]}"
+        print(f"[ERROR] {error_msg}")
+        return False, 0, error_msg, best["parsed_plan"], best["script_code"]
+
+    print(f"[INFO] Speculative winner: candidate {winner['index']} (temperature {winner['temperature']})")
+    if screenshot_index is not None:
+        screenshot_index.store("planner", nlp_input, plan_fingerprint, winner["plan_text"])
+    save_script_to_file(wrap_script_with_exit_handling(winner["script_code"]), path=script_path)
+    success, last_step, output = check_script_result(problem_id, winner["stdout"], winner["stderr"], winner["returncode"],
+                                                 events=winner.get("step_events"))
+    return success, last_step, output, winner["parsed_plan"], winner["script_code"]
+
 def extract_successful_steps_from_script(script_code, last_successful_step):
     """
     Extract the successful steps from script code up to last_successful_step.
@@ -187,6 +455,27 @@ def extract_successful_steps_from_script(script_code, last_successful_step):
     return "\n".join(successful_lines)
 
 def execute_pipeline_until_success(config, problem_id):
+    # Warm browsers are reused by every capture in this run (see browser_pool.py)
+    configure_browser_pool(config.get('browser_pool'))
+    configure_page_settle(config.get('page_settle'))
+    configure_image_budget(config.get('image_budget'))
+    configure_request_routing(config.get('request_routing'))
+    configure_har(config.get('har'), problem_id)
+    configure_selector_cache(config.get('selector_cache'))
+    checkpoint_conf = configure_checkpoints(config.get('checkpoints'))
+    # Pooled keep-alive LLM clients and cached prompt templates for every stage
+    configure_llm_gateway(config.get('llm_gateway'))
+    configure_llm_cache(config.get('llm_cache'))
+    configure_script_worker(config.get('script_worker'))
+    configure_script_execution(config.get('script_execution'))
+    run_metrics.reset()
+    # Perceptual-hash index of screenshots seen this run (skips redundant planner/answering calls)
+    screenshot_index = ScreenshotIndex(config.get('screenshot_dedupe'))
+    # Previous capture's DOM, so later iterations can send only what changed
+    dom_snapshots = DomSnapshotStore(config.get('dom_snapshots'))
+    # Per-step fragments with a fragment cache instead of one monolithic script
+    step_scripter_conf = config.get('step_scripter') or {}
+    step_scripter = StepScripter(step_scripter_conf) if step_scripter_conf.get('enabled', False) else None
     original_url = config['start_url']
     print("Start URL - ", original_url)
     screenshot_path = f"../responses/{problem_id}_screenshot.png"
@@ -201,6 +490,12 @@ def execute_pipeline_until_success(config, problem_id):
     # Track successful steps and scripts across all iterations
     all_successful_steps = []  # List of step dictionaries
     all_successful_scripts = []  # List of script code strings
+    script_spans = []  # (first step, end step) of the plan each script part covers
+
+    # Suffix recovery: after a partial run, resume from the last verified step instead of replanning it all
+    # (checkpoints imply it, since resuming is what they are for)
+    suffix_recovery = (config.get('suffix_recovery') or {}).get('enabled', False) or checkpoint_conf['enabled']
+    resume = None
 
     while not success and iteration_count < MAX_ITERATIONS:
         print(f"\n{'='*60}")
@@ -208,12 +503,18 @@ def execute_pipeline_until_success(config, problem_id):
         if last_successful_step > 0:
             print(f"[INFO] Last successful step: {last_successful_step}")
         
-        # Always start from beginning (no backtracking)
-        original_url = config['start_url']
+        # Start from the beginning unless resuming after a verified prefix
+        original_url = resume['url'] if resume is not None else config['start_url']
+        offset = len(resume['completed_steps']) if resume is not None else 0
         
         # Check if last_update.png exists from previous iteration - use it instead of taking fresh screenshot
         last_update_path = "../responses/last_update.png"
-        if iteration_count > 0 and os.path.exists(last_update_path):
+        last_bundle = load_capture_bundle(os.path.splitext(last_update_path)[0]) if resume is not None else None
+        if resume is not None and (last_bundle is None or last_bundle['final_url'] != original_url):
+            # The script ended on another page: capture the page at the last verified step instead
+            print(f"[INFO] Resuming after step {offset}: capturing {original_url}")
+            screenshot_path = f"../responses/{problem_id}_screenshot.png"
+        elif iteration_count > 0 and os.path.exists(last_update_path):
             print(f"[INFO] Using screenshot from previous iteration: {last_update_path}")
             screenshot_path = last_update_path
         elif iteration_count == 0:
@@ -238,12 +539,16 @@ def execute_pipeline_until_success(config, problem_id):
             config, 
             problem_id, 
             failure_reason=failure_reason,
-            iteration_num=iteration_count
+            iteration_num=iteration_count,
+            screenshot_index=screenshot_index,
+            dom_snapshots=dom_snapshots,
+            step_scripter=step_scripter,
+            resume=resume
         )
         
-        # Update last successful step if we made progress
-        if step_reached > last_successful_step:
-            last_successful_step = step_reached
+        # Update last successful step if we made progress (suffix runs number their steps from 1)
+        if offset + step_reached > last_successful_step:
+            last_successful_step = offset + step_reached
             print(f"[INFO] Updated last successful step to {last_successful_step}")
             
             # Extract successful steps from this iteration's plan
@@ -254,13 +559,14 @@ def execute_pipeline_until_success(config, problem_id):
             successful_script = extract_successful_steps_from_script(script_code, step_reached)
             if successful_script:
                 all_successful_scripts.append(successful_script)
+                script_spans.append((offset, offset + step_reached))
             
             # Save URL and screenshot at last successful step
             try:
                 state = load_state(problem_id)
                 step_urls = state.get("step_urls", {})
-                if str(last_successful_step) in step_urls:
-                    step_url = step_urls[str(last_successful_step)]
+                if str(step_reached) in step_urls:
+                    step_url = step_urls[str(step_reached)]
                     print(f"[INFO] Saved URL at step {last_successful_step}: {step_url}")
                 
                 # Screenshot is already saved at last_update.png by the script
@@ -275,6 +581,7 @@ def execute_pipeline_until_success(config, problem_id):
                 print(f"[WARNING] Failed to save last successful step: {e}")
         
         if iteration_success:
+            resume = None
             # Use last_update.png from script execution instead of taking fresh screenshot
             last_update_path = "../responses/last_update.png"
             if os.path.exists(last_update_path):
@@ -299,8 +606,16 @@ def execute_pipeline_until_success(config, problem_id):
                 except Exception as e:
                     print("Failed to capture fresh screenshot, reusing previous one:", e)
 
-            print(f"\n[ITERATION {iteration_count + 1}] Calling Answering LLM...")
-            llm_result, llm_output = evaluate_task_completion(screenshot_path)
+            with open(screenshot_path, "rb") as f:
+                eval_screenshot_bytes = f.read()
+            cached_eval, eval_fingerprint, _ = screenshot_index.lookup("answering", config['intent'], eval_screenshot_bytes)
+            if cached_eval is not None:
+                print(f"\n[ITERATION {iteration_count + 1}] Reusing Answering LLM verdict for unchanged screenshot")
+                llm_result, llm_output = cached_eval
+            else:
+                print(f"\n[ITERATION {iteration_count + 1}] Calling Answering LLM...")
+                llm_result, llm_output = evaluate_task_completion(screenshot_path)
+                screenshot_index.store("answering", config['intent'], eval_fingerprint, (llm_result, llm_output))
 
             if "Success" in llm_result:
                 print("Answering LLM reported success. Ending process.")
@@ -308,6 +623,8 @@ def execute_pipeline_until_success(config, problem_id):
             elif "Failure" in llm_result:
                 print("Answering LLM reported failure. Continuing to next iteration.")
                 previous_llm_result = llm_output
+                if step_scripter is not None:
+                    step_scripter.record_rejected()
                 try:
                     state = load_state(problem_id)
                     updated_url = state.get("recovery_url", config['start_url'])
@@ -321,16 +638,18 @@ def execute_pipeline_until_success(config, problem_id):
             else:
                 print("Unexpected response from LLM. Re-evaluating.")
                 previous_llm_result = None
+                if step_scripter is not None:
+                    step_scripter.record_rejected()
                 
         else:
             print(f"[INFO] Plan execution failed. Last successful step: {last_successful_step}")
             
-            # Try to parse last successful step from output if available
-            if 'output' in locals() and output:
+            # Try to parse last successful step from output if available (not needed when the script sent step events)
+            if 'output' in locals() and output and not load_state(problem_id).get("step_events"):
                 parsed_step = parse_last_successful_step_from_output(output)
-                if parsed_step > 0 and parsed_step > last_successful_step:
+                if parsed_step > 0 and offset + parsed_step > last_successful_step:
                     print(f"[INFO] Parsed last successful step from output: {parsed_step}")
-                    last_successful_step = parsed_step
+                    last_successful_step = offset + parsed_step
                     
                     # Extract successful steps from this iteration's plan
                     successful_steps = parsed_plan[:parsed_step] if parsed_step <= len(parsed_plan) else parsed_plan
@@ -340,16 +659,53 @@ def execute_pipeline_until_success(config, problem_id):
                     successful_script = extract_successful_steps_from_script(script_code, parsed_step)
                     if successful_script:
                         all_successful_scripts.append(successful_script)
+                        script_spans.append((offset, offset + parsed_step))
                     
                     try:
                         save_state(problem_id, last_successful_step=last_successful_step)
                     except Exception as e:
                         print(f"[WARNING] Failed to save last successful step: {e}")
+
+            if suffix_recovery and parsed_plan:
+                next_resume = suffix_resume_point(problem_id, resume['completed_steps'] if resume is not None else [], parsed_plan)
+                if next_resume is not None:
+                    resume = next_resume
+                    if len(resume['completed_steps']) < last_successful_step:
+                        # Resuming from an earlier checkpoint: the steps after it run again, so they
+                        # are no longer part of the successful prefix
+                        last_successful_step = len(resume['completed_steps'])
+                        all_successful_steps[:] = resume['completed_steps']
+                        truncate_script_parts(all_successful_scripts, script_spans, last_successful_step)
+                        save_state(problem_id, last_successful_step=last_successful_step)
+                    print(f"[INFO] Next iteration resumes after step {len(resume['completed_steps'])} at {resume['url']}")
+                    log_interaction(problem_id, "suffix_resume", {"completed_steps": len(resume['completed_steps']),
+                                                                  "url": resume['url'], "storage_state": resume['storage_state']})
         
         print(f"[INFO] Iteration {iteration_count + 1} completed")
         iteration_count += 1
 
-    # Concatenate all successful steps and scripts
+    save_final_outputs(problem_id, all_successful_steps, all_successful_scripts, iteration_count)
+
+    # Leak report for this problem's scripts (reaps whatever is still running)
+    end_scope(problem_id, problem_id)
+    metrics = run_metrics.log_run_metrics(problem_id)
+    print(f"[INFO] Run metrics: {metrics}")
+
+    if not success:
+        print(f"❌ Task failed after {MAX_ITERATIONS} iterations. Terminating.")
+
+def truncate_script_parts(script_parts, spans, step_count):
+    """Drop the script parts (and lines) for steps at or after step_count; spans[i] is the step range of script_parts[i]"""
+    while spans and spans[-1][0] >= step_count:
+        spans.pop()
+        script_parts.pop()
+    if spans and spans[-1][1] > step_count:
+        start = spans[-1][0]
+        script_parts[-1] = extract_successful_steps_from_script(script_parts[-1], step_count - start)
+        spans[-1] = (start, step_count)
+
+def save_final_outputs(problem_id, all_successful_steps, all_successful_scripts, iteration_count):
+    """Write the final plan and combined script from the successful steps of all iterations"""
     if all_successful_steps:
         print(f"\n{'='*60}")
         print(f"[FINAL] Concatenating {len(all_successful_steps)} successful steps from {iteration_count} iterations")
@@ -392,9 +748,6 @@ def execute_pipeline_until_success(config, problem_id):
             
             log_interaction(problem_id, "final_combined_script", combined_script)
 
-    if not success:
-        print(f"❌ Task failed after {MAX_ITERATIONS} iterations. Terminating.")
-
 def extract_successful_plan_steps(parsed_plan, last_successful_step):
     """
     Extracts the steps from the parsed plan up to the last successful step.
@@ -437,3 +790,9 @@ if __name__ == "__main__":
         execute_pipeline_until_success(config, problem_id)
     except Exception as e:
         print("Pipeline error occurred:", e)
+    finally:
+        shutdown_browser_pool()
+        shutdown_script_worker()
+        # Warm pool and worker processes that did not exit with them
+        end_scope("pipeline", problem_id)
+        reap_all()
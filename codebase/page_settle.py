@@ -0,0 +1,154 @@
+# page_settle.py
+"""
+Page-settle detection used instead of fixed sleeps and `networkidle` waits.
+Strategies are looked up by name in SETTLE_STRATEGIES; add new ones with register_settle_strategy().
+Generated scripts read the same configuration from the TESSARA_PAGE_SETTLE environment variable.
+"""
+import json, os, time
+
+SETTLE_CONFIG_ENV = "TESSARA_PAGE_SETTLE"
+
+DEFAULT_SETTLE_CONFIG = {
+    "strategy": "adaptive",       # adaptive | networkidle | fixed
+    "quiet_window_ms": 500,       # DOM, layout and requests must be quiet this long
+    "timeout_ms": 10000,          # Give up and capture anyway after this long
+    "poll_interval_ms": 100,
+    "max_request_age_ms": 5000,   # Older in-flight requests (beacons, long polls) are ignored
+    "fixed_delay_ms": 2000,       # Used by the fixed and networkidle strategies
+}
+
+# Installed once per document. Tracks DOM mutations, layout shifts and in-flight fetch/XHR requests.
+SETTLE_PROBE_JS = """() => {
+    if (window.__tessaraSettle) return;
+    const s = {lastChange: performance.now(), pending: new Map(), nextId: 0, mutations: 0, shifts: 0};
+    const touch = () => { s.lastChange = performance.now(); };
+    new MutationObserver(records => { s.mutations += records.length; touch(); })
+        .observe(document, {subtree: true, childList: true, attributes: true, characterData: true});
+    try {
+        new PerformanceObserver(list => {
+            for (const entry of list.getEntries()) {
+                if (!entry.hadRecentInput) { s.shifts++; touch(); }
+            }
+        }).observe({type: 'layout-shift', buffered: true});
+    } catch (e) {}
+    const begin = () => { const id = s.nextId++; s.pending.set(id, performance.now()); touch(); return id; };
+    const end = id => { if (s.pending.delete(id)) touch(); };
+    if (window.fetch) {
+        const originalFetch = window.fetch;
+        window.fetch = function (...args) {
+            const id = begin();
+            return originalFetch.apply(this, args).finally(() => end(id));
+        };
+    }
+    const originalSend = XMLHttpRequest.prototype.send;
+    XMLHttpRequest.prototype.send = function (...args) {
+        const id = begin();
+        this.addEventListener('loadend', () => end(id));
+        return originalSend.apply(this, args);
+    };
+    s.snapshot = maxAge => {
+        const now = performance.now();
+        let pending = 0;
+        for (const started of s.pending.values()) { if (now - started < maxAge) pending++; }
+        return {quietFor: now - s.lastChange, pending: pending, mutations: s.mutations, shifts: s.shifts};
+    };
+    window.__tessaraSettle = s;
+}"""
+
+SETTLE_SNAPSHOT_JS = "maxAge => { (" + SETTLE_PROBE_JS + ")(); return window.__tessaraSettle.snapshot(maxAge); }"
+
+
+def load_settle_config(settle_conf=None):
+    """Defaults, overridden by TESSARA_PAGE_SETTLE, overridden by settle_conf"""
+    conf = dict(DEFAULT_SETTLE_CONFIG)
+    env_conf = os.environ.get(SETTLE_CONFIG_ENV)
+    if env_conf:
+        try:
+            conf.update(json.loads(env_conf))
+        except ValueError:
+            print(f"[WARNING] Ignoring invalid {SETTLE_CONFIG_ENV}: {env_conf}")
+    conf.update(settle_conf or {})
+    return conf
+
+
+def configure_page_settle(settle_conf=None):
+    """Apply the `page_settle` section of config.yaml to this process and the scripts it starts"""
+    if settle_conf:
+        os.environ[SETTLE_CONFIG_ENV] = json.dumps(settle_conf)
+    else:
+        os.environ.pop(SETTLE_CONFIG_ENV, None)
+
+
+def install_settle_probe(context):
+    """Install the probe on a BrowserContext before navigation so requests from page start are counted"""
+    context.add_init_script(script="(" + SETTLE_PROBE_JS + ")();")
+
+
+def _result(strategy, reason, start_time, snapshot=None):
+    result = {"strategy": strategy, "reason": reason, "elapsed": round(time.time() - start_time, 3)}
+    if snapshot:
+        result.update({
+            "mutations": snapshot.get("mutations"),
+            "layout_shifts": snapshot.get("shifts"),
+            "pending_requests": snapshot.get("pending"),
+        })
+    return result
+
+
+def adaptive_settle(page, conf):
+    """Return once the DOM, layout and in-page requests have been quiet for quiet_window_ms"""
+    start_time = time.time()
+    snapshot = None
+    while True:
+        try:
+            snapshot = page.evaluate(SETTLE_SNAPSHOT_JS, conf["max_request_age_ms"])
+        except Exception:
+            # Execution context destroyed by a navigation; the probe is re-installed on the next poll
+            snapshot = None
+        if snapshot and snapshot["pending"] == 0 and snapshot["quietFor"] >= conf["quiet_window_ms"]:
+            return _result("adaptive", "quiet", start_time, snapshot)
+        if (time.time() - start_time) * 1000 >= conf["timeout_ms"]:
+            return _result("adaptive", "timeout", start_time, snapshot)
+        time.sleep(conf["poll_interval_ms"] / 1000)
+
+
+def networkidle_settle(page, conf):
+    """Previous behaviour: wait for networkidle, then a fixed buffer delay"""
+    start_time = time.time()
+    reason = "networkidle"
+    try:
+        page.wait_for_load_state("networkidle", timeout=conf["timeout_ms"])
+    except Exception:
+        reason = "timeout"
+    time.sleep(conf["fixed_delay_ms"] / 1000)
+    return _result("networkidle", reason, start_time)
+
+
+def fixed_settle(page, conf):
+    start_time = time.time()
+    time.sleep(conf["fixed_delay_ms"] / 1000)
+    return _result("fixed", "fixed_delay", start_time)
+
+
+SETTLE_STRATEGIES = {
+    "adaptive": adaptive_settle,
+    "networkidle": networkidle_settle,
+    "fixed": fixed_settle,
+}
+
+
+def register_settle_strategy(name, strategy):
+    """strategy(page, conf) -> dict with at least strategy, reason and elapsed"""
+    SETTLE_STRATEGIES[name] = strategy
+
+
+def wait_for_page_settle(page, settle_conf=None):
+    """Wait for the page to settle using the configured strategy and report why and how long it took"""
+    conf = load_settle_config(settle_conf)
+    strategy = SETTLE_STRATEGIES.get(conf["strategy"])
+    if strategy is None:
+        print(f"[WARNING] Unknown page settle strategy '{conf['strategy']}', using adaptive")
+        strategy = adaptive_settle
+    result = strategy(page, conf)
+    print(f"[INFO] Page settled: {result['reason']} after {result['elapsed']}s ({result['strategy']})")
+    return result
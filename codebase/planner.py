@@ -1,21 +1,19 @@
 #planner.py
 import base64, re
-from openai import AzureOpenAI
 from utils import log_interaction, log_token_usage  # Assume this exists
+from image_prep import image_content_parts
+from llm_gateway import load_prompt, chat_completion, stream_chat_completion, achat_completion, StreamAborted
+from llm_stream import PlanStreamMonitor
 import time
 
-def generate_plan(nlp_task, screenshot, planner_conf, problem_id):
-    start_time = time.time()
-    with open("../prompts/planner_instructions.txt", "r") as f:
-        system_prompt = f.read()
+PLAN_REQUEST = {"model": "gpt-4o", "temperature": 0.7, "max_tokens": 8000}
+
 
-    base64_image = base64.b64encode(screenshot).decode("utf-8") if isinstance(screenshot, bytes) else screenshot
+def build_plan_messages(nlp_task, screenshot, problem_id):
+    system_prompt = load_prompt("planner_instructions.txt")
 
-    client = AzureOpenAI(
-        azure_endpoint=planner_conf['azure_endpoint'],
-        api_key=planner_conf['api_key'],
-        api_version=planner_conf['api_version']
-    )
+    # Downscaled / re-encoded / tiled within the planner's image budget
+    image_parts = image_content_parts(screenshot, "planner")
 
     messages = [
         {"role": "system", "content": system_prompt},
@@ -23,7 +21,7 @@ def generate_plan(nlp_task, screenshot, planner_conf, problem_id):
             "role": "user",
             "content": [
                 {"type": "text", "text": nlp_task},
-                {"type": "image_url", "image_url": {"url": f"data:image/png;base64,{base64_image}"}}
+                *image_parts
             ]
         }
     ]
@@ -33,23 +31,17 @@ def generate_plan(nlp_task, screenshot, planner_conf, problem_id):
     print(f"[PLANNER PROMPT INPUT]")
     print(f"System Prompt :\n{system_prompt}...")
     print(f"\nUser Prompt:\n{nlp_task}")
-    print(f"[Image included: base64 encoded screenshot]")
+    print(f"[Image included: {len(image_parts)} base64 encoded screenshot tile(s)]")
     print(f"{'='*60}\n")
 
     log_interaction(problem_id, "planner_prompt", messages)
+    return messages
+
 
-    response = client.chat.completions.create(
-        model="gpt-4o",
-        messages=messages,
-        temperature=0.7,
-        max_tokens=8000
-    )
-    log_token_usage(response, problem_id, "generate_plan")
+def finish_plan(response_text, problem_id, start_time):
     # Calculate time taken
     elapsed_time = time.time() - start_time
     print(f"Time taken for generating plan: {elapsed_time} seconds")
-
-    response_text = response.choices[0].message.content
     
     # Print planner response output
     print(f"\n{'='*60}")
@@ -63,6 +55,46 @@ def generate_plan(nlp_task, screenshot, planner_conf, problem_id):
     return response_text, parsed_plan
 
 
+def generate_plan(nlp_task, screenshot, planner_conf, problem_id, on_step=None, temperature=None):
+    start_time = time.time()
+    messages = build_plan_messages(nlp_task, screenshot, problem_id)
+    # Speculative candidates sample the same prompt at different temperatures
+    request = dict(PLAN_REQUEST) if temperature is None else {**PLAN_REQUEST, "temperature": temperature}
+
+    if planner_conf.get('stream', True):
+        # Steps are handed to on_step as they arrive; prose answers are cut off early
+        monitor = PlanStreamMonitor(on_step, planner_conf.get('probe_chars', 400))
+        try:
+            response = stream_chat_completion("planner", planner_conf, messages=messages, on_text=monitor, **request)
+            response_text = response.choices[0].message.content
+            monitor.finish(response_text)
+            log_token_usage(response, problem_id, "generate_plan")
+        except StreamAborted as e:
+            # Keep the partial explanation: parse_plan turns it into a fallback step for the feedback loop
+            response_text = e.partial_text
+    else:
+        response = chat_completion("planner", planner_conf, messages=messages, **request)
+        log_token_usage(response, problem_id, "generate_plan")
+        response_text = response.choices[0].message.content
+    return finish_plan(response_text, problem_id, start_time)
+
+
+async def agenerate_plan(nlp_task, screenshot, planner_conf, problem_id, on_step=None):
+    """asyncio counterpart of generate_plan (see async_pipeline.py)"""
+    start_time = time.time()
+    messages = build_plan_messages(nlp_task, screenshot, problem_id)
+    monitor = PlanStreamMonitor(on_step, planner_conf.get('probe_chars', 400)) if planner_conf.get('stream', True) else None
+    try:
+        response = await achat_completion("planner", planner_conf, messages=messages, on_text=monitor, **PLAN_REQUEST)
+        response_text = response.choices[0].message.content
+        if monitor is not None:
+            monitor.finish(response_text)
+        log_token_usage(response, problem_id, "generate_plan")
+    except StreamAborted as e:
+        response_text = e.partial_text
+    return finish_plan(response_text, problem_id, start_time)
+
+
 def parse_plan(plan_text):
     """
     Parse plan text into structured steps.
@@ -0,0 +1,243 @@
+# process_tracker.py
+"""
+Process-tree-scoped cleanup. Instead of killing every chrome/firefox/msedge process on the host,
+each run records the processes it started and only ever reaps those, so several pipelines can
+share one machine.
+
+A ProcessTracker per scope (a problem_id, or "pipeline" for the warm browser pool and the script
+worker) remembers
+    roots       - processes the pipeline spawned (script subprocesses, the script worker)
+    descendants - everything seen below a root or below the pipeline itself (Playwright driver,
+                  browser, renderers), keyed by pid + create time so a reused pid is never hit
+    groups      - process groups those descendants created; Playwright starts browsers in their
+                  own group, so reaping the group also catches helpers that were never sampled
+                  (POSIX only)
+Descendants are refreshed while scripts run (script_executor samples the tree) and before every
+reap. After each script run, reap_run() reports whatever the run left behind as a leak and reaps it;
+end_scope() does the same for a whole problem or for the pipeline at shutdown.
+"""
+import os, signal, threading, time
+from contextlib import contextmanager
+import psutil
+import run_metrics
+
+POSIX = os.name == "posix"
+
+
+def spawn_kwargs():
+    """Popen kwargs that give a spawned script its own process group"""
+    if POSIX:
+        return {"start_new_session": True}
+    import subprocess
+    return {"creationflags": subprocess.CREATE_NEW_PROCESS_GROUP}
+
+
+class ProcessTracker:
+    def __init__(self, scope):
+        self.scope = scope
+        self._lock = threading.Lock()
+        self._processes = {}   # (pid, create_time) -> {"name", "label", "root"}
+        self._groups = {}      # process group id -> label
+        self._own_group = os.getpgid(0) if POSIX else None
+
+    def track(self, pid, label):
+        """Record a process the pipeline spawned (a Popen, asyncio process or pid) and what it started so far"""
+        pid = getattr(pid, "pid", pid)
+        try:
+            process = psutil.Process(pid)
+            self._remember(process, label, root=True)
+        except psutil.Error:
+            return
+        self.refresh(pid, label)
+
+    def track_own_children(self, label, exclude=()):
+        """Record the pipeline's own children (Playwright driver and browsers of the warm pool) not in exclude"""
+        for process in _own_children():
+            if process.pid not in exclude:
+                self._remember(process, label)
+
+    def refresh(self, pid, label=None):
+        """Remember every current descendant of pid"""
+        try:
+            children = psutil.Process(pid).children(recursive=True)
+        except psutil.Error:
+            return
+        for process in children:
+            self._remember(process, label)
+
+    def _remember(self, process, label, root=False):
+        try:
+            key = (process.pid, process.create_time())
+            name = process.name()
+        except psutil.Error:
+            return
+        with self._lock:
+            if key not in self._processes:
+                self._processes[key] = {"name": name, "label": label, "root": root}
+        if POSIX:
+            try:
+                group = os.getpgid(process.pid)
+            except OSError:
+                return
+            if group != self._own_group:
+                with self._lock:
+                    self._groups.setdefault(group, label)
+
+    def alive(self):
+        """Tracked processes that are still running (same pid and create time)"""
+        alive = []
+        with self._lock:
+            entries = list(self._processes.items())
+        for (pid, create_time), info in entries:
+            try:
+                process = psutil.Process(pid)
+                if process.create_time() == create_time and process.status() != psutil.STATUS_ZOMBIE:
+                    alive.append((process, info))
+            except psutil.Error:
+                continue
+        return alive
+
+    def _live_groups(self, label=None):
+        with self._lock:
+            groups = {group for group, group_label in self._groups.items() if label is None or group_label == label}
+        live = set()
+        for group in groups:
+            try:
+                os.killpg(group, 0)
+                live.add(group)
+            except (ProcessLookupError, PermissionError):
+                with self._lock:
+                    self._groups.pop(group, None)
+        return live
+
+    def reap(self, label=None, grace=5):
+        """Terminate tracked processes (only those with `label` if given), then kill survivors. Returns the count."""
+        targets = [process for process, info in self.alive() if label is None or info["label"] == label]
+        for process in targets:
+            for child in _children(process):
+                self._remember(child, label)
+        targets = [process for process, info in self.alive() if label is None or info["label"] == label]
+        groups = self._live_groups(label)
+        if not targets and not groups:
+            return 0
+        _signal_all(targets, groups, signal.SIGTERM)
+        _, survivors = psutil.wait_procs(targets, timeout=grace)
+        groups = groups & self._live_groups(label)
+        if survivors or groups:
+            _signal_all(survivors, groups, signal.SIGKILL if POSIX else signal.SIGTERM)
+            psutil.wait_procs(survivors, timeout=grace)
+            run_metrics.incr("processes.forced_kills", len(survivors))
+        run_metrics.incr("processes.reaped", len(targets))
+        return len(targets)
+
+    def leak_report(self, reap=True, grace=5):
+        """Processes of this scope still alive at the end of a run; reaped unless reap=False"""
+        alive = self.alive()
+        leaked = []
+        now = time.time()
+        for process, info in alive:
+            try:
+                rss_mb = round(process.memory_info().rss / (1024 * 1024), 1)
+                age = round(now - process.create_time(), 1)
+            except psutil.Error:
+                continue
+            leaked.append({"pid": process.pid, "name": info["name"], "label": info["label"],
+                           "rss_mb": rss_mb, "age_s": age})
+        groups = sorted(self._live_groups()) if POSIX else []
+        with self._lock:
+            tracked = len(self._processes)
+        report = {"scope": self.scope, "tracked": tracked, "leaked": leaked, "process_groups": groups, "reaped": 0}
+        if leaked:
+            run_metrics.incr("processes.leaked", len(leaked))
+        if (leaked or groups) and reap:
+            report["reaped"] = self.reap(grace=grace)
+        self._forget_dead()
+        return report
+
+    def _forget_dead(self):
+        alive = set()
+        for process, _ in self.alive():
+            try:
+                alive.add((process.pid, process.create_time()))
+            except psutil.Error:
+                continue
+        with self._lock:
+            self._processes = {key: info for key, info in self._processes.items() if key in alive}
+
+
+def _own_children():
+    try:
+        return psutil.Process().children(recursive=True)
+    except psutil.Error:
+        return []
+
+
+@contextmanager
+def tracking_new_children(label, scope="pipeline"):
+    """Track the children the pipeline process gains inside the block (e.g. a browser launch)"""
+    before = {process.pid for process in _own_children()}
+    yield
+    get_tracker(scope).track_own_children(label, exclude=before)
+
+
+def _children(process):
+    try:
+        return process.children(recursive=True)
+    except psutil.Error:
+        return []
+
+
+def _signal_all(processes, groups, sig):
+    for group in groups:
+        try:
+            os.killpg(group, sig)
+        except (ProcessLookupError, PermissionError):
+            pass
+    for process in processes:
+        try:
+            process.send_signal(sig)
+        except psutil.Error:
+            pass
+
+
+_trackers = {}
+_trackers_lock = threading.Lock()
+
+
+def get_tracker(scope="pipeline"):
+    with _trackers_lock:
+        if scope not in _trackers:
+            _trackers[scope] = ProcessTracker(scope)
+        return _trackers[scope]
+
+
+def reap_run(problem_id):
+    """After a script run of problem_id: whatever the run left alive is a leak; reap and log it"""
+    report = get_tracker(problem_id).leak_report()
+    if report["leaked"] or report["process_groups"]:
+        print(f"[WARNING] {len(report['leaked'])} process(es) outlived the script run; reaped {report['reaped']}")
+        from utils import log_interaction
+        log_interaction(problem_id, "process_leaks", report)
+    return report
+
+
+def end_scope(scope, problem_id=None):
+    """Leak report for one scope (logged under problem_id), reaping what is left, then forget the scope"""
+    with _trackers_lock:
+        tracker = _trackers.pop(scope, None)
+    if tracker is None:
+        return None
+    report = tracker.leak_report()
+    if report["leaked"]:
+        print(f"[WARNING] {len(report['leaked'])} process(es) of {scope} outlived the run; reaped {report['reaped']}")
+    if problem_id is not None:
+        from utils import log_interaction
+        log_interaction(problem_id, "process_leaks", report)
+    return report
+
+
+def reap_all():
+    """Reap every process this pipeline started, in every scope (never anything else on the host)"""
+    with _trackers_lock:
+        trackers = list(_trackers.values())
+    return sum(tracker.reap() for tracker in trackers)
@@ -0,0 +1,143 @@
+# request_routing.py
+"""
+Request interception profiles built on context.route / page.route. The same profile is applied
+to captures (utils.capture_page) and to generated scripts (via script_runtime context hooks),
+so capture and replay load the same resources. Counters go to run_metrics under "routing.".
+"""
+import json, os
+from urllib.parse import urlparse
+import run_metrics
+
+ROUTE_PROFILE_ENV = "TESSARA_ROUTE_PROFILE"
+
+AD_TRACKER_DOMAINS = [
+    "doubleclick.net", "googlesyndication.com", "googleadservices.com", "google-analytics.com",
+    "googletagmanager.com", "googletagservices.com", "adservice.google.com", "facebook.net",
+    "connect.facebook.net", "scorecardresearch.com", "hotjar.com", "segment.io", "segment.com",
+    "mixpanel.com", "amplitude.com", "newrelic.com", "nr-data.net", "criteo.com", "taboola.com",
+    "outbrain.com", "adnxs.com", "quantserve.com", "clarity.ms", "bing.com/bat",
+]
+
+ROUTE_PROFILES = {
+    # Load everything exactly as a user's browser would
+    "faithful": {
+        "allow_resource_types": [],
+        "block_resource_types": [],
+        "allow_domains": [],
+        "block_domains": [],
+        "max_image_bytes": None,
+    },
+    # Skip what the planner and scripter never look at
+    "capture-lite": {
+        "allow_resource_types": [],
+        "block_resource_types": ["font", "media"],
+        "allow_domains": [],
+        "block_domains": AD_TRACKER_DOMAINS,
+        "max_image_bytes": 500000,
+    },
+}
+
+# 1x1 transparent GIF served in place of oversized images
+PLACEHOLDER_GIF = (b"GIF89a\x01\x00\x01\x00\x80\x00\x00\x00\x00\x00\xff\xff\xff!\xf9\x04\x01\x00\x00\x00\x00"
+                   b",\x00\x00\x00\x00\x01\x00\x01\x00\x00\x02\x02D\x01\x00;")
+
+
+def configure_request_routing(routing_conf=None):
+    """
+    Apply the `request_routing` section of config.yaml. The resolved profile is exported through
+    TESSARA_ROUTE_PROFILE so scripts started by the pipeline use the same rules as captures.
+    """
+    routing_conf = routing_conf or {}
+    for name, profile in (routing_conf.get("profiles") or {}).items():
+        ROUTE_PROFILES[name] = dict(ROUTE_PROFILES["faithful"], **profile)
+    profile = resolve_route_profile(routing_conf.get("profile", "faithful"))
+    os.environ[ROUTE_PROFILE_ENV] = json.dumps(profile)
+    return profile
+
+
+def resolve_route_profile(profile=None):
+    """Profile name, profile dict or None (use TESSARA_ROUTE_PROFILE, else faithful) -> profile dict"""
+    if profile is None:
+        profile = os.environ.get(ROUTE_PROFILE_ENV) or "faithful"
+        if profile.startswith("{"):
+            profile = json.loads(profile)
+    if isinstance(profile, str):
+        if profile not in ROUTE_PROFILES:
+            print(f"[WARNING] Unknown route profile '{profile}', using faithful")
+            profile = "faithful"
+        return dict(ROUTE_PROFILES[profile], name=profile)
+    return dict(ROUTE_PROFILES["faithful"], **profile)
+
+
+def _matches_domain(url, domains):
+    parsed = urlparse(url)
+    host = parsed.hostname or ""
+    for domain in domains:
+        if "/" in domain:
+            # Domain plus path prefix, e.g. "bing.com/bat"
+            domain_host, path = domain.split("/", 1)
+            if (host == domain_host or host.endswith("." + domain_host)) and parsed.path.lstrip("/").startswith(path):
+                return domain
+        elif host == domain or host.endswith("." + domain):
+            return domain
+    return None
+
+
+def is_passthrough(profile):
+    return not any(profile.get(key) for key in
+                   ("allow_resource_types", "block_resource_types", "block_domains", "max_image_bytes"))
+
+
+def _block(route, reason_key):
+    run_metrics.incr("routing.blocked_requests")
+    run_metrics.incr(reason_key)
+    try:
+        route.abort("blockedbyclient")
+    except Exception:
+        pass
+
+
+def make_route_handler(profile):
+    def handle(route):
+        request = route.request
+        resource_type = request.resource_type
+        run_metrics.incr("routing.requests")
+
+        if not _matches_domain(request.url, profile["allow_domains"]):
+            domain = _matches_domain(request.url, profile["block_domains"])
+            if domain:
+                return _block(route, f"routing.blocked_domain.{domain}")
+            allowed_types = profile["allow_resource_types"]
+            if resource_type in profile["block_resource_types"] or (allowed_types and resource_type not in allowed_types):
+                return _block(route, f"routing.blocked_type.{resource_type}")
+
+        if resource_type == "image" and profile.get("max_image_bytes"):
+            try:
+                response = route.fetch()
+                body = response.body()
+            except Exception:
+                return route.fallback()
+            if len(body) > profile["max_image_bytes"]:
+                run_metrics.incr("routing.blocked_requests")
+                run_metrics.incr("routing.blocked_type.large_image")
+                run_metrics.incr("routing.blocked_bytes", len(body))
+                return route.fulfill(status=200, content_type="image/gif", body=PLACEHOLDER_GIF)
+            return route.fulfill(response=response, body=body)
+
+        # fallback() rather than continue_() so later handlers (e.g. HAR replay) still apply
+        route.fallback()
+
+    return handle
+
+
+def apply_route_profile(target, profile=None, offline=False):
+    """
+    Install the profile on a BrowserContext or Page; returns the resolved profile.
+    With offline=True (HAR record/replay) images are never fetched to check their size.
+    """
+    profile = resolve_route_profile(profile)
+    if offline:
+        profile["max_image_bytes"] = None
+    if not is_passthrough(profile):
+        target.route("**/*", make_route_handler(profile))
+    return profile
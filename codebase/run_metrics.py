@@ -0,0 +1,72 @@
+# run_metrics.py
+"""
+Per-run counters (blocked requests, cache hits, ...). Generated scripts write their counters to
+the file named by TESSARA_METRICS_FILE at exit; the pipeline merges them with absorb_file().
+"""
+import atexit, json, os, threading
+
+METRICS_FILE_ENV = "TESSARA_METRICS_FILE"
+
+_metrics = {}
+_lock = threading.Lock()
+
+
+def incr(name, amount=1):
+    with _lock:
+        _metrics[name] = _metrics.get(name, 0) + amount
+
+
+def merge(counters, prefix=""):
+    """Add numeric counters (nested dicts are flattened with '.')"""
+    for key, value in counters.items():
+        name = f"{prefix}{key}"
+        if isinstance(value, dict):
+            merge(value, prefix=name + ".")
+        elif isinstance(value, (int, float)) and not isinstance(value, bool):
+            incr(name, value)
+
+
+def snapshot():
+    with _lock:
+        return dict(sorted(_metrics.items()))
+
+
+def reset():
+    with _lock:
+        _metrics.clear()
+
+
+def absorb_file(path):
+    """Merge counters written by a child process, then remove the file"""
+    if not path or not os.path.exists(path):
+        return
+    try:
+        with open(path, "r") as f:
+            merge(json.load(f))
+    except (OSError, ValueError) as e:
+        print(f"[WARNING] Could not read metrics file {path}: {e}")
+    try:
+        os.remove(path)
+    except OSError:
+        pass
+
+
+def log_run_metrics(problem_id):
+    from utils import log_interaction
+    metrics = snapshot()
+    log_interaction(problem_id, "run_metrics", metrics)
+    return metrics
+
+
+def _flush_at_exit():
+    path = os.environ.get(METRICS_FILE_ENV)
+    if not path or not _metrics:
+        return
+    try:
+        with open(path, "w") as f:
+            json.dump(snapshot(), f, indent=2)
+    except OSError:
+        pass
+
+
+atexit.register(_flush_at_exit)
@@ -0,0 +1,119 @@
+# screenshot_dedupe.py
+"""
+Perceptual-hash fingerprinting of screenshots. A per-run ScreenshotIndex remembers the LLM
+result for each (stage, prompt, screenshot) so an unchanged page with an unchanged prompt
+reuses the earlier plan or verdict instead of calling the model again.
+
+A 64-bit hash cannot see small text or form changes on a large screenshot, so a near match on the
+hash alone is never enough: the thumbnails must not differ either (diff_region), and stages listed
+in exact_stages (the answering verdict, which is asked the same question every iteration) only
+reuse a result for a pixel-identical screenshot.
+"""
+import hashlib, io
+from PIL import Image, ImageChops
+import run_metrics
+
+DEFAULT_DEDUPE_CONFIG = {
+    "enabled": True,
+    "hash_size": 8,          # 8 -> 64-bit difference hash
+    "max_distance": 2,       # Hamming distance still treated as "the same page"
+    "thumb_width": 128,      # Thumbnail kept per entry for diff regions
+    "diff_threshold": 24,    # Grayscale delta that counts as a changed pixel
+    "exact_stages": ["answering"],  # Stages that only reuse results for pixel-identical screenshots
+}
+
+
+def perceptual_hash(image, hash_size=8):
+    """Difference hash (dHash) of a PIL image as an int"""
+    gray = image.convert("L").resize((hash_size + 1, hash_size), Image.LANCZOS)
+    pixels = list(gray.getdata())
+    value = 0
+    for row in range(hash_size):
+        for col in range(hash_size):
+            left = pixels[row * (hash_size + 1) + col]
+            right = pixels[row * (hash_size + 1) + col + 1]
+            value = (value << 1) | (1 if left > right else 0)
+    return value
+
+
+def hamming_distance(a, b):
+    return bin(a ^ b).count("1")
+
+
+class ScreenshotFingerprint:
+    def __init__(self, image_bytes, conf):
+        image = Image.open(io.BytesIO(image_bytes))
+        image.load()
+        self.size = image.size
+        self.digest = hashlib.sha256(image.mode.encode() + repr(image.size).encode() + image.tobytes()).hexdigest()
+        self.phash = perceptual_hash(image, conf["hash_size"])
+        thumb_height = max(1, int(image.height * conf["thumb_width"] / max(1, image.width)))
+        self.thumb = image.convert("L").resize((conf["thumb_width"], thumb_height), Image.BILINEAR)
+
+
+def diff_region(previous, current, threshold=24):
+    """Bounding box (left, top, right, bottom) of the changed area in current-screenshot pixels, or None"""
+    prev_thumb = previous.thumb
+    if prev_thumb.size != current.thumb.size:
+        prev_thumb = prev_thumb.resize(current.thumb.size, Image.BILINEAR)
+    delta = ImageChops.difference(prev_thumb, current.thumb).point(lambda v: 255 if v > threshold else 0)
+    box = delta.getbbox()
+    if box is None:
+        return None
+    scale_x = current.size[0] / current.thumb.size[0]
+    scale_y = current.size[1] / current.thumb.size[1]
+    return (int(box[0] * scale_x), int(box[1] * scale_y), int(box[2] * scale_x), int(box[3] * scale_y))
+
+
+class ScreenshotIndex:
+    """Per-run index of screenshot fingerprints and the LLM results produced for them"""
+
+    def __init__(self, dedupe_conf=None):
+        self.conf = dict(DEFAULT_DEDUPE_CONFIG)
+        self.conf.update(dedupe_conf or {})
+        self.entries = []          # (stage, prompt_hash, fingerprint, result)
+        self.last_by_stage = {}    # stage -> fingerprint of the last screenshot seen
+
+    @staticmethod
+    def _prompt_hash(prompt_text):
+        return hashlib.sha256((prompt_text or "").encode("utf-8")).hexdigest()
+
+    def lookup(self, stage, prompt_text, image_bytes):
+        """
+        Return (cached_result, fingerprint, diff_box). cached_result is None on a miss;
+        diff_box is the region that changed since the previous screenshot of this stage.
+        """
+        if not self.conf["enabled"]:
+            return None, None, None
+        fingerprint = ScreenshotFingerprint(image_bytes, self.conf)
+        prompt_hash = self._prompt_hash(prompt_text)
+
+        previous = self.last_by_stage.get(stage)
+        self.last_by_stage[stage] = fingerprint
+        box = None
+        if previous is not None:
+            box = diff_region(previous, fingerprint, self.conf["diff_threshold"])
+
+        for entry_stage, entry_prompt, entry_fp, result in reversed(self.entries):
+            if entry_stage == stage and entry_prompt == prompt_hash and self._same_page(stage, entry_fp, fingerprint):
+                run_metrics.incr(f"dedupe.{stage}.hits")
+                print(f"[INFO] Screenshot unchanged for {stage} (phash {fingerprint.phash:016x}), reusing previous result")
+                return result, fingerprint, box
+
+        run_metrics.incr(f"dedupe.{stage}.misses")
+        if box is not None:
+            print(f"[INFO] Screenshot changed for {stage} in region {box}")
+        return None, fingerprint, box
+
+    def _same_page(self, stage, previous, current):
+        if previous.digest == current.digest:
+            return True
+        if stage in self.conf["exact_stages"]:
+            return False
+        return hamming_distance(previous.phash, current.phash) <= self.conf["max_distance"] and \
+            diff_region(previous, current, self.conf["diff_threshold"]) is None
+
+    def store(self, stage, prompt_text, fingerprint, result):
+        if fingerprint is None:
+            return
+        self.entries.append((stage, self._prompt_hash(prompt_text), fingerprint, result))
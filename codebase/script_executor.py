@@ -0,0 +1,221 @@
+# script_executor.py
+"""
+Supervised, streaming execution of generated scripts. The script runs as a subprocess whose
+output is read while it runs, next to the step events it sends (see step_events.py), instead of a
+blocking subprocess.run that only returns once every remaining step has waited out its timeouts.
+
+An ExecutionMonitor watches the run and stops it when
+    failure     - abort_on_failure is set and a step failed after saving its capture bundle
+                  (step_events.step_failed); the replan can start from the failing page right away
+    timeout     - the run exceeded `deadline` seconds
+    step_timeout- the current step (from its step_start event) exceeded `step_deadline` seconds
+    memory      - the RSS of the script's process tree (script, Playwright driver, browser)
+                  exceeded `max_rss_mb`
+Stopping is graceful first (terminate the tree, wait `grace` seconds), then forced (kill).
+Every result reports how the run ended, its peak RSS and the CPU time of the process tree.
+
+Abort modes passed to scripts in TESSARA_ABORT_ON_FAILURE:
+    kill    - the executor terminates the process (subprocess runs)
+    exit    - the script ends itself after the capture (warm worker jobs, see script_worker.py)
+"""
+import threading, time
+from subprocess import Popen, PIPE, TimeoutExpired
+import psutil
+from step_events import ABORT_ENV
+from process_tracker import spawn_kwargs
+import run_metrics
+
+DEFAULT_EXECUTION_CONFIG = {
+    "abort_on_failure": False,
+    "deadline": 900,          # Seconds for the whole script; 0 disables
+    "step_deadline": 300,     # Seconds for one step, measured from its step_start event; 0 disables
+    "max_rss_mb": 0,          # RSS limit of the script's process tree; 0 disables
+    "grace": 5,               # Seconds between terminate and kill
+    "sample_interval": 0.5,   # Seconds between resource samples
+}
+
+_execution_config = dict(DEFAULT_EXECUTION_CONFIG)
+
+
+def configure_script_execution(execution_conf=None):
+    """Apply the `script_execution` section of config.yaml"""
+    global _execution_config
+    conf = dict(DEFAULT_EXECUTION_CONFIG)
+    conf.update(execution_conf or {})
+    _execution_config = conf
+    return conf
+
+
+def abort_env(env, mode):
+    """env with the abort mode for the script, when abort_on_failure is enabled"""
+    if not _execution_config["abort_on_failure"]:
+        return env
+    return {**env, ABORT_ENV: mode}
+
+
+class ExecutionMonitor:
+    """
+    Consumes a run's step events (on_event, called from the listener thread) and decides when the
+    run has to be stopped (check, called from the executor loop). `reason` stays None for a run
+    that ends on its own.
+    """
+
+    def __init__(self, conf=None, on_event=None):
+        self.conf = conf or _execution_config
+        self.forward = on_event
+        self.stop = threading.Event()
+        self.reason = None
+        self.detail = ""
+        self._lock = threading.Lock()
+        self._step = None
+        self._step_started = None
+
+    def on_event(self, event):
+        if self.forward is not None:
+            self.forward(event)
+        with self._lock:
+            if event.get("event") == "step_start":
+                self._step, self._step_started = event.get("step"), time.time()
+            elif event.get("event") in ("step_end", "step_error"):
+                self._step, self._step_started = None, None
+        if self.conf["abort_on_failure"] and event.get("event") == "step_error" and event.get("captured"):
+            self._trigger("failure", f"step {event.get('step')} failed")
+
+    def check(self, start_time, rss_mb):
+        now = time.time()
+        if self.conf["deadline"] and now - start_time > self.conf["deadline"]:
+            self._trigger("timeout", f"exceeded the {self.conf['deadline']}s deadline")
+        with self._lock:
+            step, step_started = self._step, self._step_started
+        if self.conf["step_deadline"] and step_started is not None and now - step_started > self.conf["step_deadline"]:
+            self._trigger("step_timeout", f"step {step} exceeded the {self.conf['step_deadline']}s step deadline")
+        if self.conf["max_rss_mb"] and rss_mb > self.conf["max_rss_mb"]:
+            self._trigger("memory", f"process tree RSS {round(rss_mb)} MB exceeded {self.conf['max_rss_mb']} MB")
+        return self.stop.is_set()
+
+    def _trigger(self, reason, detail):
+        with self._lock:
+            if self.reason is None:
+                self.reason, self.detail = reason, detail
+        self.stop.set()
+
+
+class _TreeUsage:
+    """Samples RSS and CPU time of a process and all its descendants"""
+
+    def __init__(self, pid):
+        self.pid = pid
+        self.peak_rss_mb = 0.0
+        self._cpu = {}   # pid -> last seen user + system seconds (kept after the process exits)
+
+    def sample(self):
+        try:
+            root = psutil.Process(self.pid)
+            processes = [root] + root.children(recursive=True)
+        except psutil.NoSuchProcess:
+            return 0.0
+        rss = 0
+        for process in processes:
+            try:
+                with process.oneshot():
+                    rss += process.memory_info().rss
+                    cpu = process.cpu_times()
+                    self._cpu[process.pid] = cpu.user + cpu.system
+            except psutil.Error:
+                continue
+        rss_mb = rss / (1024 * 1024)
+        self.peak_rss_mb = max(self.peak_rss_mb, rss_mb)
+        return rss_mb
+
+    @property
+    def cpu_seconds(self):
+        return round(sum(self._cpu.values()), 2)
+
+
+def stop_process_tree(proc, grace=None):
+    """Terminate a script process and everything it started (Playwright driver, browser); kill what survives `grace`"""
+    grace = _execution_config["grace"] if grace is None else grace
+    try:
+        children = psutil.Process(proc.pid).children(recursive=True)
+    except psutil.NoSuchProcess:
+        children = []
+    for process in children:
+        try:
+            process.terminate()
+        except psutil.NoSuchProcess:
+            pass
+    proc.terminate()
+    deadline = time.time() + grace
+    try:
+        # The script itself is reaped through Popen so its return code is kept
+        proc.wait(timeout=grace)
+    except TimeoutExpired:
+        pass
+    _, alive = psutil.wait_procs(children, timeout=max(0.0, deadline - time.time()))
+    forced = bool(alive) or proc.poll() is None
+    if proc.poll() is None:
+        proc.kill()
+    for process in alive:
+        try:
+            process.kill()
+        except psutil.NoSuchProcess:
+            pass
+    if forced:
+        run_metrics.incr("execution.forced_kills")
+    proc.wait()
+
+
+def _pump(stream, chunks):
+    for line in iter(stream.readline, ""):
+        chunks.append(line)
+    stream.close()
+
+
+def run_streamed(cmd, env, cwd=None, monitor=None, tracker=None):
+    """
+    Run cmd under `monitor` (an ExecutionMonitor), reading stdout/stderr as they arrive. The process
+    gets its own process group and, with a tracker (process_tracker.ProcessTracker), its tree is
+    recorded at every resource sample. Returns returncode, stdout, stderr, ended ("normal" or the
+    monitor's reason), elapsed, peak_rss_mb and cpu_seconds.
+    """
+    monitor = monitor or ExecutionMonitor()
+    start_time = time.time()
+    proc = Popen(cmd, env=env, cwd=cwd, stdout=PIPE, stderr=PIPE,
+                 text=True, encoding="utf-8", errors="replace", **spawn_kwargs())
+    if tracker is not None:
+        tracker.track(proc, "script")
+    stdout, stderr = [], []
+    readers = [threading.Thread(target=_pump, args=(proc.stdout, stdout), daemon=True),
+               threading.Thread(target=_pump, args=(proc.stderr, stderr), daemon=True)]
+    for reader in readers:
+        reader.start()
+
+    usage = _TreeUsage(proc.pid)
+    next_sample = 0.0
+    rss_mb = 0.0
+    while proc.poll() is None:
+        if time.time() >= next_sample:
+            rss_mb = usage.sample()
+            if tracker is not None:
+                tracker.refresh(proc.pid, "script")
+            next_sample = time.time() + monitor.conf["sample_interval"]
+        if monitor.check(start_time, rss_mb) or monitor.stop.wait(0.1):
+            stop_process_tree(proc, monitor.conf["grace"])
+            break
+    # Leftover children (a Playwright driver that outlived the script) can hold the pipes open;
+    # they are reaped afterwards, so do not wait for them to close
+    drain_deadline = time.time() + 2
+    for reader in readers:
+        reader.join(timeout=max(0.0, drain_deadline - time.time()))
+
+    ended = monitor.reason or "normal"
+    elapsed = round(time.time() - start_time, 2)
+    stderr_text = "".join(stderr)
+    if ended != "normal":
+        run_metrics.incr(f"execution.ended.{ended}")
+        print(f"[WATCHDOG] Script stopped after {elapsed}s: {monitor.detail}")
+        if ended != "failure":
+            stderr_text += f"\n[WATCHDOG] Script stopped: {monitor.detail}\n"
+    return {"returncode": proc.returncode, "stdout": "".join(stdout), "stderr": stderr_text,
+            "ended": ended, "elapsed": elapsed, "peak_rss_mb": round(usage.peak_rss_mb, 1),
+            "cpu_seconds": usage.cpu_seconds}
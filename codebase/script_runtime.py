@@ -0,0 +1,181 @@
+# script_runtime.py
+"""
+Helpers shared by the pipeline and by generated Playwright scripts.
+Generated scripts get the codebase directory on sys.path (see main.wrap_script_with_exit_handling)
+so they can `from script_runtime import ...`.
+"""
+import json, os, time
+
+CAPTURE_PREFIX_ENV = "TESSARA_CAPTURE_PREFIX"
+DEFAULT_CAPTURE_PREFIX = "../responses/last_update"
+# Storage state (cookies, local storage) a generated script starts from when resuming mid-task
+RESUME_STORAGE_ENV = "TESSARA_RESUME_STORAGE"
+
+
+def capture_paths(prefix=None):
+    """Screenshot, DOM and metadata paths that make up one capture bundle"""
+    prefix = prefix or os.environ.get(CAPTURE_PREFIX_ENV) or DEFAULT_CAPTURE_PREFIX
+    return {
+        "screenshot_path": prefix + ".png",
+        "dom_path": prefix + ".html",
+        "meta_path": prefix + "_capture.json",
+        "storage_path": prefix + "_storage.json",
+    }
+
+
+def save_capture_bundle(page, prefix=None, full_page=True, timing=None, extra=None):
+    """
+    Dump screenshot, serialized DOM, final URL and viewport of the current page
+    state in one go, so the next iteration never has to navigate again.
+    """
+    paths = capture_paths(prefix)
+    os.makedirs(os.path.dirname(paths["screenshot_path"]) or ".", exist_ok=True)
+
+    start = time.time()
+    page.screenshot(path=paths["screenshot_path"], full_page=full_page)
+    screenshot_done = time.time()
+    html = page.content()
+    dom_done = time.time()
+
+    viewport = page.viewport_size
+    if not viewport:
+        viewport = page.evaluate("() => ({width: window.innerWidth, height: window.innerHeight})")
+
+    with open(paths["dom_path"], "w", encoding="utf-8") as f:
+        f.write(html)
+
+    # Validated selectors for the scripter (cached per URL + DOM hash, see selector_cache.py)
+    selectors = None
+    try:
+        from selector_cache import page_selectors
+        selectors = page_selectors(page, html)
+    except Exception as e:
+        print(f"[WARNING] Selector precomputation failed: {e}")
+    selectors_done = time.time()
+
+    # Cookies and local storage at this point, so a later run can resume from this page state
+    storage_path = None
+    try:
+        page.context.storage_state(path=paths["storage_path"])
+        storage_path = paths["storage_path"]
+    except Exception as e:
+        print(f"[WARNING] Storage state not saved: {e}")
+
+    timing = dict(timing or {})
+    timing["screenshot"] = round(screenshot_done - start, 3)
+    timing["dom"] = round(dom_done - screenshot_done, 3)
+    timing["selectors"] = round(selectors_done - dom_done, 3)
+
+    meta = {
+        "final_url": page.url,
+        "viewport": viewport,
+        "full_page": full_page,
+        "captured_at": time.time(),
+        "screenshot_path": paths["screenshot_path"],
+        "dom_path": paths["dom_path"],
+        "screenshot_mtime": os.path.getmtime(paths["screenshot_path"]),
+        "timing": timing,
+        "selectors": selectors,
+        "storage_path": storage_path,
+    }
+    if extra:
+        meta.update(extra)
+    with open(paths["meta_path"], "w", encoding="utf-8") as f:
+        json.dump(meta, f, indent=2)
+
+    meta["meta_path"] = paths["meta_path"]
+    meta["html"] = html
+    return meta
+
+
+def load_capture_bundle(prefix=None):
+    """
+    Load a bundle written by save_capture_bundle. Returns None when it is missing
+    or when the screenshot was rewritten afterwards (DOM would describe another state).
+    """
+    paths = capture_paths(prefix)
+    if not all(os.path.exists(paths[key]) for key in ("screenshot_path", "dom_path", "meta_path")):
+        return None
+    try:
+        with open(paths["meta_path"], "r", encoding="utf-8") as f:
+            meta = json.load(f)
+        if abs(os.path.getmtime(paths["screenshot_path"]) - meta.get("screenshot_mtime", 0)) > 1:
+            return None
+        with open(paths["dom_path"], "r", encoding="utf-8") as f:
+            meta["html"] = f.read()
+    except (OSError, ValueError):
+        return None
+    meta["meta_path"] = paths["meta_path"]
+    return meta
+
+
+_context_hooks = []
+
+
+def register_context_hook(hook):
+    """hook(target) runs on every BrowserContext (and Browser.new_page page) the script creates"""
+    _context_hooks.append(hook)
+
+
+def _run_context_hooks(target):
+    for hook in _context_hooks:
+        try:
+            hook(target)
+        except Exception as e:
+            print(f"[WARNING] Context hook {getattr(hook, '__name__', hook)} failed: {e}")
+
+
+def _resume_storage(context_kwargs):
+    storage_path = os.environ.get(RESUME_STORAGE_ENV)
+    if storage_path and "storage_state" not in context_kwargs and os.path.exists(storage_path):
+        context_kwargs["storage_state"] = storage_path
+
+
+def install_context_hooks():
+    """
+    Patch Playwright so every context a generated script creates gets the pipeline's
+    HAR replay and request routing profile, without relying on the script to opt in.
+    When resuming mid-task, new contexts also start from the saved storage state (and
+    checkpoint form values / scroll position, see checkpoints.py).
+    """
+    from playwright.sync_api import Browser, BrowserType
+    from har_archive import apply_har, har_active
+    from request_routing import apply_route_profile
+    from checkpoints import track_requests, apply_resume_checkpoint
+    from step_events import track_selectors
+
+    if getattr(Browser, "_tessara_hooked", False):
+        return
+    track_selectors()
+    # HAR first: Playwright runs the most recently added route handler first, and the
+    # routing handler falls back to the HAR handler for requests it does not block
+    register_context_hook(apply_har)
+    register_context_hook(lambda target: apply_route_profile(target, offline=har_active()))
+    register_context_hook(track_requests)
+    register_context_hook(apply_resume_checkpoint)
+
+    original_new_context = Browser.new_context
+    original_new_page = Browser.new_page
+    original_launch_persistent_context = BrowserType.launch_persistent_context
+
+    def new_context(self, *args, **kwargs):
+        _resume_storage(kwargs)
+        context = original_new_context(self, *args, **kwargs)
+        _run_context_hooks(context)
+        return context
+
+    def new_page(self, *args, **kwargs):
+        _resume_storage(kwargs)
+        page = original_new_page(self, *args, **kwargs)
+        _run_context_hooks(page)
+        return page
+
+    def launch_persistent_context(self, *args, **kwargs):
+        context = original_launch_persistent_context(self, *args, **kwargs)
+        _run_context_hooks(context)
+        return context
+
+    Browser.new_context = new_context
+    Browser.new_page = new_page
+    BrowserType.launch_persistent_context = launch_persistent_context
+    Browser._tessara_hooked = True
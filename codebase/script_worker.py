@@ -0,0 +1,443 @@
+# script_worker.py
+"""
+Long-lived execution worker for generated scripts. Starting a new interpreter per script means
+importing Playwright and launching Chrome before step 1; the worker keeps one Playwright
+instance and one warm browser alive and runs each script in-process instead:
+
+    - the pipeline sends a job (script path, working directory, environment) over a local
+      multiprocessing.connection socket and gets back {returncode, stdout, stderr, elapsed}
+    - inside a job, sync_playwright() hands out the warm browser: launch() returns it, every
+      new_context()/new_page() creates a fresh BrowserContext, and close() only closes the
+      contexts of that job, so jobs never share cookies, storage or pages
+    - each job gets its own globals, working directory, environment and captured output
+    - in-process state is put back after every job (_ProcessState): modules the job imported are
+      dropped from sys.modules, attributes a script patched onto Playwright classes are restored,
+      and the pipeline's runtime modules (step events, context hooks, checkpoint activity, settle
+      strategies) are reset to what they were before the job
+
+Jobs still share one interpreter: installed third-party packages the job imported (kept so
+extension modules are not loaded twice) and anything a script changes inside the standard library
+or in native code outlive the job. Scripts that must not share that run in a subprocess.
+
+Scripts that manage their own browser (persistent profiles, Firefox/WebKit, CDP connections,
+subprocesses) are not sent to the worker and run as a separate `python` process as before.
+
+    python script_worker.py        # started by the pipeline; prints "READY host:port" when listening
+"""
+import atexit, contextlib, io, json, os, re, secrets, subprocess, sys, time, traceback
+from multiprocessing.connection import Listener, Client
+
+AUTHKEY_ENV = "TESSARA_WORKER_AUTHKEY"
+WORKER_CONFIG_ENV = "TESSARA_WORKER"
+
+DEFAULT_WORKER_CONFIG = {
+    "enabled": False,
+    "headless": False,
+    "channel": "chrome",
+    "host": "127.0.0.1",
+    "timeout": 600,           # Seconds per job; the worker is restarted when a job overruns
+    "start_timeout": 60,      # Seconds to wait for the worker to start listening
+}
+
+# Scripts that need a browser the worker cannot hand out
+OWN_BROWSER_PATTERNS = re.compile(
+    r"launch_persistent_context|\.firefox\b|\.webkit\b|connect_over_cdp|\.connect\(|async_playwright|"
+    r"\bsubprocess\b|\bmultiprocessing\b|os\.fork|os\._exit"
+)
+
+
+# Pipeline modules the generated scripts use; imported once by the worker and reset after every job
+RUNTIME_MODULES = ("run_metrics", "step_events", "script_runtime", "checkpoints", "page_settle",
+                   "har_archive", "request_routing")
+# Modules a job may import that are kept afterwards
+SHARED_MODULE_ROOTS = ("playwright", "greenlet", "pyee")
+
+
+def needs_own_browser(script_code):
+    return OWN_BROWSER_PATTERNS.search(script_code) is not None
+
+
+# ---------------------------------------------------------------- worker side
+
+class _Job:
+    def __init__(self, browser):
+        self.browser = browser
+        self.contexts = []
+
+    def close(self):
+        for context in self.contexts:
+            try:
+                context.close()
+            except Exception:
+                pass
+        self.contexts = []
+
+
+class _JobBrowser:
+    """What launch() returns inside a job: the warm browser, limited to the job's own contexts"""
+
+    def __init__(self, job):
+        self._job = job
+
+    def new_context(self, **kwargs):
+        context = self._job.browser.new_context(**kwargs)
+        self._job.contexts.append(context)
+        return context
+
+    def new_page(self, **kwargs):
+        return self.new_context(**kwargs).new_page()
+
+    @property
+    def contexts(self):
+        return list(self._job.contexts)
+
+    def close(self, **kwargs):
+        self._job.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+    def __getattr__(self, name):
+        return getattr(self._job.browser, name)
+
+
+class _JobBrowserType:
+    def __init__(self, job, browser_type):
+        self._job = job
+        self._browser_type = browser_type
+
+    def launch(self, **kwargs):
+        return _JobBrowser(self._job)
+
+    def __getattr__(self, name):
+        return getattr(self._browser_type, name)
+
+
+class _JobPlaywright:
+    """Stands in for sync_playwright() inside a job (both `with` and .start()/.stop() forms)"""
+
+    def __init__(self, job, playwright):
+        self._playwright = playwright
+        self.chromium = _JobBrowserType(job, playwright.chromium)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.stop()
+
+    def start(self):
+        return self
+
+    def stop(self):
+        self.chromium._job.close()
+
+    def __getattr__(self, name):
+        return getattr(self._playwright, name)
+
+
+def _shared_module(name, module):
+    root = name.split(".")[0]
+    if root in SHARED_MODULE_ROOTS or root in sys.stdlib_module_names or root in RUNTIME_MODULES:
+        return True
+    path = getattr(module, "__file__", None) or ""
+    return "site-packages" in path or "dist-packages" in path
+
+
+def _playwright_classes():
+    import playwright.sync_api as sync_api
+    return [value for name, value in vars(sync_api).items() if isinstance(value, type) and
+            getattr(value, "__module__", "").startswith("playwright.")]
+
+
+class _ProcessState:
+    """Interpreter state a job can change, captured before the job and put back after it"""
+
+    def __init__(self):
+        import script_runtime, page_settle
+        self.modules = set(sys.modules)
+        self.class_attrs = {cls: dict(vars(cls)) for cls in _playwright_classes()}
+        self.context_hooks = list(script_runtime._context_hooks)
+        self.settle_strategies = dict(page_settle.SETTLE_STRATEGIES)
+
+    def restore(self):
+        import script_runtime, page_settle, step_events
+        for name in set(sys.modules) - self.modules:
+            if not _shared_module(name, sys.modules.get(name)):
+                sys.modules.pop(name, None)
+        for cls, attrs in self.class_attrs.items():
+            for name in set(vars(cls)) - set(attrs):
+                delattr(cls, name)
+            for name, value in attrs.items():
+                if vars(cls).get(name) is not value:
+                    setattr(cls, name, value)
+        script_runtime._context_hooks[:] = self.context_hooks
+        page_settle.SETTLE_STRATEGIES.clear()
+        page_settle.SETTLE_STRATEGIES.update(self.settle_strategies)
+        step_events._current.update(step=None, started=None, selector=None)
+        _reset_checkpoint_activity()
+
+
+def _prepare_runtime():
+    """Import the runtime modules and install the context hooks once, before the first job"""
+    import importlib
+    for name in RUNTIME_MODULES:
+        importlib.import_module(name)
+    import script_runtime
+    script_runtime.install_context_hooks()
+
+
+def _run_job(job_request, playwright, browser):
+    """Execute one script in this process. Returns the structured result sent to the pipeline."""
+    import playwright.sync_api as sync_api
+    import run_metrics, step_events
+
+    job = _Job(browser)
+    process_state = _ProcessState()
+    saved_env, saved_cwd, saved_path = dict(os.environ), os.getcwd(), list(sys.path)
+    original_sync_playwright = sync_api.sync_playwright
+    stdout, stderr = io.StringIO(), io.StringIO()
+    returncode = 0
+    start = time.time()
+    try:
+        os.environ.clear()
+        os.environ.update(job_request["env"])
+        os.chdir(job_request["cwd"])
+        sync_api.sync_playwright = lambda: _JobPlaywright(job, playwright)
+        run_metrics.reset()
+        _reset_checkpoint_activity()
+        with open(job_request["script_path"], "r", encoding="utf-8") as f:
+            code = compile(f.read(), job_request["script_path"], "exec")
+        namespace = {"__name__": "__main__", "__file__": job_request["script_path"]}
+        with contextlib.redirect_stdout(stdout), contextlib.redirect_stderr(stderr):
+            try:
+                exec(code, namespace)
+            except SystemExit as e:
+                returncode = e.code if isinstance(e.code, int) else (0 if e.code is None else 1)
+            except BaseException:
+                traceback.print_exc()
+                returncode = 1
+        _flush_job_metrics(run_metrics)
+        run_metrics.reset()
+    finally:
+        step_events.disconnect()
+        job.close()
+        sync_api.sync_playwright = original_sync_playwright
+        process_state.restore()
+        sys.path[:] = saved_path
+        os.chdir(saved_cwd)
+        os.environ.clear()
+        os.environ.update(saved_env)
+    return {"returncode": returncode, "stdout": stdout.getvalue(), "stderr": stderr.getvalue(),
+            "elapsed": round(time.time() - start, 3), "ended": "normal", "mode": "worker"}
+
+
+def _reset_checkpoint_activity():
+    try:
+        from checkpoints import _activity
+    except ImportError:
+        return
+    _activity.update({"mutations": 0, "at_last_checkpoint": 0, "navigation_method": None})
+
+
+def _flush_job_metrics(run_metrics):
+    # A subprocess writes its counters at exit; a job writes them when it finishes
+    path = os.environ.get(run_metrics.METRICS_FILE_ENV)
+    if path:
+        try:
+            with open(path, "w") as f:
+                json.dump(run_metrics.snapshot(), f, indent=2)
+        except OSError:
+            pass
+
+
+def _launch(playwright, conf):
+    launch_kwargs = {"headless": conf["headless"]}
+    if conf["channel"]:
+        launch_kwargs["channel"] = conf["channel"]
+    return playwright.chromium.launch(**launch_kwargs)
+
+
+def serve():
+    from playwright.sync_api import sync_playwright
+    conf = dict(DEFAULT_WORKER_CONFIG)
+    conf.update(json.loads(os.environ.get(WORKER_CONFIG_ENV) or "{}"))
+    authkey = os.environ[AUTHKEY_ENV].encode()
+    _prepare_runtime()
+    with sync_playwright() as playwright:
+        browser = _launch(playwright, conf)
+        with Listener((conf["host"], 0), authkey=authkey) as listener:
+            host, port = listener.address
+            print(f"READY {host}:{port}", flush=True)
+            while True:
+                with listener.accept() as conn:
+                    while True:
+                        try:
+                            request = conn.recv()
+                        except EOFError:
+                            break
+                        if request.get("op") == "shutdown":
+                            browser.close()
+                            return
+                        if not browser.is_connected():
+                            browser = _launch(playwright, conf)
+                        conn.send(_run_job(request, playwright, browser))
+
+
+# ---------------------------------------------------------------- pipeline side
+
+class ScriptWorkerClient:
+    """Starts the worker on first use and sends it jobs; restarts it after a crash or timeout"""
+
+    def __init__(self, conf):
+        self.conf = conf
+        self.proc = None
+        self.conn = None
+
+    def _start(self):
+        authkey = secrets.token_hex(16)
+        env = {**os.environ, AUTHKEY_ENV: authkey, WORKER_CONFIG_ENV: json.dumps(self.conf)}
+        self.proc = subprocess.Popen([sys.executable, os.path.abspath(__file__)], env=env,
+                                     cwd=os.path.dirname(os.path.abspath(__file__)),
+                                     stdout=subprocess.PIPE, text=True)
+        deadline = time.time() + self.conf["start_timeout"]
+        line = ""
+        while time.time() < deadline and not line.startswith("READY"):
+            line = self.proc.stdout.readline()
+            if not line and self.proc.poll() is not None:
+                raise RuntimeError(f"script worker exited with code {self.proc.returncode}")
+        if not line.startswith("READY"):
+            raise RuntimeError("script worker did not start in time")
+        host, port = line.split()[1].rsplit(":", 1)
+        self.conn = Client((host, int(port)), authkey=authkey.encode())
+        from process_tracker import get_tracker
+        get_tracker().track(self.proc, "script_worker")
+        print(f"[INFO] Script worker ready (PID {self.proc.pid}, {host}:{port})")
+
+    def run(self, script_path, env, cwd=None, monitor=None):
+        """
+        Structured result of one script run, or None if the worker is unavailable. The job is
+        supervised by `monitor` (script_executor.ExecutionMonitor) like a subprocess run: deadlines
+        and the memory limit (RSS of the worker's process tree) restart the worker when exceeded.
+        """
+        import run_metrics
+        from script_executor import ExecutionMonitor, _TreeUsage
+        monitor = monitor or ExecutionMonitor()
+        try:
+            if self.conn is None:
+                self._start()
+            usage = _TreeUsage(self.proc.pid)
+            usage.sample()
+            cpu_before = usage.cpu_seconds
+            usage.peak_rss_mb = 0.0
+            start = time.time()
+            self.conn.send({"op": "run", "script_path": os.path.abspath(script_path),
+                            "cwd": os.path.abspath(cwd or os.getcwd()), "env": dict(env)})
+            ended = self._supervise(monitor, usage, start)
+            if ended is not None:
+                self.stop(force=True)
+                run_metrics.incr(f"execution.ended.{ended}")
+                run_metrics.incr("script_worker.timeouts" if ended == "timeout" else "script_worker.stopped")
+                detail = monitor.detail or f"exceeded the worker timeout of {self.conf['timeout']}s"
+                print(f"[WATCHDOG] Worker job stopped after {round(time.time() - start, 2)}s: {detail}; restarting the worker")
+                return {"returncode": -9, "stdout": "", "stderr": f"[WATCHDOG] Script stopped: {detail}\n",
+                        "elapsed": round(time.time() - start, 2), "ended": ended, "mode": "worker",
+                        "peak_rss_mb": round(usage.peak_rss_mb, 1),
+                        "cpu_seconds": round(usage.cpu_seconds - cpu_before, 2)}
+            result = self.conn.recv()
+        except Exception as e:
+            print(f"[WARNING] Script worker unavailable ({e}); running the script in a subprocess")
+            self.stop(force=True)
+            run_metrics.incr("script_worker.failures")
+            return None
+        usage.sample()
+        result.update(peak_rss_mb=round(usage.peak_rss_mb, 1), cpu_seconds=round(usage.cpu_seconds - cpu_before, 2))
+        run_metrics.incr("script_worker.jobs")
+        return result
+
+    def _supervise(self, monitor, usage, start):
+        """Wait for the job's result; the reason the job has to be stopped, or None once the result is ready"""
+        next_sample = 0.0
+        rss_mb = 0.0
+        failed_at = None
+        while not self.conn.poll(0.1):
+            if time.time() >= next_sample:
+                rss_mb = usage.sample()
+                next_sample = time.time() + monitor.conf["sample_interval"]
+            if time.time() - start > self.conf["timeout"]:
+                return "timeout"
+            if monitor.check(start, rss_mb):
+                if monitor.reason != "failure":
+                    return monitor.reason
+                # The job ends itself after a captured failure ("exit" abort mode); only a job that
+                # does not is stopped
+                failed_at = failed_at or time.time()
+                if time.time() - failed_at > monitor.conf["grace"]:
+                    return "failure"
+        return None
+
+    def stop(self, force=False):
+        if self.conn is not None and not force:
+            try:
+                self.conn.send({"op": "shutdown"})
+            except Exception:
+                pass
+        if self.conn is not None:
+            self.conn.close()
+        self.conn = None
+        if self.proc is not None:
+            try:
+                self.proc.wait(timeout=0 if force else 10)
+            except subprocess.TimeoutExpired:
+                pass
+            if self.proc.poll() is None:
+                self.proc.kill()
+                self.proc.wait()
+            # The worker's browser lives in its own process group and may outlive a killed worker
+            from process_tracker import get_tracker
+            get_tracker().reap(label="script_worker")
+        self.proc = None
+
+
+_worker_config = dict(DEFAULT_WORKER_CONFIG)
+_client = None
+
+
+def configure_script_worker(worker_conf=None):
+    """Apply the `script_worker` section of config.yaml"""
+    global _worker_config
+    conf = dict(DEFAULT_WORKER_CONFIG)
+    conf.update(worker_conf or {})
+    _worker_config = conf
+    return conf
+
+
+def run_in_worker(script_path, env, monitor=None):
+    """Run the script in the warm worker under `monitor`. None means: use the subprocess path instead."""
+    global _client
+    if not _worker_config["enabled"]:
+        return None
+    with open(script_path, "r", encoding="utf-8") as f:
+        if needs_own_browser(f.read()):
+            print("[INFO] Script manages its own browser; running it in a subprocess")
+            return None
+    if _client is None:
+        _client = ScriptWorkerClient(_worker_config)
+    return _client.run(script_path, env, monitor=monitor)
+
+
+def shutdown_script_worker():
+    global _client
+    if _client is not None:
+        _client.stop()
+        _client = None
+
+
+atexit.register(shutdown_script_worker)
+
+
+if __name__ == "__main__":
+    serve()
@@ -1,26 +1,29 @@
 #scripter.py
 import base64, re, time
-from openai import AzureOpenAI
 from utils import log_interaction, log_token_usage
+from image_prep import image_content_parts
+from llm_gateway import load_prompt, chat_completion, stream_chat_completion, achat_completion, StreamAborted
+from llm_stream import ScriptStreamMonitor
 
-def generate_script(plan_steps, filtered_dom, start_url, screenshot, scripter_conf, problem_id):
-    with open("../prompts/scripter_instructions.txt", "r") as f:
-        system_prompt = f.read()
+SCRIPT_REQUEST = {"model": "gpt-4o", "temperature": 0.1, "max_tokens": 10000}
+
+
+def build_script_messages(plan_steps, filtered_dom, start_url, screenshot, problem_id):
+    system_prompt = load_prompt("scripter_instructions.txt")
 
     plan_text = "\n".join(
         [f"Step {i+1} - {step['action_label']} - {step['element_type']} - {step['action']}" for i, step in enumerate(plan_steps)]
     )
-    user_prompt_text = f"Start URL: {start_url}\n\nProblem ID: {problem_id}\n\nIMPORTANT: In the script, replace {{PROBLEM_ID_PLACEHOLDER}} with: {problem_id}\n\nSteps:\n{plan_text}\n\nRelevant DOM:\n{str(filtered_dom)}\n\nCRITICAL FOR BACKTRACKING: You MUST record the URL after EVERY successful step execution. This is not optional - it is required for the backtracking feature to work. For each step:\n1. Before executing: print('Executing Step <N> - <action>')\n2. Update: last_executed_step = <N>\n3. After successful execution (inside try block, after the action succeeds):\n   - step_urls[<N>] = page.url\n   - Print: print(f'[SUCCESS] Step {{<N>}} completed. URL: {{page.url}}')\n\nIMPORTANT: Do NOT save individual step URL files. The step_urls dictionary will be saved to JSON at the end. Only record URLs for successfully completed steps in the step_urls dictionary.\n\nIf a step fails, do NOT record its URL. Only record URLs for successfully completed steps."
+    user_prompt_text = f"Start URL: {start_url}\n\nProblem ID: {problem_id}\n\nIMPORTANT: In the script, replace {{PROBLEM_ID_PLACEHOLDER}} with: {problem_id}\n\nSteps:\n{plan_text}\n\nRelevant DOM:\n{str(filtered_dom)}\n\nCRITICAL FOR BACKTRACKING: You MUST record the URL after EVERY successful step execution. This is not optional - it is required for the backtracking feature to work. For each step:\n1. Before executing: print('Executing Step <N> - <action>') and step_started(<N>, '<action>')\n2. Update: last_executed_step = <N>\n3. After successful execution (inside try block, after the action succeeds):\n   - step_urls[<N>] = page.url\n   - step_succeeded(<N>, page)\n   - Print: print(f'[SUCCESS] Step {{<N>}} completed. URL: {{page.url}}')\n4. In the except block: step_failed(<N>, e, page)\n\nIMPORTANT: Do NOT save individual step URL files. The step_urls dictionary will be saved to JSON at the end. Only record URLs for successfully completed steps in the step_urls dictionary.\n\nIf a step fails, do NOT record its URL. Only record URLs for successfully completed steps."
 
-    base64_image = base64.b64encode(screenshot).decode("utf-8")
-    start_time = time.time()
+    image_parts = image_content_parts(screenshot, "scripter")
     messages = [
         {"role": "system", "content": system_prompt},
         {
             "role": "user",
             "content": [
                 {"type": "text", "text": user_prompt_text},
-                {"type": "image_url", "image_url": {"url": f"data:image/png;base64,{base64_image}"}}
+                *image_parts
             ]
         }
     ]
@@ -30,30 +33,63 @@ def generate_script(plan_steps, filtered_dom, start_url, screenshot, scripter_co
     print(f"[SCRIPTER PROMPT INPUT]")
     print(f"System Prompt (first 500 chars):\n{system_prompt[:500]}...")
     print(f"\nUser Prompt:\n{user_prompt_text}")
-    print(f"[Image included: base64 encoded screenshot]")
+    print(f"[Image included: {len(image_parts)} base64 encoded screenshot tile(s)]")
     print(f"{'='*60}\n")
 
     log_interaction(problem_id, "scripter_prompt", messages)
+    return messages
 
-    client = AzureOpenAI(
-        azure_endpoint=scripter_conf['azure_endpoint'],
-        api_key=scripter_conf['api_key'],
-        api_version=scripter_conf['api_version']
-    )
 
-    response = client.chat.completions.create(
-        model="gpt-4o",
-        messages=messages,
-        temperature=0.1,
-        max_tokens=10000
-    )
+def _scripter_aborted(e, problem_id):
+    error_msg = f"Generated script appears to contain explanatory text instead of code ({e.reason})."
+    print(f"[ERROR] {error_msg}")
+    log_interaction(problem_id, "scripter_error", {"error": error_msg, "partial_response": e.partial_text})
+    return ValueError(error_msg)
+
+
+def generate_script(plan_steps, filtered_dom, start_url, screenshot, scripter_conf, problem_id, on_step=None, temperature=None):
+    start_time = time.time()
+    messages = build_script_messages(plan_steps, filtered_dom, start_url, screenshot, problem_id)
+    request = dict(SCRIPT_REQUEST) if temperature is None else {**SCRIPT_REQUEST, "temperature": temperature}
+
+    if scripter_conf.get('stream', True):
+        # Completed step blocks go to on_step while the rest is generated; prose is cancelled early
+        monitor = ScriptStreamMonitor(on_step, scripter_conf.get('probe_chars', 400))
+        try:
+            response = stream_chat_completion("scripter", scripter_conf, messages=messages, on_text=monitor, **request)
+        except StreamAborted as e:
+            raise _scripter_aborted(e, problem_id)
+        monitor.finish(response.choices[0].message.content)
+    else:
+        response = chat_completion("scripter", scripter_conf, messages=messages, **request)
 
     log_token_usage(response, problem_id, "generate_script")
     # Calculate time taken
     elapsed_time = time.time() - start_time
     print(f"Time taken for generating script: {elapsed_time} seconds")
+    return extract_script(response.choices[0].message.content, problem_id)
+
+
+async def agenerate_script(plan_steps, filtered_dom, start_url, screenshot, scripter_conf, problem_id, on_step=None):
+    """asyncio counterpart of generate_script (see async_pipeline.py)"""
+    start_time = time.time()
+    messages = build_script_messages(plan_steps, filtered_dom, start_url, screenshot, problem_id)
+    monitor = ScriptStreamMonitor(on_step, scripter_conf.get('probe_chars', 400)) if scripter_conf.get('stream', True) else None
+    try:
+        response = await achat_completion("scripter", scripter_conf, messages=messages, on_text=monitor, **SCRIPT_REQUEST)
+    except StreamAborted as e:
+        raise _scripter_aborted(e, problem_id)
+    if monitor is not None:
+        monitor.finish(response.choices[0].message.content)
 
-    script_code = response.choices[0].message.content.strip()
+    log_token_usage(response, problem_id, "generate_script")
+    print(f"Time taken for generating script: {time.time() - start_time} seconds")
+    return extract_script(response.choices[0].message.content, problem_id)
+
+
+def extract_script(response_text, problem_id):
+    """Pull the Python code out of a scripter answer and reject explanatory text"""
+    script_code = response_text.strip()
     
     # Print scripter response output (first 1000 chars)
     print(f"\n{'='*60}")
@@ -119,8 +155,7 @@ def generate_script(plan_steps, filtered_dom, start_url, screenshot, scripter_co
     return script_code
 
 def correct_script(script_code, error_message, scripter_conf, problem_id):
-    with open("../prompts/script_correction_instructions.txt", "r") as f:
-        system_prompt = f.read()
+    system_prompt = load_prompt("script_correction_instructions.txt")
     
     user_prompt_text = f"Original Script:\n{script_code}\n\nError Message:\n{error_message}\n\nPlease correct the script."
     
@@ -131,13 +166,8 @@ def correct_script(script_code, error_message, scripter_conf, problem_id):
     
     log_interaction(problem_id, "script_correction_prompt", messages)
     
-    client = AzureOpenAI(
-        azure_endpoint=scripter_conf['azure_endpoint'],
-        api_key=scripter_conf['api_key'],
-        api_version=scripter_conf['api_version']
-    )
-    
-    response = client.chat.completions.create(
+    response = chat_completion(
+        "correction", scripter_conf,
         model="gpt-3.5",
         messages=messages,
         temperature=0.1,
@@ -0,0 +1,190 @@
+# selector_cache.py
+"""
+Capture-time selector precomputation. A script run in the page ranks stable selectors for every
+interactive element (test IDs, ids, role + name, attributes, text, CSS path) and keeps only the
+ones that match exactly one element. Results are cached on disk per URL and DOM hash, so a
+revisited page is not recomputed, and are keyed by the same stable element IDs as the compact DOM.
+Settings reach generated scripts (which save the next iteration's capture) through TESSARA_SELECTOR_CACHE.
+"""
+import hashlib, json, os
+from dom_compact import (KEY_ATTRIBUTES, IMPLICIT_ROLES, INPUT_ROLES, DEFAULT_COMPACTION_CONFIG,
+                         _GENERATED_ID, stable_element_id)
+from dom_filter import INTERACTIVE_ROLES
+import run_metrics
+
+SELECTOR_CACHE_ENV = "TESSARA_SELECTOR_CACHE"
+
+DEFAULT_SELECTOR_CONFIG = {
+    "enabled": True,
+    "dir": "../responses/selector_cache",
+    "max_selectors": 3,       # Unique selectors kept per element, best first
+    "max_elements": 1500,     # Interactive elements examined per page
+}
+
+TEST_ID_ATTRIBUTES = ["data-testid", "data-test-id", "data-test", "data-qa", "data-cy"]
+
+SELECTOR_JS = """
+(opts) => {
+    const esc = (v) => v.replace(/\\\\/g, '\\\\\\\\').replace(/"/g, '\\\\"');
+    const norm = (v) => (v || '').replace(/\\s+/g, ' ').trim();
+    const generated = new RegExp(opts.generatedId, 'i');
+    const roleSet = new Set(opts.interactiveRoles);
+    const unique = (css) => { try { return document.querySelectorAll(css).length === 1; } catch (e) { return false; } };
+
+    const isInteractive = (el) => {
+        const tag = el.tagName.toLowerCase();
+        if (['a', 'button', 'select', 'textarea', 'summary', 'option'].includes(tag)) return true;
+        if (tag === 'input') return (el.getAttribute('type') || '').toLowerCase() !== 'hidden';
+        return roleSet.has((el.getAttribute('role') || '').toLowerCase());
+    };
+    const roleOf = (el, tag) => {
+        if (el.getAttribute('role')) return el.getAttribute('role');
+        if (tag === 'input') return opts.inputRoles[(el.getAttribute('type') || 'text').toLowerCase()] || 'textbox';
+        return opts.implicitRoles[tag] || tag;
+    };
+    // Same precedence as dom_compact.accessible_name, so stable IDs line up with the compact DOM
+    const nameOf = (el, tag, text) => {
+        const candidates = [el.getAttribute('aria-label'), text, el.getAttribute('title'), el.getAttribute('placeholder'),
+                            (tag === 'input' || tag === 'button') ? el.getAttribute('value') : null,
+                            el.getAttribute('alt'), el.getAttribute('name')];
+        for (const c of candidates) {
+            if (c && c.trim()) return { name: norm(c), fromText: c === text, fromLabel: c === el.getAttribute('aria-label') };
+        }
+        return { name: '', fromText: false, fromLabel: false };
+    };
+    const cssPath = (el) => {
+        const parts = [];
+        let node = el;
+        while (node && node.nodeType === 1 && node !== document.documentElement) {
+            const tag = node.tagName.toLowerCase();
+            if (node !== el && node.id && !generated.test(node.id) && unique('#' + CSS.escape(node.id))) {
+                parts.unshift('#' + CSS.escape(node.id));
+                break;
+            }
+            let index = 1;
+            for (let sib = node.previousElementSibling; sib; sib = sib.previousElementSibling) {
+                if (sib.tagName === node.tagName) index++;
+            }
+            parts.unshift(`${tag}:nth-of-type(${index})`);
+            node = node.parentElement;
+        }
+        return parts.join(' > ');
+    };
+
+    const elements = Array.from(document.querySelectorAll('*')).filter(isInteractive).slice(0, opts.maxElements);
+    const described = elements.map((el) => {
+        const tag = el.tagName.toLowerCase();
+        const text = norm(el.textContent).slice(0, 300);
+        const attrs = {};
+        for (const key of opts.keyAttributes) attrs[key] = el.getAttribute(key);
+        return { el, tag, text, attrs, role: roleOf(el, tag), ...nameOf(el, tag, text) };
+    });
+    const roleNameCount = {};
+    for (const d of described) {
+        const key = d.role + '\\u0000' + d.name;
+        roleNameCount[key] = (roleNameCount[key] || 0) + 1;
+    }
+
+    return described.map((d) => {
+        const { el, tag, attrs } = d;
+        const selectors = [];
+        const add = (kind, selector, isUnique) => {
+            if (isUnique && selectors.length < opts.maxSelectors && !selectors.some((s) => s.selector === selector)) {
+                selectors.push({ kind, selector });
+            }
+        };
+        for (const attr of opts.testIdAttributes) {
+            const value = el.getAttribute(attr);
+            if (value) { const css = `[${attr}="${esc(value)}"]`; add('test-id', css, unique(css)); }
+        }
+        if (el.id && !generated.test(el.id)) { const css = '#' + CSS.escape(el.id); add('id', css, unique(css)); }
+        if (d.name && (d.fromText || d.fromLabel) && d.name.length <= 80) {
+            add('role', `role=${d.role}[name="${esc(d.name)}"s]`, roleNameCount[d.role + '\\u0000' + d.name] === 1);
+        }
+        for (const attr of ['name', 'aria-label', 'placeholder']) {
+            const value = el.getAttribute(attr);
+            if (value) { const css = `${tag}[${attr}="${esc(value)}"]`; add('attribute', css, unique(css)); }
+        }
+        if (d.text && d.text.length <= 40 && ['a', 'button', 'summary'].includes(tag)) {
+            const needle = d.text.toLowerCase();
+            const matches = Array.from(document.getElementsByTagName(tag))
+                .filter((other) => norm(other.textContent).toLowerCase().includes(needle)).length;
+            add('text', `${tag}:has-text("${esc(d.text)}")`, matches === 1);
+        }
+        if (selectors.length < opts.maxSelectors) {
+            const css = cssPath(el);
+            add('css-path', css, unique(css));
+        }
+        return { tag, attrs, name: d.name.slice(0, opts.maxNameChars), selectors };
+    });
+}
+"""
+
+
+def configure_selector_cache(selector_conf):
+    """Apply the `selector_cache` section of config.yaml and export it to child scripts"""
+    conf = dict(DEFAULT_SELECTOR_CONFIG)
+    conf.update(selector_conf or {})
+    conf["dir"] = os.path.abspath(conf["dir"])
+    os.environ[SELECTOR_CACHE_ENV] = json.dumps(conf)
+    return conf
+
+
+def load_selector_config():
+    try:
+        conf = json.loads(os.environ.get(SELECTOR_CACHE_ENV) or "{}")
+    except ValueError:
+        conf = {}
+    merged = dict(DEFAULT_SELECTOR_CONFIG)
+    merged.update(conf)
+    return merged
+
+
+def cache_path(url, html, conf):
+    dom_hash = hashlib.sha1(html.encode("utf-8", errors="replace")).hexdigest()
+    key = hashlib.sha1(f"{url}\n{dom_hash}".encode("utf-8")).hexdigest()
+    return os.path.join(conf["dir"], key + ".json")
+
+
+def compute_selectors(page, conf=None):
+    """Run the selector ranking in the page. Returns {stable element ID: [{kind, selector}, ...]}"""
+    conf = conf or load_selector_config()
+    results = page.evaluate(SELECTOR_JS, {
+        "generatedId": _GENERATED_ID.pattern,
+        "interactiveRoles": sorted(INTERACTIVE_ROLES),
+        "inputRoles": INPUT_ROLES,
+        "implicitRoles": IMPLICIT_ROLES,
+        "keyAttributes": KEY_ATTRIBUTES,
+        "testIdAttributes": TEST_ID_ATTRIBUTES,
+        "maxSelectors": conf["max_selectors"],
+        "maxElements": conf["max_elements"],
+        "maxNameChars": DEFAULT_COMPACTION_CONFIG["max_name_chars"],
+    })
+    selectors = {}
+    for item in results:
+        if item["selectors"]:
+            element_id = stable_element_id(item["tag"], item["attrs"], item["name"])
+            selectors.setdefault(element_id, item["selectors"])
+    return selectors
+
+
+def page_selectors(page, html):
+    """Validated selectors for the current page state, from the cache when URL and DOM are unchanged"""
+    conf = load_selector_config()
+    if not conf["enabled"]:
+        return None
+    path = cache_path(page.url, html, conf)
+    if os.path.exists(path):
+        try:
+            with open(path, "r", encoding="utf-8") as f:
+                selectors = json.load(f)
+            run_metrics.incr("selector_cache.hits")
+            return selectors
+        except (OSError, ValueError):
+            pass
+    run_metrics.incr("selector_cache.misses")
+    selectors = compute_selectors(page, conf)
+    os.makedirs(conf["dir"], exist_ok=True)
+    with open(path, "w", encoding="utf-8") as f:
+        json.dump(selectors, f)
+    return selectors
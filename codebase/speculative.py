@@ -0,0 +1,289 @@
+# speculative.py
+"""
+Speculative iterations: instead of one plan and one script, request several plan/script
+candidates in parallel at different temperatures, rank them locally, then run the best ones at
+the same time. The first run that satisfies the oracle (clean exit with every plan step reached)
+wins and the others are killed along with their browsers.
+
+Ranking needs no browser and no extra LLM call:
+    plan validity      - the plan parsed into real steps (not parse_plan's fallback step)
+    AST check          - the script parses as Python and announces every plan step
+    selector validity  - selectors in the script match exactly one element of the captured DOM
+                         (or are one of the selectors validated in the page at capture time)
+
+Each candidate runs in its own sandbox directory, so its capture bundle, state file and metrics
+never collide with another candidate's; the winner's files are copied back into ../responses.
+"""
+import ast, os, re, shutil, subprocess, time
+from concurrent.futures import ThreadPoolExecutor
+from dom_filter import parse_tree
+from utils import log_interaction, save_script_to_file
+from planner import generate_plan
+from scripter import generate_script
+from script_runtime import CAPTURE_PREFIX_ENV
+from checkpoints import CHECKPOINT_DIR_ENV
+from step_events import StepEventListener, STEP_EVENTS_ENV, completed_prefix
+from process_tracker import get_tracker, spawn_kwargs, reap_run
+import run_metrics
+
+DEFAULT_SPECULATIVE_CONFIG = {
+    "enabled": False,
+    "candidates": 3,
+    "temperatures": [0.2, 0.5, 0.8],  # One per candidate, cycled when there are more candidates
+    "run_top": 2,                     # Best-ranked candidates run concurrently
+    "timeout": 300,                   # Seconds before a running candidate is killed
+    "dir": "../responses/speculative",
+}
+
+SCRIPT_STEP_MARKER = re.compile(r"Executing Step (\d+) -")
+STEP_SUCCESS_MARKER = re.compile(r"\[SUCCESS\] Step (\d+) completed")
+STEP_FAILURE_MARKER = re.compile(r"\[ERROR\] Step (\d+) failed")
+# First string argument of the Playwright calls that take a selector, on a page or frame. Keyboard and
+# mouse calls and calls chained on a locator are not matched: their string is a key or text to type
+# (locator(...).press("Enter")), or a selector relative to the locator
+SCRIPT_SELECTOR = re.compile(
+    r"(?<![\w.])(?:page|frame|\w+_page|\w+_frame)"
+    r"\.(?:locator|click|dblclick|fill|type|check|uncheck|hover|press|select_option|wait_for_selector|query_selector)"
+    r"\(\s*([\"'])(.+?)\1"
+)
+# Playwright-only selector engines that BeautifulSoup cannot evaluate
+PLAYWRIGHT_ENGINES = ("role=", "text=", "xpath=", "//", "internal:", "data-testid=")
+
+
+def load_speculative_config(spec_conf=None):
+    conf = dict(DEFAULT_SPECULATIVE_CONFIG)
+    conf.update(spec_conf or {})
+    return conf
+
+
+def plan_is_valid(parsed_plan):
+    """False for an empty plan or parse_plan's single fallback step built from explanatory text"""
+    if not parsed_plan:
+        return False
+    return not (len(parsed_plan) == 1 and parsed_plan[0]["element_type"] == "Information")
+
+
+def script_checks(script_code, parsed_plan):
+    """(parses as Python, share of plan steps the script announces with "Executing Step N -")"""
+    try:
+        ast.parse(script_code)
+    except SyntaxError:
+        return False, 0.0
+    announced = {int(n) for n in SCRIPT_STEP_MARKER.findall(script_code)}
+    expected = {step["step_number"] for step in parsed_plan}
+    return True, len(announced & expected) / max(1, len(expected))
+
+
+def selector_score(script_code, dom_tree, validated):
+    """
+    Share of the script's selectors that resolve to exactly one element of the captured DOM.
+    Ambiguous selectors and Playwright-only engines count half; unmatched ones count zero.
+    dom_tree is the captured HTML, or a callable returning its parsed tree.
+    """
+    selectors = [match.group(2) for match in SCRIPT_SELECTOR.finditer(script_code)]
+    if not selectors:
+        return 0.5
+    soup = None
+    total = 0.0
+    for selector in selectors:
+        if selector in validated:
+            total += 1.0
+            continue
+        if selector.startswith(PLAYWRIGHT_ENGINES) or ":has-text(" in selector or ">>" in selector:
+            total += 0.5
+            continue
+        if soup is None:
+            # Parsed only for the selectors the precomputed ones do not cover
+            soup = dom_tree() if callable(dom_tree) else parse_tree(dom_tree)
+        try:
+            matches = len(soup.select(selector, limit=2))
+        except Exception:
+            total += 0.5  # Not CSS BeautifulSoup understands; Playwright may still resolve it
+            continue
+        total += {0: 0.0, 1: 1.0}.get(matches, 0.5)
+    return total / len(selectors)
+
+
+def rank_candidates(candidates, dom_tree, selectors=None):
+    """Score candidates in place and return them best first"""
+    soups = []
+
+    def soup():
+        # One parse per ranking, and none when every candidate's selectors were precomputed
+        if not soups:
+            soups.append(parse_tree(dom_tree))
+        return soups[0]
+
+    validated = {entry["selector"] for entries in (selectors or {}).values() for entry in entries}
+    for candidate in candidates:
+        plan_ok = plan_is_valid(candidate["parsed_plan"])
+        script_code = candidate.get("script_code") or ""
+        ast_ok, step_coverage = script_checks(script_code, candidate["parsed_plan"]) if script_code else (False, 0.0)
+        selector_ok = selector_score(script_code, soup, validated) if ast_ok else 0.0
+        candidate["checks"] = {"plan_valid": plan_ok, "ast_ok": ast_ok,
+                               "step_coverage": round(step_coverage, 2), "selectors": round(selector_ok, 2)}
+        candidate["score"] = (plan_ok, ast_ok, round(step_coverage + selector_ok, 3), -candidate["index"])
+    return sorted(candidates, key=lambda c: c["score"], reverse=True)
+
+
+def generate_candidates(nlp_input, screenshot_bytes, start_url, config, problem_id, prepare_dom, conf):
+    """
+    Request conf["candidates"] plan/script pairs in parallel. prepare_dom(parsed_plan) returns the
+    scripter's DOM section for a plan. Failed candidates are kept (with an error) so they rank last.
+    """
+    temperatures = conf["temperatures"] or [None]
+
+    def one(index):
+        temperature = temperatures[index % len(temperatures)]
+        candidate = {"index": index, "temperature": temperature, "plan_text": "", "parsed_plan": [], "script_code": ""}
+        try:
+            candidate["plan_text"], candidate["parsed_plan"] = generate_plan(
+                nlp_input, screenshot_bytes, config['planner'], problem_id, temperature=temperature)
+            if plan_is_valid(candidate["parsed_plan"]):
+                filtered_dom = prepare_dom(candidate["parsed_plan"])
+                candidate["script_code"] = generate_script(
+                    candidate["parsed_plan"], filtered_dom, start_url, screenshot_bytes, config['scripter'],
+                    problem_id, temperature=temperature)
+        except Exception as e:
+            candidate["error"] = str(e)
+            print(f"[WARNING] Speculative candidate {index} failed: {e}")
+        return candidate
+
+    with ThreadPoolExecutor(max_workers=conf["candidates"]) as pool:
+        return list(pool.map(one, range(conf["candidates"])))
+
+
+def _sandbox(conf, problem_id, index):
+    """
+    Working directory for one candidate run. Generated scripts write to ../responses relative to
+    their working directory, so <sandbox>/work + <sandbox>/responses isolates everything they save.
+    """
+    root = os.path.abspath(os.path.join(conf["dir"], problem_id, f"candidate_{index}"))
+    shutil.rmtree(root, ignore_errors=True)
+    os.makedirs(os.path.join(root, "work"))
+    os.makedirs(os.path.join(root, "responses"))
+    return root
+
+
+def _kill_tree(candidate, tracker):
+    """Kill a candidate script and the browsers it launched (only the processes tracked for it)"""
+    candidate["proc"].kill()
+    candidate["proc"].wait()
+    tracker.reap(label=candidate["label"], grace=0)
+
+
+def race_candidates(ranked, wrap_script, env, problem_id, conf):
+    """
+    Run the top conf["run_top"] candidates concurrently. Returns the winning candidate with
+    stdout, stderr and returncode filled in: the first one to satisfy the oracle or, when none
+    does, the one that got furthest. The winner's sandbox files are copied into ../responses.
+    """
+    runnable = [c for c in ranked if c["checks"]["ast_ok"] and c["checks"]["plan_valid"]][:conf["run_top"]]
+    if not runnable:
+        return None
+    tracker = get_tracker(problem_id)
+    running = []
+    for candidate in runnable:
+        root = _sandbox(conf, problem_id, candidate["index"])
+        script_path = os.path.join(root, "work", "playwright_script.py")
+        save_script_to_file(wrap_script(candidate["script_code"]), path=script_path)
+        listener = StepEventListener()
+        candidate_env = {**env, run_metrics.METRICS_FILE_ENV: os.path.join(root, "responses", "script_metrics.json"),
+                         CHECKPOINT_DIR_ENV: os.path.join(root, "checkpoints"), STEP_EVENTS_ENV: listener.address}
+        candidate_env.pop(CAPTURE_PREFIX_ENV, None)  # Default ../responses/last_update, inside the sandbox
+        # Output goes to files so a chatty script never blocks on a full pipe while others are polled
+        stdout_file = open(os.path.join(root, "stdout.txt"), "w+", encoding="utf-8", errors="replace")
+        stderr_file = open(os.path.join(root, "stderr.txt"), "w+", encoding="utf-8", errors="replace")
+        proc = subprocess.Popen(["python", script_path], cwd=os.path.join(root, "work"), env=candidate_env,
+                                stdout=stdout_file, stderr=stderr_file, **spawn_kwargs())
+        candidate.update(sandbox=root, proc=proc, stdout_file=stdout_file, stderr_file=stderr_file, listener=listener,
+                         label=f"candidate_{candidate['index']}")
+        tracker.track(proc, candidate["label"])
+        running.append(candidate)
+    print(f"[INFO] Speculative run of candidates {[c['index'] for c in running]}")
+
+    winner = None
+    finished = []
+    deadline = time.time() + conf["timeout"]
+    while running and winner is None and time.time() < deadline:
+        for candidate in list(running):
+            if candidate["proc"].poll() is None:
+                tracker.refresh(candidate["proc"].pid, candidate["label"])
+                continue
+            running.remove(candidate)
+            _collect(candidate)
+            finished.append(candidate)
+            if _satisfies_oracle(candidate):
+                winner = candidate
+                break
+        time.sleep(0.1)
+
+    for candidate in running:
+        _kill_tree(candidate, tracker)
+        _collect(candidate)
+        candidate["cancelled"] = True
+        run_metrics.incr("speculative.cancelled")
+    if winner is None:
+        candidates = finished or running
+        winner = max(candidates, key=lambda c: (c["steps_reached"], c["returncode"] == 0 and not _failed(c)))
+    else:
+        run_metrics.incr("speculative.oracle_wins")
+
+    reap_run(problem_id)
+    log_interaction(problem_id, "speculative_race", [
+        {"index": c["index"], "temperature": c["temperature"], "checks": c["checks"], "returncode": c["returncode"],
+         "steps_reached": c["steps_reached"], "cancelled": c.get("cancelled", False), "winner": c is winner}
+        for c in runnable
+    ])
+    _adopt_outputs(winner, env.get(CHECKPOINT_DIR_ENV))
+    return winner
+
+
+def _collect(candidate):
+    for stream in ("stdout", "stderr"):
+        handle = candidate.pop(f"{stream}_file")
+        handle.seek(0)
+        candidate[stream] = handle.read()
+        handle.close()
+    candidate["returncode"] = candidate["proc"].returncode
+    listener = candidate.pop("listener")
+    listener.close()
+    candidate["step_events"] = listener.summary()
+    if candidate["step_events"] is not None:
+        candidate["steps_reached"] = candidate["step_events"]["last_successful_step"]
+    else:
+        candidate["steps_reached"] = _steps_reached_from_output(candidate["stdout"])
+    metrics_path = os.path.join(candidate["sandbox"], "responses", "script_metrics.json")
+    run_metrics.absorb_file(metrics_path)
+
+
+def _steps_reached_from_output(stdout):
+    """Completed step prefix from the printed markers, for a script that sent no step events"""
+    failures = [int(n) for n in STEP_FAILURE_MARKER.findall(stdout)]
+    steps = {int(n): {"status": "succeeded"} for n in STEP_SUCCESS_MARKER.findall(stdout)}
+    return completed_prefix(steps, min(failures, default=None))
+
+
+def _failed(candidate):
+    if candidate["step_events"] is not None:
+        return candidate["step_events"]["failed_step"] is not None
+    return "Task completion status: Failed" in candidate["stdout"] or STEP_FAILURE_MARKER.search(candidate["stdout"]) is not None
+
+
+def _satisfies_oracle(candidate):
+    # Generated scripts catch step exceptions and exit 0, so the return code alone proves nothing
+    return candidate["returncode"] == 0 and not _failed(candidate) and \
+        candidate["steps_reached"] >= len(candidate["parsed_plan"])
+
+
+def _adopt_outputs(winner, checkpoint_dir=None):
+    """Copy the winner's capture bundle, state file, checkpoints and anything else it saved into ../responses"""
+    source = os.path.join(winner["sandbox"], "responses")
+    for name in os.listdir(source):
+        path = os.path.join(source, name)
+        if name != "script_metrics.json" and os.path.isfile(path):
+            shutil.copy2(path, os.path.join("../responses", name))
+    checkpoints = os.path.join(winner["sandbox"], "checkpoints")
+    if checkpoint_dir and os.path.isdir(checkpoints):
+        shutil.rmtree(checkpoint_dir, ignore_errors=True)
+        shutil.copytree(checkpoints, checkpoint_dir)
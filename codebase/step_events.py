@@ -0,0 +1,281 @@
+# step_events.py
+"""
+Structured step events. Generated scripts report progress through three helpers instead of the
+pipeline grepping "Executing Step N -" out of their output afterwards:
+
+    step_started(N, "Click on search button")
+    step_succeeded(N, page)
+    step_failed(N, e, page)
+
+Each call sends one JSON line over a local socket to the StepEventListener the pipeline opened
+for this run. TESSARA_STEP_EVENTS holds "<token>@<host>:<port>"; the first line of a connection
+must be the token, and the listener drops connections that do not present it, so no other local
+process can inject events (a fake "captured" failure would stop the run):
+
+    {"event": "step_start" | "step_end" | "step_error", "step": N, "label": ..., "t": ...,
+     "duration": ..., "url": ..., "selector": ..., "error_type": ..., "error": ...}
+
+"selector" is the last selector the step passed to page.locator()/click()/fill()/... (see
+track_selectors). The listener consumes events while the script runs; summarize() turns them
+into the run's outcome, which is authoritative over the printed markers and the state file.
+Without a listener (script run by hand) nothing is sent.
+
+With TESSARA_ABORT_ON_FAILURE set (see script_executor.py), step_failed() first saves the capture
+bundle of the failing page, reports the failure with "captured": true and then stops the script:
+it waits for the pipeline to kill it ("kill") or exits right away ("exit").
+"""
+import hmac, json, os, secrets, socket, threading, time
+
+STEP_EVENTS_ENV = "TESSARA_STEP_EVENTS"
+ABORT_ENV = "TESSARA_ABORT_ON_FAILURE"
+KILL_GRACE = 5  # Seconds an aborting script waits to be killed before it exits itself
+
+# Page methods whose first argument is a selector
+SELECTOR_METHODS = ("locator", "click", "dblclick", "fill", "type", "check", "uncheck", "hover", "press",
+                    "select_option", "set_input_files", "wait_for_selector", "query_selector", "query_selector_all")
+# Page methods that build a locator from role / text / label ...
+GET_BY_METHODS = ("get_by_role", "get_by_text", "get_by_label", "get_by_placeholder", "get_by_alt_text",
+                  "get_by_title", "get_by_test_id")
+
+# Script side: connection to the listener and the step in progress
+_channel = {"address": None, "sock": None}
+_current = {"step": None, "started": None, "selector": None}
+
+
+def _send(event):
+    address = os.environ.get(STEP_EVENTS_ENV)
+    if not address:
+        return
+    if _channel["address"] != address:
+        disconnect()
+        try:
+            token, _, endpoint = address.rpartition("@")
+            host, port = endpoint.rsplit(":", 1)
+            _channel["sock"] = socket.create_connection((host, int(port)), timeout=5)
+            _channel["sock"].sendall((token + "\n").encode("utf-8"))
+        except (OSError, ValueError) as e:
+            print(f"[WARNING] Step events unavailable ({e})")
+            disconnect()
+        _channel["address"] = address
+    if _channel["sock"] is None:
+        return
+    try:
+        _channel["sock"].sendall((json.dumps(event, default=str) + "\n").encode("utf-8"))
+    except OSError:
+        disconnect()
+        _channel["address"] = address  # Do not retry for every event of this run
+
+
+def disconnect():
+    if _channel["sock"] is not None:
+        try:
+            _channel["sock"].close()
+        except OSError:
+            pass
+    _channel["sock"] = None
+    _channel["address"] = None
+
+
+def _page_url(page):
+    try:
+        return page.url if page is not None else None
+    except Exception:
+        return None
+
+
+def step_started(step, label=""):
+    _current.update(step=step, started=time.time(), selector=None)
+    _send({"event": "step_start", "step": step, "label": label, "t": _current["started"]})
+
+
+def step_succeeded(step, page=None):
+    now = time.time()
+    _send({"event": "step_end", "step": step, "t": now, "duration": _duration(step, now),
+           "url": _page_url(page), "selector": _current["selector"]})
+    _current["step"] = None
+
+
+def step_failed(step, error, page=None):
+    now = time.time()
+    abort_mode = os.environ.get(ABORT_ENV)
+    captured = bool(abort_mode) and _capture_failure(page)
+    _send({"event": "step_error", "step": step, "t": now, "duration": _duration(step, now),
+           "url": _page_url(page), "selector": _current["selector"],
+           "error_type": type(error).__name__, "error": str(error)[:2000], "captured": captured})
+    _current["step"] = None
+    if captured:
+        print(f"[ERROR] Step {step} failed: {error}")
+        print("Task Status: Failed (stopped at the first failed step)", flush=True)
+        if abort_mode == "kill" and _channel["sock"] is not None:
+            time.sleep(KILL_GRACE)
+        raise SystemExit(1)
+
+
+def _capture_failure(page):
+    """Capture bundle of the failing page, before the script is stopped"""
+    if page is None:
+        return False
+    try:
+        from script_runtime import save_capture_bundle
+        save_capture_bundle(page)
+        return True
+    except Exception as e:
+        print(f"[WARNING] Failed to save capture bundle of the failing step: {e}")
+        return False
+
+
+def _duration(step, now):
+    if _current["step"] != step or _current["started"] is None:
+        return None
+    return round(now - _current["started"], 3)
+
+
+def track_selectors():
+    """Patch Page so the selector each step acts on is reported with its events"""
+    from playwright.sync_api import Page
+
+    if getattr(Page, "_tessara_selectors", False):
+        return
+
+    def remember(name, original, describe):
+        def method(self, *args, **kwargs):
+            if _current["step"] is not None:
+                _current["selector"] = describe(name, args, kwargs)
+            return original(self, *args, **kwargs)
+        method.__name__ = name
+        return method
+
+    for name in SELECTOR_METHODS:
+        setattr(Page, name, remember(name, getattr(Page, name),
+                                     lambda name, args, kwargs: args[0] if args else kwargs.get("selector")))
+    for name in GET_BY_METHODS:
+        setattr(Page, name, remember(name, getattr(Page, name),
+                                     lambda name, args, kwargs: f"{name}({', '.join(map(repr, args))})"))
+    Page._tessara_selectors = True
+
+
+# ---------------------------------------------------------------- pipeline side
+
+class StepEventListener:
+    """
+    Local socket that collects a script's step events as they arrive. on_event(event) is called
+    from the listener thread for every event. Use as a context manager around one script run.
+    """
+
+    def __init__(self, on_event=None):
+        self.on_event = on_event
+        self.events = []
+        self._lock = threading.Lock()
+        self._readers = []
+        self._token = secrets.token_hex(16)
+        self._server = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+        self._server.bind(("127.0.0.1", 0))
+        self._server.listen()
+        self._closed = False
+        self._acceptor = threading.Thread(target=self._accept, daemon=True)
+        self._acceptor.start()
+
+    @property
+    def address(self):
+        host, port = self._server.getsockname()
+        return f"{self._token}@{host}:{port}"
+
+    def _accept(self):
+        while not self._closed:
+            try:
+                conn, _ = self._server.accept()
+            except OSError:
+                return
+            reader = threading.Thread(target=self._read, args=(conn,), daemon=True)
+            reader.start()
+            self._readers.append(reader)
+
+    def _read(self, conn):
+        with conn, conn.makefile("r", encoding="utf-8", errors="replace") as lines:
+            if not hmac.compare_digest(lines.readline().strip().encode("utf-8"), self._token.encode("utf-8")):
+                print("[WARNING] Dropped a step event connection without the run's token")
+                return
+            for line in lines:
+                try:
+                    event = json.loads(line)
+                except ValueError:
+                    continue
+                with self._lock:
+                    self.events.append(event)
+                if self.on_event is not None:
+                    try:
+                        self.on_event(event)
+                    except Exception as e:
+                        print(f"[WARNING] Step event handler failed: {e}")
+
+    def close(self, timeout=2.0):
+        """Stop accepting and wait briefly for connections to drain (the script has exited by now)"""
+        self._closed = True
+        try:
+            self._server.close()
+        except OSError:
+            pass
+        deadline = time.time() + timeout
+        for reader in self._readers:
+            reader.join(max(0.0, deadline - time.time()))
+
+    def summary(self):
+        with self._lock:
+            return summarize(list(self.events))
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+
+def summarize(events):
+    """
+    Outcome of a run from its events: per-step status, duration, URL and selector, the last step
+    of the completed prefix, and the first failure with its exception type. None when no event arrived.
+
+    last_successful_step only counts steps 1..N that all succeeded: a script that keeps going after
+    a failed step can report later steps as succeeded, but the run did not get past the failure.
+    """
+    if not events:
+        return None
+    steps = {}
+    failed = None
+    for event in events:
+        step = event.get("step")
+        if step is None:
+            continue
+        record = steps.setdefault(step, {"label": "", "status": "started"})
+        if event["event"] == "step_start":
+            record["label"] = event.get("label", "")
+        elif event["event"] in ("step_end", "step_error"):
+            record.update(status="succeeded" if event["event"] == "step_end" else "failed",
+                          duration=event.get("duration"), url=event.get("url"), selector=event.get("selector"))
+            if event["event"] == "step_error" and (failed is None or step < failed["step"]):
+                failed = {key: event.get(key) for key in ("step", "error_type", "error", "url", "selector")}
+    return {
+        "last_successful_step": completed_prefix(steps, failed["step"] if failed else None),
+        "failed_step": failed["step"] if failed else None,
+        "error": failed,
+        "steps": {str(step): steps[step] for step in sorted(steps)},
+        "events": len(events),
+    }
+
+
+def completed_prefix(steps, failed_step=None):
+    """Highest N such that steps 1..N all succeeded (and N is before failed_step)"""
+    last = 0
+    while steps.get(last + 1, {}).get("status") == "succeeded":
+        last += 1
+    if failed_step is not None:
+        last = min(last, failed_step - 1)
+    return last
+
+
+def print_event(event):
+    """Default live consumer: one line per finished step"""
+    if event.get("event") == "step_end":
+        print(f"[EVENT] Step {event['step']} completed in {event.get('duration')}s ({event.get('url')})")
+    elif event.get("event") == "step_error":
+        print(f"[EVENT] Step {event['step']} failed: {event.get('error_type')}: {event.get('error', '')[:200]}")
@@ -0,0 +1,291 @@
+# step_scripter.py
+"""
+Step-aligned script generation. Instead of one monolithic script per plan, every plan step gets
+its own code fragment, requested in parallel and stored in an on-disk fragment cache keyed by
+sha256 over the step text, the page URL, the steps before it and the step's DOM region (its
+candidate elements in the element index). The assembler wraps each fragment in the usual step-tracking block, so the
+runnable script keeps the "Executing Step N -" markers the rest of the pipeline relies on, and
+records which fragment produced which lines.
+
+All fragments of one plan are generated from the same capture, so they never wait on each
+other. The capture is of the page the plan starts on: a step that runs after a navigation gets
+candidates from that start page, which may not contain its element. Its key still changes with
+the steps before it (the way the script gets to its page), and a failed or rejected run evicts
+the fragment, so a retry regenerates it. A fragment that cannot be parsed is requested once more;
+when it fails again, generate() raises FragmentError and the pipeline falls back to the
+monolithic scripter. After a run, only the fragments of failed steps are evicted: on a retry with the same page,
+every other step is served from the cache and only the failing fragment is regenerated. A run
+whose steps all passed but that the answering LLM rejects evicts every fragment of its script, so
+the retry cannot assemble the same script again.
+"""
+import ast, hashlib, json, os, re, textwrap, time
+from concurrent.futures import ThreadPoolExecutor
+from utils import log_interaction, log_token_usage
+from llm_gateway import load_prompt, chat_completion
+from dom_compact import format_element_line
+import run_metrics
+
+DEFAULT_STEP_SCRIPTER_CONFIG = {
+    "enabled": False,
+    "dir": "../responses/fragment_cache",
+    "max_workers": 4,       # Fragment requests in flight
+    "top_k": 5,             # Candidate elements per step (the step's DOM region)
+}
+
+FRAGMENT_REQUEST = {"model": "gpt-4o", "temperature": 0.1, "max_tokens": 1500}
+
+STEP_FAILED = re.compile(r"\[ERROR\] Step (\d+) failed")
+FORBIDDEN_IN_FRAGMENT = ("sync_playwright", ".launch(", "new_page(", "browser.close(", "context.close(")
+
+SCRIPT_HEADER = '''from playwright.sync_api import sync_playwright
+import time
+import json
+import os
+from script_runtime import save_capture_bundle
+from page_settle import wait_for_page_settle
+from checkpoints import save_checkpoint
+from step_events import step_started, step_succeeded, step_failed
+
+success_status = True
+start_time = time.time()
+last_executed_step = 0  # Track last successful step for backtracking
+step_urls = {{}}  # Track URLs at each step for backtracking
+problem_id = {problem_id!r}
+
+with sync_playwright() as p:
+    browser = p.chromium.launch(headless=False, channel="chrome")
+    # Use larger viewport to ensure full page visibility
+    context = browser.new_context(viewport={{"width": 2560, "height": 1440}})
+    page = context.new_page()
+    start_url = {start_url!r}
+
+    try:
+        page.goto(start_url, wait_until="domcontentloaded", timeout=60000)
+        page.wait_for_load_state("load", timeout=10000)
+    except Exception as e:
+        print(f'Page load warning: {{e}}')
+    wait_for_page_settle(page)
+'''
+
+STEP_BLOCK = '''
+    # --- Step {number} | fragment {key} ---
+    if success_status:
+        try:
+            print({marker!r})
+            step_started({number}, {label!r})
+            last_executed_step = {number}
+{code}
+            step_urls[{number}] = page.url
+            save_checkpoint(page, {number})
+            step_succeeded({number}, page)
+            print(f"[SUCCESS] Step {number} completed. URL: {{page.url}}")
+        except Exception as e:
+            step_failed({number}, e, page)
+            print(f"[ERROR] Step {number} failed: {{e}}")
+            success_status = False
+'''
+
+SCRIPT_FOOTER = '''
+    if not success_status:
+        print("Task Status: Failed")
+    try:
+        save_capture_bundle(page)
+    except Exception as e:
+        print(f"[WARNING] Failed to save capture bundle: {e}")
+
+    state_file = f"../responses/{problem_id}_state.json"
+    state = {
+        "last_successful_step": max(step_urls, default=0),
+        "step_urls": step_urls,
+        "recovery_url": page.url
+    }
+    with open(state_file, "w") as f:
+        json.dump(state, f, indent=2)
+
+    context.close()
+    browser.close()
+'''
+
+
+def step_text(step):
+    """Step text without its number, so a step that moves within the plan keeps its fragment"""
+    return f"{step['action_label']} - {step['element_type']} - {step['action']}"
+
+
+def dom_region(step, element_index, k):
+    """The step's candidate elements, one compact line each (what the fragment is written against)"""
+    return "\n".join(format_element_line(record, record["count"]) for record in element_index.query(step, k))
+
+
+class FragmentError(Exception):
+    """A step's fragment could not be generated"""
+
+
+def fragment_key(step, page_url, region, previous_steps=()):
+    payload = json.dumps([step_text(step), page_url, region, [step_text(s) for s in previous_steps]],
+                         ensure_ascii=False)
+    return hashlib.sha256(payload.encode("utf-8")).hexdigest()
+
+
+def extract_fragment(response_text):
+    """Code of one step: fences removed, dedented, checked to parse and to stay within one step"""
+    code = response_text.strip()
+    block = re.search(r"```(?:python)?\s*\n(.*?)\n```", code, re.DOTALL)
+    if block:
+        code = block.group(1)
+    code = textwrap.dedent(code).strip()
+    if not code:
+        raise ValueError("Empty fragment")
+    ast.parse(code)  # SyntaxError propagates
+    for forbidden in FORBIDDEN_IN_FRAGMENT:
+        if forbidden in code:
+            raise ValueError(f"Fragment manages the browser itself ({forbidden})")
+    return code
+
+
+class FragmentCache:
+    """One JSON file per fragment key under conf['dir']"""
+
+    def __init__(self, directory):
+        self.dir = directory
+
+    def _path(self, key):
+        return os.path.join(self.dir, key[:2], key + ".json")
+
+    def get(self, key):
+        try:
+            with open(self._path(key), "r", encoding="utf-8") as f:
+                return json.load(f)
+        except (OSError, ValueError):
+            return None
+
+    def put(self, key, entry):
+        path = self._path(key)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        tmp_path = f"{path}.{os.getpid()}.tmp"
+        with open(tmp_path, "w", encoding="utf-8") as f:
+            json.dump(entry, f, indent=2)
+        os.replace(tmp_path, path)
+
+    def invalidate(self, key):
+        try:
+            os.remove(self._path(key))
+            return True
+        except OSError:
+            return False
+
+
+class StepScripter:
+    """Per-problem step-aligned scripter: generate() per iteration, record_run() after each script run"""
+
+    def __init__(self, conf=None):
+        self.conf = dict(DEFAULT_STEP_SCRIPTER_CONFIG)
+        self.conf.update(conf or {})
+        self.cache = FragmentCache(self.conf["dir"])
+        self.provenance = {}   # step_number -> fragment key, source and script lines of the last assembly
+
+    def generate(self, plan_steps, element_index, page_url, start_url, scripter_conf, problem_id):
+        """Runnable script for the plan: cached fragments plus fresh ones for the other steps"""
+        start_time = time.time()
+        self.provenance = {}
+        regions = [dom_region(step, element_index, self.conf["top_k"]) for step in plan_steps]
+        keys = [fragment_key(step, page_url, region, plan_steps[:i])
+                for i, (step, region) in enumerate(zip(plan_steps, regions))]
+        fragments = [self.cache.get(key) for key in keys]
+        missing = [i for i, entry in enumerate(fragments) if entry is None]
+        run_metrics.incr("fragments.hits", len(plan_steps) - len(missing))
+        run_metrics.incr("fragments.misses", len(missing))
+
+        def fresh(i):
+            code = self._generate_fragment_with_retry(plan_steps, i, regions[i], start_url, scripter_conf, problem_id)
+            entry = {"key": keys[i], "step": step_text(plan_steps[i]), "page_url": page_url,
+                     "code": code, "created_at": time.time()}
+            self.cache.put(keys[i], entry)
+            return i, entry
+
+        if missing:
+            with ThreadPoolExecutor(max_workers=self.conf["max_workers"]) as pool:
+                for i, entry in pool.map(fresh, missing):
+                    fragments[i] = entry
+
+        script_code = self.assemble(plan_steps, fragments, start_url, problem_id, fresh_steps=set(missing))
+        print(f"[INFO] Step scripter: {len(plan_steps) - len(missing)} cached / {len(missing)} generated "
+              f"fragments in {round(time.time() - start_time, 2)}s")
+        log_interaction(problem_id, "script_provenance", self.provenance)
+        return script_code
+
+    def _generate_fragment_with_retry(self, plan_steps, i, region, start_url, scripter_conf, problem_id):
+        """A fragment that does not parse or manages the browser itself is requested once more"""
+        try:
+            return self._generate_fragment(plan_steps, i, region, start_url, scripter_conf, problem_id)
+        except (ValueError, SyntaxError) as e:
+            print(f"[WARNING] Fragment for step {i + 1} rejected ({e}); requesting it again")
+            run_metrics.incr("fragments.retries")
+        try:
+            return self._generate_fragment(plan_steps, i, region, start_url, scripter_conf, problem_id)
+        except (ValueError, SyntaxError) as e:
+            raise FragmentError(f"step {i + 1}: {e}") from e
+
+    def _generate_fragment(self, plan_steps, i, region, start_url, scripter_conf, problem_id):
+        step = plan_steps[i]
+        previous = "\n".join(f"Step {j + 1} - {step_text(s)}" for j, s in enumerate(plan_steps[:i])) or "(none)"
+        user_prompt_text = (f"Start URL: {start_url}\n\nSteps already executed before this one:\n{previous}\n\n"
+                            f"Step to implement:\nStep {i + 1} - {step_text(step)}\n\n"
+                            f"Candidate elements for this step:\n{region or '(no matching element found on the captured page)'}")
+        messages = [
+            {"role": "system", "content": load_prompt("step_fragment_instructions.txt")},
+            {"role": "user", "content": user_prompt_text},
+        ]
+        log_interaction(problem_id, "fragment_prompt", messages)
+        response = chat_completion("fragment", scripter_conf, messages=messages, **FRAGMENT_REQUEST)
+        log_token_usage(response, problem_id, "generate_fragment")
+        code = extract_fragment(response.choices[0].message.content)
+        log_interaction(problem_id, "fragment_response", {"step": i + 1, "code": code})
+        return code
+
+    def assemble(self, plan_steps, fragments, start_url, problem_id, fresh_steps=()):
+        """Script with one tracked block per fragment; fills self.provenance with exact line ranges"""
+        parts = [SCRIPT_HEADER.format(problem_id=problem_id, start_url=start_url)]
+        line = parts[0].count("\n") + 1
+        self.provenance = {}
+        for i, (step, entry) in enumerate(zip(plan_steps, fragments)):
+            number = i + 1
+            block = STEP_BLOCK.format(number=number, key=entry["key"][:12],
+                                      marker=f"Executing Step {number} - {step['action_label']}", label=step['action_label'],
+                                      code=textwrap.indent(entry["code"], " " * 12))
+            self.provenance[number] = {"key": entry["key"], "step": step_text(step),
+                                       "source": "generated" if i in fresh_steps else "cache",
+                                       "lines": [line + 1, line + block.count("\n") - 1]}
+            parts.append(block)
+            line += block.count("\n")
+        parts.append(SCRIPT_FOOTER)
+        return "".join(parts)
+
+    def record_run(self, success, events=None, output_text=""):
+        """
+        Evict the fragments of steps that failed, so the next attempt regenerates only those. The
+        failed step comes from the run's step events (step_events.summarize); the printed markers
+        are only used for a script that sent none. A failed run without a failed step (stopped by
+        the watchdog, crashed between steps) evicts the step after its completed prefix.
+        """
+        if events:
+            failed = [events["failed_step"]] if events["failed_step"] is not None else []
+            if not success and not failed:
+                failed = [events["last_successful_step"] + 1]
+        else:
+            failed = sorted({int(n) for n in STEP_FAILED.findall(output_text or "")})
+        for number in failed:
+            self._evict(number, f"Step {number} failed")
+        return failed
+
+    def record_rejected(self):
+        """Every step ran but the answering LLM reported failure: evict all fragments of the script"""
+        for number in sorted(self.provenance):
+            self._evict(number, "Answering LLM rejected the run")
+        return sorted(self.provenance)
+
+    def _evict(self, number, reason):
+        entry = self.provenance.get(number)
+        if entry is not None and self.cache.invalidate(entry["key"]):
+            run_metrics.incr("fragments.invalidated")
+            print(f"[INFO] {reason}; fragment {entry['key'][:12]} of step {number} will be regenerated")
@@ -1,8 +1,15 @@
 # utils.py
 from subprocess import PIPE, Popen
 from bs4 import BeautifulSoup
-import time, yaml, json, os, re
+import time, yaml, json, os, re, threading
 from playwright.sync_api import sync_playwright
+from browser_pool import browser_context
+from process_tracker import get_tracker, spawn_kwargs, reap_run
+from script_runtime import save_capture_bundle, load_capture_bundle
+from page_settle import install_settle_probe, wait_for_page_settle
+from request_routing import apply_route_profile
+from har_archive import apply_har
+from dom_filter import filter_dom
 
 def sanitize_content_for_logging(content):
     """Recursively remove image_url fields from content to avoid saving large base64 images"""
@@ -13,6 +20,9 @@ def sanitize_content_for_logging(content):
     else:
         return content
 
+# Speculative candidates and the asyncio pipeline log from several threads
+_log_lock = threading.Lock()
+
 def log_interaction(problem_id, stage, content, log_file=None):
     log_file = f"../responses/{problem_id}_responses.json"
     # Remove image_url from content before logging
@@ -24,16 +34,17 @@ def log_interaction(problem_id, stage, content, log_file=None):
         "content": sanitized_content
     }
 
-    if os.path.exists(log_file):
-        with open(log_file, "r") as f:
-            logs = json.load(f)
-    else:
-        logs = []
+    with _log_lock:
+        if os.path.exists(log_file):
+            with open(log_file, "r") as f:
+                logs = json.load(f)
+        else:
+            logs = []
 
-    logs.append(log_entry)
+        logs.append(log_entry)
 
-    with open(log_file, "w") as f:
-        json.dump(logs, f, indent=2)
+        with open(log_file, "w") as f:
+            json.dump(logs, f, indent=2)
 
 def load_config(path="../config.yaml"):
     with open(path, "r") as file:
@@ -41,21 +52,14 @@ def load_config(path="../config.yaml"):
     #print("🤬 utils load_config()")
 
 def get_dom_tree(url):
-    with sync_playwright() as p:
-        browser = p.chromium.launch(headless=True, channel="chrome")
-        # Use larger viewport to ensure full page content is loaded
-        context = browser.new_context(viewport={"width": 2560, "height": 1440})
+    # Use larger viewport to ensure full page content is loaded
+    with browser_context(viewport={"width": 2560, "height": 1440}) as context:
+        install_settle_probe(context)
         page = context.new_page()
         page.goto(url, wait_until="domcontentloaded", timeout=60000)
-        try:
-            page.wait_for_load_state("networkidle", timeout=30000)
-        except:
-            pass
-        time.sleep(2)
+        wait_for_page_settle(page)
         
         html = page.content()
-        context.close()
-        browser.close()
     
     soup = BeautifulSoup(html, 'html.parser')
     return soup
@@ -95,28 +99,33 @@ def get_dom_tree(url):
 from bs4 import BeautifulSoup
 import time
 
-def get_screenshot(url, output_path, profile_path=None):
-    """Get screenshot and DOM tree using Playwright"""
-    with sync_playwright() as p:
-        # Use Chrome for better compatibility
-        # Use larger viewport to ensure full page visibility
-        browser = p.chromium.launch(headless=True, channel="chrome")
-        context = browser.new_context(viewport={"width": 2560, "height": 1440})
+def capture_page(url, output_path, profile_path=None, storage_state=None):
+    """
+    Navigate once and capture screenshot, serialized DOM, final URL, viewport and timing
+    together. The bundle is also written next to the screenshot (see script_runtime).
+    storage_state restores cookies/local storage saved by an earlier run (suffix recovery).
+    """
+    timing = {}
+    start_time = time.time()
+    # Warm Chrome from the browser pool; each capture gets its own fresh context
+    # Use larger viewport to ensure full page visibility
+    context_kwargs = {"storage_state": storage_state} if storage_state else {}
+    with browser_context(viewport={"width": 2560, "height": 1440}, **context_kwargs) as context:
+        install_settle_probe(context)
+        # Same HAR archive and routing profile the generated scripts run with (HAR must come first)
+        har_state = apply_har(context)
+        route_profile = apply_route_profile(context, offline=har_state is not None)
         page = context.new_page()
         
         try:
             # Navigate to URL
             page.goto(url, wait_until="domcontentloaded", timeout=60000)
             page.wait_for_load_state("load", timeout=10000)
+            timing["navigation"] = round(time.time() - start_time, 3)
             
-            # Wait for networkidle with timeout
-            try:
-                page.wait_for_load_state("networkidle", timeout=30000)
-            except:
-                pass  # Continue if networkidle times out
-            
-            # Small buffer delay for lazy-loaded content
-            time.sleep(2)
+            # Wait until DOM, layout and in-page requests are quiet (see page_settle.py)
+            settle = wait_for_page_settle(page)
+            timing["settle"] = settle["elapsed"]
             
             # Get the actual page dimensions to ensure we capture everything
             scroll_height = page.evaluate("""
@@ -150,33 +159,31 @@ def get_screenshot(url, output_path, profile_path=None):
             viewport_height = min(viewport_height, 2880)
             page.set_viewport_size({"width": viewport_width, "height": viewport_height})
             
-            # Take full-page screenshot
-            page.screenshot(path=output_path, full_page=True)
-            
-            # Get HTML content
-            html = page.content()
-            soup = BeautifulSoup(html, "html.parser")
+            # Take full-page screenshot and DOM from the same page state
+            bundle = save_capture_bundle(page, prefix=os.path.splitext(output_path)[0], full_page=True,
+                                         timing=timing, extra={"settle": settle,
+                                                               "route_profile": route_profile.get("name", "custom"),
+                                                               "har": har_state})
+            bundle["timing"]["total"] = round(time.time() - start_time, 3)
             
         finally:
-            context.close()
-            browser.close()
+            page.close()
     
-    return soup, output_path
+    return bundle
+
+def get_screenshot(url, output_path, profile_path=None):
+    """Get screenshot and DOM tree using Playwright"""
+    bundle = capture_page(url, output_path, profile_path)
+    soup = BeautifulSoup(bundle["html"], "html.parser")
+    return soup, bundle["screenshot_path"]
 
 
 def filter_dom_by_whitelist(dom_tree, whitelist):
-    filtered_elements = []
-    for tag in dom_tree.find_all(True):
-        for item in whitelist:
-            item_lower = item.lower()
-            if item_lower == "button" and tag.name == "button":
-                filtered_elements.append(tag)
-            elif item_lower == "text box" and tag.name == "input":
-                if tag.get("type") in ["text", "search", None]:
-                    filtered_elements.append(tag)
-            elif item_lower == "link" and tag.name == "a":
-                filtered_elements.append(tag)
-    return "\n".join(str(el) for el in filtered_elements)
+    """
+    Outer HTML of the whitelisted elements, one per line. dom_tree may be the raw HTML
+    string (preferred: parsed in one streaming pass) or an already-parsed BeautifulSoup tree.
+    """
+    return filter_dom(dom_tree, whitelist)
 
 def save_script_to_file(script_text, path="generated_script.py"):
     with open(path, "w") as f:
@@ -191,7 +198,9 @@ try:
 finally:
     try:
         current_url = page.url
-        page.screenshot(path="../responses/last_update.png", full_page=True)
+        # Screenshot + DOM + URL bundle so the next iteration does not navigate again
+        from script_runtime import save_capture_bundle
+        save_capture_bundle(page)
         
         # Save state to JSON file (replaces individual text files)
         problem_id_placeholder = "REPLACE_PROBLEM_ID"  # This should be replaced by scripter
@@ -251,7 +260,15 @@ def load_state(problem_id):
         "recovery_url": None
     }
 
-def save_state(problem_id, last_successful_step=None, step_urls=None, recovery_url=None):
+def reset_state(problem_id):
+    """Forget the previous run's progress before a script runs (the recovery URL is kept)"""
+    state = load_state(problem_id)
+    state.update({"last_successful_step": 0, "step_urls": {}})
+    state.pop("step_events", None)
+    with open(get_state_file_path(problem_id), "w") as f:
+        json.dump(state, f, indent=2)
+
+def save_state(problem_id, last_successful_step=None, step_urls=None, recovery_url=None, step_events=None):
     """Save state to JSON file, updating only provided fields"""
     state_file = get_state_file_path(problem_id)
     state = load_state(problem_id)
@@ -262,6 +279,8 @@ def save_state(problem_id, last_successful_step=None, step_urls=None, recovery_u
         state["step_urls"].update(step_urls)
     if recovery_url is not None:
         state["recovery_url"] = recovery_url
+    if step_events is not None:
+        state["step_events"] = step_events
     
     with open(state_file, "w") as f:
         json.dump(state, f, indent=2)
@@ -343,8 +362,10 @@ def final_save_and_run(plan_steps, script_code, problem_id):
         f.write(script_code)
 
     save_script_to_file(script_code, path="../responses/final_script.py")
-    proc = Popen(["python", "../responses/final_script.py"], stdout=PIPE, stderr=PIPE)
+    proc = Popen(["python", "../responses/final_script.py"], stdout=PIPE, stderr=PIPE, **spawn_kwargs())
+    get_tracker(problem_id).track(proc, "final_script")
     stdout, stderr = proc.communicate()
+    reap_run(problem_id)
     print(stdout.decode('utf-8'), stderr.decode('utf-8'))
 
 